@@ -1,5 +1,3 @@
-import logging
-
 from flask import Flask
 
 from app.config import Config
@@ -17,13 +15,58 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
-    app.logger.setLevel(logging.DEBUG)
+    from app.services.log import configure_logging
+    configure_logging(app)
+
     db.init_app(app)
+
+    from app.services.metrics import metrics
+    metrics.init_app(app)
+
+    from app.services.replica import replica_router
+    replica_router.init_app(app)
+
+    from app.services.barcode_gen import allocator
+    allocator.init_app(app)
+
+    from app.services.dimension_cache import dimension_cache
+    dimension_cache.init_app(app)
+
+    from app.services.response_cache import response_cache
+    response_cache.init_app(app)
+
+    from app.services.similarity import similarity_index
+    similarity_index.init_app(app)
+
+    from app.services.range_index import range_index
+    range_index.init_app(app)
+
+    from app.services.ingest import ingest_queue
+    ingest_queue.init_app(app)
+
+    from app.services.idempotency import idempotency_store
+    idempotency_store.init_app(app)
+
+    from app.services.change_feed import change_feed
+    change_feed.init_app(app)
+
+    from app.services.blob_store import blob_store
+    blob_store.init_app(app)
+
+    from app.services.photos import thumbnails
+    thumbnails.init_app(app)
+
+    from app.services.compaction import compaction_job
+    compaction_job.init_app(app)
+
     api = Api(app, title="BatteryHub API", version="0.0.1")
 
     from app.api.endpoints import bp as api_bp
     app.register_blueprint(api_bp)
 
+    from app.cli import batteryhub
+    app.cli.add_command(batteryhub)
+
     return app
 
 
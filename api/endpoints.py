@@ -1,20 +1,162 @@
 import json
+from concurrent.futures import TimeoutError
 
-from flask import jsonify, request
+from flask import Response, current_app, jsonify, request, send_file, stream_with_context
 from app.api import bp
+from app.exceptions import (BarcodeSpaceExhaustedError, BlobTooLargeError, IngestQueueFullError,
+                            TooManySubscribersError)
 from app.services.api import APIHandler
+from app.services.barcode_gen import allocator
+from app.services.blob_store import blob_store
+from app.services.change_feed import change_feed
 from app.services.db import Database
+from app.services.export import EXPORT_FORMATS, RecordExporter
+from app.services.idempotency import idempotency_store
+from app.services.ingest import ingest_queue
+from app.services.metrics import metrics
+from app.services.packing import PackMatcher
+from app.services.photos import Photos, thumbnails
+from app.services.range_index import range_index
+from app.services.response_cache import LIST_TAG, barcode_tag, response_cache
+from app.services.serializer import row_encoder
+from app.services.similarity import FEATURES, similarity_index
+from app.services.stats import InventoryStats
+
+
+@bp.errorhandler(BarcodeSpaceExhaustedError)
+def barcode_space_exhausted(ex):
+    return jsonify({'error': str(ex), 'description': 'Barcode space exhausted'}), 503
+
+
+@bp.errorhandler(BlobTooLargeError)
+def blob_too_large(ex):
+    return jsonify({'error': str(ex), 'description': 'Photo too large'}), 413
+
+
+@bp.errorhandler(IngestQueueFullError)
+def ingest_queue_full(ex):
+    response = jsonify({'error': str(ex), 'description': 'Ingest queue full'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+@bp.errorhandler(TooManySubscribersError)
+def too_many_subscribers(ex):
+    response = jsonify({'error': str(ex), 'description': 'Too many subscribers'})
+    response.headers['Retry-After'] = '30'
+    return response, 503
 
 
 @bp.route('/api/records', methods=['POST'])
+@idempotency_store.idempotent
 def add_record():
+    """
+    Add a record.
+
+    With an Idempotency-Key header, a retry of the request returns the first response
+    instead of adding the record again.
+
+    Returns:
+    - JSON object with the barcode of the record
+    """
+    if ingest_queue.enabled:
+        return add_record_async()
+
     data = json.loads(request.get_json())
     result = Database.add_record(data)
 
     if 'error' in result:
         return jsonify(result), 400
 
-    return jsonify({'success': 'Record added successfully.'}), 200
+    return jsonify(result), 200
+
+
+def add_record_async():
+    """
+    Validate a record, assign its barcode and queue it for the group-committing writer.
+
+    Returns:
+    - 202 with the barcode; GET /api/records/<barcode>/status tells when the record is stored
+    """
+    record = APIHandler.records_handler(request)
+    if isinstance(record, str):
+        return jsonify({'error': record}), 400
+
+    try:
+        ingest_queue.submit(record)
+    except IngestQueueFullError:
+        allocator.release(record.barcode)
+        raise
+
+    response = jsonify({'success': 'Record accepted.', 'barcode': record.barcode,
+                        'status_url': f'/api/records/{record.barcode}/status'})
+    response.headers['Location'] = f'/api/records/{record.barcode}/status'
+    return response, 202
+
+
+@bp.route('/api/records/<barcode>/status', methods=['GET'])
+def get_record_status(barcode):
+    """
+    Get whether a record accepted by POST /api/records is stored yet.
+
+    Parameters:
+    - barcode: record barcode
+
+    Returns:
+    - JSON object with the status: 'queued', 'durable' or 'failed' (with the error)
+    """
+    if not barcode.isdigit():
+        return jsonify({'error': 'Barcode must be an integer'}), 400
+
+    status = ingest_queue.lookup(int(barcode))
+    if status is None:
+        return jsonify({'barcode': int(barcode), 'status': 'unknown'}), 404
+    return jsonify(dict(status, barcode=int(barcode))), 200
+
+
+@bp.route('/api/ingest/stats', methods=['GET'])
+def get_ingest_stats():
+    """
+    Get the queue depth and write counters of the write-behind ingest.
+
+    Returns:
+    - JSON object with the ingest metrics of this worker
+    """
+    return jsonify(ingest_queue.stats()), 200
+
+
+@bp.route('/api/records/batch', methods=['POST'])
+@idempotency_store.idempotent
+def add_records_batch():
+    """
+    Add a batch of records in a single transaction.
+
+    The body is a JSON array of records or NDJSON ('application/x-ndjson'). With an
+    Idempotency-Key header, a retry of the request returns the first response.
+
+    Returns:
+    - JSON object with the per-record result and the assigned barcodes
+    """
+    handled = APIHandler.batch_records_handler(request)
+    if isinstance(handled, str):
+        return jsonify({'error': handled}), 400
+
+    valid = [record for record in handled if not isinstance(record, str)]
+    result = Database.add_records_batch(valid) if valid else {'count': 0}
+
+    if 'error' in result:
+        for record in valid:
+            allocator.release(record.barcode)
+        return jsonify(result), 400
+
+    rows = [
+        {'index': index, 'error': record} if isinstance(record, str)
+        else {'index': index, 'barcode': record.barcode}
+        for index, record in enumerate(handled)
+    ]
+    response = {'inserted': result['count'], 'failed': len(handled) - result['count'], 'records': rows}
+
+    return jsonify(response), 200 if valid or not handled else 400
 
 
 @bp.route('/api/records/<barcode>', methods=['PUT'])
@@ -30,29 +172,140 @@ def update_record(barcode):
     return jsonify(response), 200
 
 
+@bp.route('/api/records', methods=['PATCH'])
+def update_records():
+    """
+    Change some fields of many records in a single transaction.
+
+    The body has the new values in 'set' and selects the records with either
+    'barcodes' or 'filter' (the filter arguments of GET /api/records), for example
+    {"filter": {"source": "laptop"}, "set": {"source": "e-bike"}}.
+
+    Returns:
+    - JSON object with the number of updated records
+    """
+    handled = APIHandler.patch_records_handler(request)
+    if isinstance(handled, str):
+        return jsonify({'error': handled}), 400
+
+    result = Database.update_records(handled['values'], barcodes=handled.get('barcodes'),
+                                     conditions=handled.get('conditions'))
+    if 'error' in result:
+        return jsonify(result), 400
+
+    return jsonify(result), 200
+
+
 @bp.route('/api/records', methods=['GET'])
+@response_cache.cached(tags=lambda: [LIST_TAG])
 def get_records():
+    """
+    Get records filtered by the sorting arguments.
+
+    Sorting ('sort_by', 'order_by') happens in the database. With 'limit' or 'cursor'
+    the response is one page with 'next_cursor' and 'prev_cursor' for the neighbouring pages.
+    With 'shape=columns' the records are returned as {"columns": [...], "rows": [[...], ...]}.
+
+    Returns:
+    - JSON list of records, or a JSON object with one page of records
+    """
     args_list = request.args.to_dict()
     args_handler = APIHandler.sorting_args_handler(args_list)
-    db_args = Database.get_records_by_sorting(args_handler)
+    pagination = APIHandler.pagination_args_handler(args_list, Database.read_columns())
 
-    order_by = args_list.get('order_by')
-    sort_by = args_list.get('sort_by')
+    if isinstance(pagination, str):
+        return jsonify({'error': pagination}), 400
 
-    if order_by:
-        if order_by == 'desc':
-            db_args = sorted(db_args, key=lambda x: x.get(sort_by, 0), reverse=True)
-        elif order_by == 'asc':
-            db_args = sorted(db_args, key=lambda x: x.get(sort_by, 0))
-    elif sort_by:
-        db_args = sorted(db_args, key=lambda x: x.get(sort_by, 0))
+    shape = args_list.get('shape') or 'records'
+    if shape not in ('records', 'columns'):
+        return jsonify({'error': "Invalid shape. Expected 'records' or 'columns'"}), 400
 
-    response = db_args
+    if pagination['limit'] is None:
+        rows = range_index.rows(APIHandler.filter_args(args_list),
+                                sort_by=pagination['sort_by'],
+                                order_by=pagination['order_by'])
+        if rows is None:
+            rows = Database.get_rows_by_sorting(args_handler,
+                                                sort_by=pagination['sort_by'],
+                                                order_by=pagination['order_by'])
+        if isinstance(rows, dict):
+            return jsonify(rows), 200
+        return Response(row_encoder.encode(rows, shape) + '\n', mimetype='application/json'), 200
 
-    return jsonify(response), 200
+    try:
+        page = Database.get_rows_page(args_handler, **pagination)
+    except ValueError as ex:
+        return jsonify({'error': str(ex)}), 400
+
+    if 'error' in page:
+        return jsonify(page), 400
+
+    body = row_encoder.encode_page(page['rows'], shape, page['next_cursor'], page['prev_cursor'])
+    return Response(body + '\n', mimetype='application/json'), 200
+
+
+@bp.route('/api/records/barcodes', methods=['GET'])
+@response_cache.cached(tags=lambda: [LIST_TAG])
+def get_record_barcodes():
+    """
+    Get the barcodes of the records matching the filter arguments, in ascending order.
+
+    Answered from the in-process range index when it is enabled and loaded.
+
+    Returns:
+    - JSON object with the barcodes and their count
+    """
+    args_list = request.args.to_dict()
+    barcodes = range_index.barcodes(APIHandler.filter_args(args_list))
+    if barcodes is None:
+        rows = Database.get_field_rows(APIHandler.sorting_args_handler(args_list), ['barcode'])
+        barcodes = sorted(row.barcode for row in rows)
+
+    return jsonify({'count': len(barcodes), 'barcodes': barcodes}), 200
+
+
+@bp.route('/api/records/export', methods=['GET'])
+def export_records():
+    """
+    Stream the filtered inventory as NDJSON or CSV.
+
+    Parameters:
+    - format: 'ndjson' (default) or 'csv'
+    - the filter and sorting arguments of GET /api/records
+
+    The body is gzip-compressed while streaming if the client accepts gzip.
+
+    Returns:
+    - Chunked response with the exported records
+    """
+    args_list = request.args.to_dict()
+    export_format = args_list.get('format') or 'ndjson'
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Invalid format. Expected one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+    args_handler = APIHandler.sorting_args_handler(args_list)
+    pagination = APIHandler.pagination_args_handler(args_list, Database.read_columns())
+    if isinstance(pagination, str):
+        return jsonify({'error': pagination}), 400
+
+    iterate = Database.iter_rows if export_format == 'ndjson' else Database.iter_records
+    records = iterate(args_handler,
+                      sort_by=pagination['sort_by'],
+                      order_by=pagination['order_by'],
+                      batch_size=current_app.config.get('EXPORT_BATCH_SIZE', 1000))
+    compress = 'gzip' in request.accept_encodings
+    body = RecordExporter.export(records, export_format, compress=compress)
+
+    response = Response(stream_with_context(body), mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=records.{export_format}'
+    response.vary.add('Accept-Encoding')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 
 @bp.route('/api/records/<barcode>', methods=['GET'])
+@response_cache.cached(tags=lambda barcode: [barcode_tag(barcode)])
 def get_record(barcode):
     """
     Get a record from the database by barcode.
@@ -88,10 +341,276 @@ def delete_record(barcode: int):
         return jsonify({'error': 'Record not found.'}), 404
 
 
+@bp.route('/api/records', methods=['DELETE'])
+def delete_records():
+    """
+    Delete many records in a single transaction.
+
+    The body selects the records with either 'barcodes' or 'filter' (the filter
+    arguments of GET /api/records), for example {"filter": {"source": "laptop"}}.
+    With "soft": true the records are kept as tombstones until compaction purges them.
+
+    Returns:
+    - JSON object with the number of deleted records
+    """
+    handled = APIHandler.delete_records_handler(request)
+    if isinstance(handled, str):
+        return jsonify({'error': handled}), 400
+
+    result = Database.delete_records(barcodes=handled.get('barcodes'), conditions=handled.get('conditions'),
+                                     soft=handled['soft'])
+    if 'error' in result:
+        return jsonify(result), 400
+
+    return jsonify(result), 200
+
+
+@bp.route('/api/records/<barcode>/photo', methods=['PUT', 'POST'])
+def upload_photo(barcode):
+    """
+    Store the photo of a record.
+
+    The image (JPEG, PNG, WEBP or GIF) is the request body, or the 'photo' file of
+    a multipart form. It is streamed into the blob store; identical images are stored once.
+
+    Parameters:
+    - barcode: record barcode
+
+    Returns:
+    - JSON object with the photo metadata
+    """
+    if not barcode.isdigit():
+        return jsonify({'error': 'Barcode must be an integer'}), 400
+    stream = request.files['photo'].stream if 'photo' in request.files else request.stream
+
+    result = Photos.attach(int(barcode), stream, current_app.config.get('PHOTO_MAX_BYTES', 10 * 1024 * 1024))
+    if 'error' in result:
+        return jsonify(result), 404 if result['description'] == 'Not found' else 400
+    return jsonify(result), 200
+
+
+def send_photo_file(path: str, mimetype: str, etag: str):
+    # Conditional responses answer Range and If-None-Match requests; the file is
+    # sent through wsgi.file_wrapper, which lets the server use sendfile()
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=etag,
+                         max_age=current_app.config.get('PHOTO_MAX_AGE', 86400))
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+@bp.route('/api/records/<barcode>/photo', methods=['GET'])
+def download_photo(barcode):
+    """
+    Download the photo of a record; Range requests are answered with partial content.
+
+    Parameters:
+    - barcode: record barcode
+
+    Returns:
+    - The image
+    """
+    photo = Photos.for_barcode(int(barcode)) if barcode.isdigit() else None
+    if photo is None:
+        return jsonify({'error': 'Photo not found.'}), 404
+    return send_photo_file(blob_store.path(photo.sha256), photo.content_type, photo.sha256)
+
+
+@bp.route('/api/records/<barcode>/photo/thumbnail', methods=['GET'])
+def download_thumbnail(barcode):
+    """
+    Download the JPEG thumbnail of the photo of a record.
+
+    A missing thumbnail is generated by the thumbnail workers first.
+
+    Parameters:
+    - barcode: record barcode
+
+    Returns:
+    - The thumbnail image
+    """
+    photo = Photos.for_barcode(int(barcode)) if barcode.isdigit() else None
+    if photo is None:
+        return jsonify({'error': 'Photo not found.'}), 404
+
+    try:
+        path = thumbnails.submit(photo.sha256).result(timeout=current_app.config.get('THUMBNAIL_TIMEOUT', 10))
+    except TimeoutError:
+        response = jsonify({'error': 'Thumbnail is being generated.'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    except Exception as ex:
+        # Images migrated from the database may not be readable by the thumbnail workers
+        return jsonify({'error': f'Thumbnail can not be generated: {ex}'}), 404
+    return send_photo_file(path, 'image/jpeg', f'{photo.sha256}-{thumbnails.size}')
+
+
+@bp.route('/api/records/stream', methods=['GET'])
+def stream_records():
+    """
+    Stream record changes as Server-Sent Events.
+
+    Every event has the id, the action ('create', 'update' or 'delete') as event type and
+    JSON data with the 'barcodes', the 'time' and, for creates and updates, the 'records'.
+    A 'reset' event means events were missed and the records should be reloaded.
+
+    Parameters:
+    - action: comma-separated actions to send (default: all)
+    - the filters of GET /api/records, applied to the records of creates and updates
+    - last_event_id or the Last-Event-ID header: resume after this event
+
+    Returns:
+    - text/event-stream response that stays open
+    """
+    if not change_feed.enabled:
+        return jsonify({'error': 'Change feed is disabled.'}), 404
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or None
+    subscription = change_feed.subscribe(request.args.to_dict(), last_event_id)
+    if isinstance(subscription, str):
+        return jsonify({'error': subscription}), 400
+
+    response = Response(subscription, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keeps reverse proxies from buffering the events
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @bp.route('/api/records/last', methods=['GET'])
+@response_cache.cached(tags=lambda: [LIST_TAG])
 def get_last_record():
     record = Database.get_records_by_limit(1)
     if record:
         return jsonify(record), 200
     else:
         return jsonify({'error': 'Record not found.'}), 404
+
+
+def similar_records_response(target: dict, k: int, exclude: int | None = None):
+    matches = similarity_index.nearest(target, k=k, exclude=exclude)
+    records = Database.get_records_by_barcodes([barcode for barcode, _ in matches])
+    response = {
+        'target': target,
+        'records': [dict(records[barcode], distance=distance)
+                    for barcode, distance in matches if barcode in records],
+    }
+    return jsonify(response), 200
+
+
+@bp.route('/api/records/similar', methods=['GET'])
+@response_cache.cached(tags=lambda: [LIST_TAG])
+def get_similar_to_values():
+    """
+    Get the k cells closest to the given 'capacity', 'resistance', 'voltage' and 'weight'.
+
+    Values are compared in units of their standard deviation; parameters that are
+    not given are ignored.
+
+    Returns:
+    - JSON object with the target values and the matching records with their distance
+    """
+    similar_args = APIHandler.similar_args_handler(request.args.to_dict())
+    if isinstance(similar_args, str):
+        return jsonify({'error': similar_args}), 400
+
+    return similar_records_response(similar_args['target'], similar_args['k'])
+
+
+@bp.route('/api/records/<barcode>/similar', methods=['GET'])
+@response_cache.cached(tags=lambda barcode: [LIST_TAG])
+def get_similar_to_record(barcode):
+    """
+    Get the k cells closest to the cell with the given barcode.
+
+    Returns:
+    - JSON object with the target values and the matching records with their distance
+    """
+    similar_args = APIHandler.similar_args_handler(request.args.to_dict(), target_required=False)
+    if isinstance(similar_args, str):
+        return jsonify({'error': similar_args}), 400
+
+    record = Database.get_record_by_barcode(barcode)
+    if 'error' in record:
+        return jsonify(record), 404
+
+    target = {feature: record[feature] for feature in FEATURES if isinstance(record[feature], (int, float))}
+    return similar_records_response(target, similar_args['k'], exclude=record['barcode'])
+
+
+@bp.route('/api/stats', methods=['GET'])
+@response_cache.cached(tags=lambda: [LIST_TAG])
+def get_stats():
+    """
+    Get statistics of the records matching the filter arguments.
+
+    'bins' sets the number of histogram bins and 'percentiles' the comma separated
+    percentiles to compute.
+
+    Returns:
+    - JSON object with the record count, the counts per name, color and source, and
+      min/max/mean, percentiles and a histogram of voltage, resistance, capacity and weight
+    """
+    args_list = request.args.to_dict()
+    stats_args = APIHandler.stats_args_handler(args_list)
+    if isinstance(stats_args, str):
+        return jsonify({'error': stats_args}), 400
+
+    conditions = APIHandler.sorting_args_handler(args_list)
+    return jsonify(InventoryStats.compute(conditions, **stats_args)), 200
+
+
+@bp.route('/api/packs/match', methods=['GET'])
+@response_cache.cached(tags=lambda: [LIST_TAG])
+def match_pack():
+    """
+    Build a balanced pack from the cells matching the filter arguments.
+
+    'topology' is the pack layout like '13s4p'. 'selection' is 'uniform' (the cells
+    of the tightest capacity range) or 'capacity' (the highest capacity cells) and
+    'ir_weight' weighs the resistance spread against the capacity spread.
+
+    Returns:
+    - JSON object with the barcodes of every parallel group and the balance statistics
+    """
+    args_list = request.args.to_dict()
+    pack_args = APIHandler.pack_args_handler(args_list)
+    if isinstance(pack_args, str):
+        return jsonify({'error': pack_args}), 400
+
+    conditions = APIHandler.sorting_args_handler(args_list)
+    columns = Database.read_columns()
+    conditions += [columns['capacity'].isnot(None), columns['resistance'] > 0]
+    rows = Database.get_field_rows(conditions, ['barcode', 'capacity', 'resistance'])
+    barcodes, capacity, resistance = zip(*rows) if rows else ((), (), ())
+
+    matcher = PackMatcher(ir_weight=pack_args['ir_weight'],
+                          max_iterations=current_app.config.get('PACK_MAX_ITERATIONS', 5000))
+    try:
+        pack = matcher.match(barcodes, capacity, resistance, pack_args['topology'], pack_args['selection'])
+    except ValueError as ex:
+        return jsonify({'error': str(ex), 'description': 'Not enough cells'}), 422
+
+    pack['candidates'] = len(rows)
+    return jsonify(pack), 200
+
+
+@bp.route('/api/barcodes/stats', methods=['GET'])
+def get_barcode_stats():
+    """
+    Get the occupancy and allocation latency metrics of the barcode allocator.
+
+    Returns:
+    - JSON object with the allocator metrics of this worker
+    """
+    return jsonify(allocator.stats()), 200
+
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Get the request metrics of this worker in the Prometheus text exposition format.
+
+    Returns:
+    - The metrics as text/plain
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
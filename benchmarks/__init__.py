@@ -0,0 +1,9 @@
+"""
+Benchmarks for the BatteryHub API.
+
+The scripts in this package create a throwaway SQLite database and drive the
+application through the Flask test client. Run them from the directory that
+contains the 'app' package, for example:
+
+    python -m app.benchmarks.batch_ingest
+"""
@@ -0,0 +1,75 @@
+"""
+Compare ingest throughput of POST /api/records with POST /api/records/batch.
+
+Usage:
+    python -m app.benchmarks.batch_ingest [--records 2000] [--batch-size 500]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+from app import create_app
+from app.benchmarks.generator import InventoryGenerator
+from app.config import Config
+from app.extensions import db
+
+
+def make_records(count: int) -> list[dict]:
+    return list(InventoryGenerator(random.randrange(1 << 32)).records(count))
+
+
+def create_benchmark_app(path: str):
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def run_single(records: list[dict]) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_benchmark_app(os.path.join(tmp, 'single.db'))
+        client = app.test_client()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for record in records:
+                client.post('/api/records', json=json.dumps(record))
+        return time.perf_counter() - started
+
+
+def run_batch(records: list[dict], batch_size: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_benchmark_app(os.path.join(tmp, 'batch.db'))
+        client = app.test_client()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for start in range(0, len(records), batch_size):
+                client.post('/api/records/batch', json=records[start:start + batch_size])
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    single = run_single(records)
+    batch = run_batch(records, args.batch_size)
+
+    print(f'single-record path: {single:.2f}s, {len(records) / single:.0f} rows/s')
+    print(f'batch path:         {batch:.2f}s, {len(records) / batch:.0f} rows/s')
+    print(f'speedup:            {single / batch:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
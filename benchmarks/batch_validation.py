@@ -0,0 +1,150 @@
+"""
+Check the columnar batch validator against APIData and compare their speed.
+
+The check converts randomly generated records, including missing keys, wrong
+types, out of range values and malformed datetimes, both one by one with
+APIHandler.record_to_api_data and as a batch with APIHandler.records_to_api_data,
+and fails on the first record with a different result.
+
+Usage:
+    python -m app.benchmarks.batch_validation [--cases 200000] [--rows 10000] [--repeat 10]
+"""
+
+import argparse
+import gc
+import random
+import statistics
+import time
+
+from app.benchmarks.generator import InventoryGenerator
+from app.services.api import APIHandler
+from app.validator.records_model import APIData
+
+CURRENT_DATETIME = '2024-05-01 12:00:00'
+
+_MISSING = object()
+
+STRINGS = ['', 'a', 'ab', 'LG', 'Samsung', '0123456789', '01234567890', 'x' * 20, 'x' * 21,
+           'x' * 50, 'x' * 51, 'ünïcødé', ' ', '3.5', 'nan']
+NUMBERS = [0, 1, -1, 3, 3.7, 4.5, 4.5000001, 5, 999.99, 999.991, 1000, -0.0, -0.5, 0.5, 2999.9,
+           1e308, 2 ** 53 + 1, 2 ** 70, 10 ** 400, float('nan'), float('inf'), float('-inf')]
+NUMERIC_STRINGS = ['3.5', ' 42 ', '1_000', '1e3', 'nan', 'inf', '-0', '', 'abc', '0x10']
+OTHERS = [None, True, False, [], [1], {}, {'a': 1}]
+DATETIMES = [CURRENT_DATETIME, '2024-1-5 3:4:5', '2024-02-29 23:59:59', '2023-02-29 00:00:00',
+             '2024-01-01 24:00:00', '2024-01-01  00:00:00', '2024-01-01 00:00:00 ', '2024-01-01',
+             '2024-01-01T00:00:00', '', 5, None, ['2024-01-01 00:00:00']]
+BARCODES = [100000, 999999, 123456, 99999, 1000000, -12345, -1234, 0]
+
+
+def random_value(rng: random.Random, valid):
+    kind = rng.random()
+    if kind < 0.55:
+        return valid
+    if kind < 0.6:
+        return _MISSING
+    if kind < 0.75:
+        return rng.choice(STRINGS)
+    if kind < 0.88:
+        return rng.choice(NUMBERS)
+    if kind < 0.94:
+        return rng.choice(NUMERIC_STRINGS)
+    return rng.choice(OTHERS)
+
+
+def random_cases(count: int, seed: int = 0) -> tuple[list, list, list]:
+    rng = random.Random(seed)
+    generator = InventoryGenerator(seed)
+    records, barcodes, datetimes = [], [], []
+    for valid in generator.records(count):
+        if rng.random() < 0.02:
+            records.append(rng.choice(OTHERS[:1] + OTHERS[3:] + STRINGS[:2] + NUMBERS[:2]))
+        else:
+            record = {}
+            # Every field is corrupted in about one of three records
+            corrupt = rng.random() < 0.3
+            for field, value in valid.items():
+                value = random_value(rng, value) if corrupt else value
+                if value is not _MISSING:
+                    record[field] = value
+            if rng.random() < 0.05:
+                record['extra'] = rng.choice(OTHERS)
+            records.append(record)
+        barcodes.append(rng.choice(BARCODES) if rng.random() < 0.05 else rng.randint(100000, 999999))
+        datetimes.append(rng.choice(DATETIMES) if rng.random() < 0.1 else CURRENT_DATETIME)
+    return records, barcodes, datetimes
+
+
+def one_by_one(records: list, barcodes: list, datetimes: list) -> list:
+    results = []
+    for record, barcode, record_datetime in zip(records, barcodes, datetimes):
+        try:
+            results.append(APIHandler.record_to_api_data(record, barcode, record_datetime))
+        except Exception as ex:
+            results.append(APIHandler.record_error(ex))
+    return results
+
+
+def same_result(expected, actual) -> bool:
+    if isinstance(expected, APIData):
+        # repr() compares NaN values as equal and tells -0.0 from 0.0
+        return type(actual) is APIData and repr(expected.dict()) == repr(actual.dict())
+    return expected == actual
+
+
+def check(cases: int, chunk_size: int = 1000) -> int:
+    records, barcodes, datetimes = random_cases(cases)
+    valid = 0
+    for start in range(0, cases, chunk_size):
+        window = slice(start, start + chunk_size)
+        expected = one_by_one(records[window], barcodes[window], datetimes[window])
+        actual = APIHandler.records_to_api_data(records[window], barcodes[window], datetimes[window])
+        for offset, (left, right) in enumerate(zip(expected, actual)):
+            if not same_result(left, right):
+                index = start + offset
+                raise AssertionError(f'Results differ for {records[index]!r}, barcode {barcodes[index]}, '
+                                     f'datetime {datetimes[index]!r}:\n  APIData: {left!r}\n  batch:   {right!r}')
+            valid += isinstance(left, APIData)
+    return valid
+
+
+def measure(validate, repeat: int) -> list[float]:
+    # Like timeit, without garbage collection passes triggered by earlier runs
+    timings = []
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            validate()
+            timings.append((time.perf_counter() - started) * 1000)
+            gc.collect()
+    finally:
+        gc.enable()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', type=int, default=200000, help='Random records compared with APIData.')
+    parser.add_argument('--rows', type=int, default=10000, help='Records of the timed batch.')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    valid = check(args.cases)
+    print(f'{args.cases} random records validated identically, {valid} of them valid')
+
+    # A realistic batch: generated records with one in fifty out of range
+    records = list(InventoryGenerator(1).records(args.rows))
+    for record in records[::50]:
+        record['voltage'] = 9.9
+    barcodes = list(range(100000, 100000 + args.rows))
+    datetimes = [CURRENT_DATETIME] * args.rows
+
+    baseline = statistics.median(measure(lambda: one_by_one(records, barcodes, datetimes), args.repeat))
+    batch = statistics.median(measure(lambda: APIHandler.records_to_api_data(records, barcodes, datetimes),
+                                      args.repeat))
+    print(f'{"record_to_api_data":<22} median {baseline:8.2f} ms for {args.rows} records')
+    print(f'{"records_to_api_data":<22} median {batch:8.2f} ms for {args.rows} records ({baseline / batch:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
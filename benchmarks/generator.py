@@ -0,0 +1,137 @@
+"""
+Synthetic battery inventory for benchmarks.
+
+The generator produces cell records shaped like the ones collected from
+recycled packs: a few dominant manufacturers, wrappers in a handful of
+colors, mostly healthy voltages with a tail of deeply discharged cells and
+a long tail of high internal resistance. All values pass the APIData
+validators.
+
+Usage:
+    python -m app.benchmarks.generator --rows 100000 --database inventory.db
+"""
+
+import argparse
+import contextlib
+import io
+import random
+import time
+from typing import Iterator
+
+NAMES = {'Samsung': 24, 'LG': 20, 'Sony': 12, 'Panasonic': 12, 'Molicel': 6, 'Sanyo': 6,
+         'BAK': 5, 'Lishen': 5, 'EVE': 4, 'DLG': 3, 'Unknown': 3}
+COLORS = {'blue': 22, 'green': 16, 'red': 14, 'pink': 12, 'black': 10, 'white': 8,
+          'purple': 6, 'orange': 6, 'yellow': 4, 'grey': 2}
+SOURCES = {'laptop': 45, 'e-bike': 15, 'power tool': 15, 'vape': 10, 'flashlight': 5,
+           'scooter': 5, 'unknown': 5}
+
+# The barcode space of BarcodeAllocator: six digit barcodes
+BARCODE_SPACE = 900000
+
+# Row count presets of the benchmark suite. The largest one fills the barcode
+# space except for room for the write scenarios.
+SIZES = {'10k': 10000, '100k': 100000, 'max': BARCODE_SPACE - 10000}
+
+
+class InventoryGenerator:
+    """
+    Deterministic generator of synthetic cell records.
+
+    Attributes:
+        seed (int): The seed of the random number generator.
+    """
+
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        self.random = random.Random(seed)
+        self._names = (list(NAMES), list(NAMES.values()))
+        self._colors = (list(COLORS), list(COLORS.values()))
+        self._sources = (list(SOURCES), list(SOURCES.values()))
+
+    def voltage(self) -> float:
+        # About one cell in ten comes out of a pack deeply discharged
+        if self.random.random() < 0.1:
+            value = self.random.uniform(0.0, 2.5)
+        else:
+            value = self.random.gauss(3.7, 0.25)
+        return round(min(max(value, 0.0), 4.2), 2)
+
+    def resistance(self) -> float:
+        value = self.random.lognormvariate(3.6, 0.45)
+        return round(min(max(value, 0.01), 999.99), 2)
+
+    def capacity(self, voltage: float) -> int:
+        value = self.random.gauss(2400 if voltage > 2.5 else 1500, 450)
+        return int(min(max(value, 200), 3600))
+
+    def weight(self) -> float:
+        return round(self.random.gauss(0.046, 0.0015), 3)
+
+    def record(self) -> dict:
+        """
+        One record in the format of POST /api/records.
+        """
+        voltage = self.voltage()
+        return {'name': self.random.choices(*self._names)[0],
+                'color': self.random.choices(*self._colors)[0],
+                'voltage': voltage,
+                'resistance': self.resistance(),
+                'capacity': self.capacity(voltage),
+                'weight': self.weight(),
+                'source': self.random.choices(*self._sources)[0]}
+
+    def records(self, count: int) -> Iterator[dict]:
+        for _ in range(count):
+            yield self.record()
+
+
+def load(client, count: int, chunk_size: int = 5000, seed: int = 0) -> list[int]:
+    """
+    Load synthetic records through POST /api/records/batch.
+
+    Args:
+        client: A Flask test client.
+        count (int): The number of records to load.
+        chunk_size (int): The number of records per request.
+        seed (int): The seed of the generator.
+
+    Returns:
+        list[int]: The barcodes of the loaded records.
+
+    Raises:
+        ValueError: If the records do not fit into the barcode space.
+    """
+    if count > BARCODE_SPACE:
+        raise ValueError(f'At most {BARCODE_SPACE} records fit into the six digit barcode space')
+
+    generator = InventoryGenerator(seed)
+    barcodes = []
+    while len(barcodes) < count:
+        chunk = list(generator.records(min(chunk_size, count - len(barcodes))))
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = client.post('/api/records/batch', json=chunk)
+        if response.status_code not in (200, 201):
+            raise RuntimeError(f'Loading failed with {response.status_code}: {response.get_data(as_text=True)}')
+        barcodes += [row['barcode'] for row in response.json['records'] if 'barcode' in row]
+    return barcodes
+
+
+def main():
+    from app.benchmarks.batch_ingest import create_benchmark_app
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='10k', help=f'a row count or one of {", ".join(SIZES)}')
+    parser.add_argument('--database', required=True, help='the SQLite file to load')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    count = SIZES.get(args.rows) or int(args.rows)
+    app = create_benchmark_app(args.database)
+    started = time.perf_counter()
+    load(app.test_client(), count, seed=args.seed)
+    elapsed = time.perf_counter() - started
+    print(f'loaded {count} records in {elapsed:.1f}s, {count / elapsed:.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
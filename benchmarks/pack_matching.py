@@ -0,0 +1,38 @@
+"""
+Time PackMatcher on synthetic candidates.
+
+Usage:
+    python -m app.benchmarks.pack_matching [--candidates 50000] [--topology 13s4p --topology 20s10p]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from app.benchmarks.generator import InventoryGenerator
+from app.services.packing import SELECTIONS, PackMatcher, parse_topology
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--candidates', type=int, default=50000)
+    parser.add_argument('--topology', action='append')
+    args = parser.parse_args()
+
+    records = list(InventoryGenerator().records(args.candidates))
+    barcodes = np.arange(100000, 100000 + len(records))
+    capacity = np.array([record['capacity'] for record in records], dtype=np.float64)
+    resistance = np.array([record['resistance'] for record in records], dtype=np.float64)
+
+    for topology in args.topology or ['13s4p', '14s5p', '20s10p', '100s20p']:
+        for selection in SELECTIONS:
+            started = time.perf_counter()
+            stats = PackMatcher().match(barcodes, capacity, resistance, parse_topology(topology), selection)['stats']
+            elapsed = time.perf_counter() - started
+            print(f'{topology:<8} {selection:<9} {elapsed:6.2f}s  capacity spread {stats["capacity_spread_pct"]:6.3f}%  '
+                  f'IR spread {stats["resistance_spread_pct"]:6.3f}%  swaps {stats["swaps"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare read latency of the normalized join with the 'battery_flat' read table.
+
+Usage:
+    python -m app.benchmarks.read_model [--records 20000] [--repeat 200]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from app.benchmarks.batch_ingest import create_benchmark_app, make_records
+
+
+def measure(client, urls: list[str]) -> list[float]:
+    timings = []
+    for url in urls:
+        started = time.perf_counter()
+        client.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(label: str, timings: list[float]):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f'{label:<28} mean {statistics.mean(timings):8.2f} ms   p95 {p95:8.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_benchmark_app(os.path.join(tmp, 'read_model.db'))
+        app.config['FLAT_TABLE_SYNC'] = True
+        client = app.test_client()
+
+        records = make_records(args.records)
+        barcodes = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for start in range(0, len(records), 1000):
+                response = client.post('/api/records/batch', json=records[start:start + 1000])
+                barcodes += [row['barcode'] for row in response.json['records'] if 'barcode' in row]
+
+        lookups = [f'/api/records/{random.choice(barcodes)}' for _ in range(args.repeat)]
+        filters = [f'/api/records?name=LG&min_voltage={random.uniform(3.0, 3.5):.2f}&max_voltage=4.2'
+                   for _ in range(max(args.repeat // 10, 10))]
+
+        for read_model in ('join', 'flat'):
+            app.config['READ_MODEL'] = read_model
+            report(f'{read_model}: barcode lookup', measure(client, lookups))
+            report(f'{read_model}: filtered list', measure(client, filters))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Compare jsonify() of serialized records with the compiled RowEncoder.
+
+Usage:
+    python -m app.benchmarks.serialization [--rows 5000] [--repeat 20]
+"""
+
+import argparse
+import datetime
+import random
+import statistics
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from flask import Flask, jsonify
+
+from app.services.db import Database
+from app.services.serializer import RECORD_FIELDS, row_encoder
+
+Row = namedtuple('Row', RECORD_FIELDS)
+
+
+def make_rows(count: int) -> list:
+    rng = random.Random(0)
+    started = datetime.datetime(2024, 1, 1)
+    return [Row(index, 100000 + index, started + datetime.timedelta(seconds=index),
+                rng.choice(['LG', 'Sony', 'Samsung', None]), rng.choice(['red', 'blue', None]),
+                Decimal(f'{rng.uniform(2.5, 4.2):.2f}'), Decimal(f'{rng.uniform(15, 150):.2f}'),
+                rng.choice(['laptop', 'e-bike', None]), Decimal(f'{rng.uniform(0.04, 0.05):.3f}'),
+                rng.randint(1500, 3500))
+            for index in range(count)]
+
+
+def measure(encode, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encode()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    with Flask(__name__).app_context():
+        baseline = jsonify([Database.serialize_record(row) for row in rows]).get_data(as_text=True)
+        assert baseline == row_encoder.encode_rows(rows) + '\n', 'RowEncoder output differs from jsonify()'
+
+        cases = (
+            ('jsonify(serialize_record)', lambda: jsonify([Database.serialize_record(row) for row in rows]).get_data()),
+            ('RowEncoder records', lambda: row_encoder.encode(rows).encode()),
+            ('RowEncoder columns', lambda: row_encoder.encode(rows, 'columns').encode()),
+        )
+        for label, encode in cases:
+            timings = measure(encode, args.repeat)
+            print(f'{label:<28} median {statistics.median(timings):8.2f} ms for {args.rows} rows')
+
+
+if __name__ == '__main__':
+    main()
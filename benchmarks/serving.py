@@ -0,0 +1,171 @@
+"""
+Throughput of the application under the available HTTP servers.
+
+Every profile serves the same synthetic inventory from a SQLite file while
+client threads send a mix of list, single record and create requests over
+keep-alive connections for a fixed time:
+
+- dev: the threaded Werkzeug development server ('flask run')
+- waitress: waitress with its defaults (4 threads)
+- gunicorn: the production profile of gunicorn.conf.py
+
+Usage:
+    python -m app.benchmarks.serving [--rows 20000] [--clients 16] [--seconds 15]
+                                     [--write-ratio 0.1] [--profiles dev,waitress,gunicorn]
+
+Run it from the directory that contains the 'app' package. The response
+cache is disabled so the numbers reflect the database path.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from app.benchmarks.batch_ingest import create_benchmark_app
+from app.benchmarks.generator import InventoryGenerator, load
+
+PROFILES = ('dev', 'waitress', 'gunicorn')
+STARTUP_TIMEOUT = 60
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(profile: str, port: int) -> list[str]:
+    if profile == 'dev':
+        return [sys.executable, '-m', 'flask', '--app', 'app:create_app', 'run', '--port', str(port)]
+    if profile == 'waitress':
+        return [sys.executable, '-c', 'from waitress import serve; from app import create_app; '
+                                      f'serve(create_app(), host="127.0.0.1", port={port})']
+    return [sys.executable, '-m', 'gunicorn', '-c', 'app/gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+            'app.wsgi:app']
+
+
+def wait_until_ready(process: subprocess.Popen, port: int):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/api/records?limit=1')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('Server did not start')
+
+
+def client_loop(port: int, barcodes: list[int], write_ratio: float, deadline: float, seed: int,
+                timings: dict[str, list[float]], errors: list[int]):
+    rng = random.Random(seed)
+    generator = InventoryGenerator(seed)
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.monotonic() < deadline:
+        draw = rng.random()
+        if draw < write_ratio:
+            kind, method, url = 'create', 'POST', '/api/records'
+            body = json.dumps(json.dumps(generator.record()))
+        elif draw < write_ratio + (1 - write_ratio) / 2:
+            kind, method, url, body = 'list', 'GET', '/api/records?limit=50&sort_by=voltage&order_by=desc', None
+        else:
+            kind, method, url, body = 'record', 'GET', f'/api/records/{rng.choice(barcodes)}', None
+
+        started = time.perf_counter()
+        try:
+            connection.request(method, url, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException):
+            errors.append(0)
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            continue
+        timings[kind].append((time.perf_counter() - started) * 1000)
+    connection.close()
+
+
+def run_profile(profile: str, database: str, barcodes: list[int], args) -> dict:
+    port = free_port()
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URL=f'sqlite:///{database}', RESPONSE_CACHE_ENABLED='false',
+               LOG_LEVEL='WARNING', PHOTO_STORE_PATH=os.path.join(os.path.dirname(database), 'photos'))
+    cwd = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    process = subprocess.Popen(server_command(profile, port), cwd=cwd, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(process, port)
+        timings = {'list': [], 'record': [], 'create': []}
+        errors = []
+        deadline = time.monotonic() + args.seconds
+        threads = [threading.Thread(target=client_loop,
+                                    args=(port, barcodes, args.write_ratio, deadline, seed, timings, errors))
+                   for seed in range(args.clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait(30)
+
+    everything = sorted(timing for values in timings.values() for timing in values)
+    return {
+        'profile': profile,
+        'requests': len(everything),
+        'errors': len(errors),
+        'requests_per_s': len(everything) / elapsed,
+        'p50_ms': statistics.median(everything) if everything else 0.0,
+        'p95_ms': everything[int(len(everything) * 0.95) - 1] if everything else 0.0,
+        'by_kind_p50_ms': {kind: statistics.median(values) if values else 0.0 for kind, values in timings.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    parser.add_argument('--profiles', default=','.join(PROFILES))
+    parser.add_argument('--output', help='save the results as JSON')
+    args = parser.parse_args()
+
+    profiles = [profile.strip() for profile in args.profiles.split(',')]
+    unknown = set(profiles) - set(PROFILES)
+    if unknown:
+        parser.error(f"Unknown profiles: {', '.join(sorted(unknown))}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'serving.db')
+        barcodes = load(create_benchmark_app(database).test_client(), args.rows)
+        for profile in profiles:
+            result = run_profile(profile, database, barcodes, args)
+            results.append(result)
+            print(f"{profile:<10} {result['requests_per_s']:8.1f} req/s   p50 {result['p50_ms']:7.2f} ms   "
+                  f"p95 {result['p95_ms']:7.2f} ms   errors {result['errors']}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'args': vars(args), 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
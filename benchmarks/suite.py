@@ -0,0 +1,296 @@
+"""
+API benchmark suite.
+
+Loads a synthetic inventory into SQLite, drives every scenario through the
+Flask test client and reports p50/p95/p99 latencies and rows/s. Results are
+saved as JSON so two runs can be compared.
+
+Usage:
+    python -m app.benchmarks.suite run [--rows 10k|100k|max|<count>] [--repeat 200]
+                                       [--database inventory.db] [--output results.json]
+    python -m app.benchmarks.suite diff before.json after.json [--threshold 10]
+
+Loading the largest inventory takes a while; pass --database to keep the file
+and reuse it in later runs. The response cache is disabled unless
+--response-cache is given, so the numbers reflect the database path.
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable
+
+from app.benchmarks.generator import SIZES, InventoryGenerator, load
+
+BATCH_SIZE = 100
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    count: int = 0
+    rows: int = 0
+    total_ms: float = 0.0
+    p50_ms: float = 0.0
+    p95_ms: float = 0.0
+    p99_ms: float = 0.0
+    rows_per_s: float = 0.0
+    errors: int = 0
+    timings: list = field(default_factory=list, repr=False)
+
+    def finish(self):
+        timings = sorted(self.timings)
+        self.count = len(timings)
+        self.total_ms = sum(timings)
+        self.p50_ms = percentile(timings, 50)
+        self.p95_ms = percentile(timings, 95)
+        self.p99_ms = percentile(timings, 99)
+        self.rows_per_s = self.rows / (self.total_ms / 1000) if self.total_ms else 0.0
+
+    def to_dict(self) -> dict:
+        result = asdict(self)
+        del result['timings']
+        return {key: round(value, 3) if isinstance(value, float) else value for key, value in result.items()}
+
+
+def percentile(timings: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile of sorted timings.
+    """
+    if not timings:
+        return 0.0
+    rank = max(int(round(q / 100 * len(timings) + 0.5)) - 1, 0)
+    return timings[min(rank, len(timings) - 1)]
+
+
+class Scenarios:
+    """
+    The benchmarked API operations.
+
+    Every scenario is called once per repetition and returns the number of
+    rows it wrote or read.
+    """
+
+    def __init__(self, client, barcodes: list[int], seed: int = 1):
+        self.client = client
+        self.barcodes = barcodes
+        self.random = random.Random(seed)
+        self.generator = InventoryGenerator(seed)
+        self.created = []
+
+    def _request(self, method: str, url: str, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.open(url, method=method, **kwargs)
+        body = response.get_json(silent=True)
+        if response.status_code >= 400 or (isinstance(body, dict) and 'error' in body):
+            raise RuntimeError(f'{method} {url} returned {response.status_code}')
+        return response
+
+    def add_record(self) -> int:
+        self._request('POST', '/api/records', json=json.dumps(self.generator.record()))
+        return 1
+
+    def add_batch(self) -> int:
+        response = self._request('POST', '/api/records/batch',
+                                 json=list(self.generator.records(BATCH_SIZE)))
+        self.created += [row['barcode'] for row in response.json['records'] if 'barcode' in row]
+        return response.json['inserted']
+
+    def barcode_lookup(self) -> int:
+        self._request('GET', f'/api/records/{self.random.choice(self.barcodes)}')
+        return 1
+
+    def filtered_list(self) -> int:
+        record = self.generator.record()
+        low = round(self.random.uniform(3.0, 3.8), 2)
+        response = self._request('GET', f'/api/records?name={record["name"]}&min_voltage={low}'
+                                        f'&max_voltage={low + 0.2:.2f}&limit=100')
+        return len(response.json['records'])
+
+    def last(self) -> int:
+        response = self._request('GET', '/api/records/last')
+        return len(response.json) if isinstance(response.json, list) else 1
+
+    def update(self) -> int:
+        self._request('PUT', f'/api/records/{self.random.choice(self.barcodes)}', json=self.generator.record())
+        return 1
+
+    def delete(self) -> int:
+        # Only records created by add_batch are deleted, so the loaded
+        # inventory stays the same for the read scenarios
+        if not self.created:
+            self.add_batch()
+        self._request('DELETE', f'/api/records/{self.created.pop()}')
+        return 1
+
+    def all(self) -> list[tuple[str, Callable[[], int]]]:
+        return [('add_record', self.add_record),
+                ('add_batch', self.add_batch),
+                ('barcode_lookup', self.barcode_lookup),
+                ('filtered_list', self.filtered_list),
+                ('last', self.last),
+                ('update', self.update),
+                ('delete', self.delete)]
+
+
+def run_scenario(name: str, scenario: Callable[[], int], repeat: int, warmup: int = 5) -> ScenarioResult:
+    result = ScenarioResult(name)
+    for _ in range(warmup):
+        scenario()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            rows = scenario()
+        except RuntimeError:
+            result.errors += 1
+            continue
+        result.timings.append((time.perf_counter() - started) * 1000)
+        result.rows += rows
+    result.finish()
+    return result
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def inventory(app, after_id: int = 0) -> tuple[list[int], int]:
+    """
+    The barcodes of the records with an id above after_id and the highest id.
+    """
+    from app.extensions import db
+    from app.models.records import BatteryData
+
+    with app.app_context():
+        rows = db.session.execute(db.select(BatteryData.barcode, BatteryData.id)
+                                  .where(BatteryData.id > after_id)).all()
+        db.session.remove()
+    return [row.barcode for row in rows], max((row.id for row in rows), default=after_id)
+
+
+def run(args) -> dict:
+    from app.benchmarks.batch_ingest import create_benchmark_app
+
+    rows = SIZES.get(args.rows) or int(args.rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.database or os.path.join(tmp, 'suite.db')
+        app = create_benchmark_app(path)
+        app.config['RESPONSE_CACHE_ENABLED'] = args.response_cache
+        app.extensions['response_cache'].enabled = args.response_cache
+        client = app.test_client()
+
+        barcodes, last_id = inventory(app)
+        if len(barcodes) < rows:
+            started = time.perf_counter()
+            load(client, rows - len(barcodes), seed=len(barcodes))
+            print(f'loaded {rows - len(barcodes)} records in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+            barcodes, last_id = inventory(app)
+
+        scenarios = Scenarios(client, barcodes)
+        results = []
+        for name, scenario in scenarios.all():
+            if args.scenario and name not in args.scenario:
+                continue
+            result = run_scenario(name, scenario, args.repeat)
+            results.append(result)
+            print(f'{name:<16} p50 {result.p50_ms:8.2f} ms  p95 {result.p95_ms:8.2f} ms  '
+                  f'p99 {result.p99_ms:8.2f} ms  {result.rows_per_s:10.0f} rows/s', file=sys.stderr)
+
+        # Leave a kept database with the loaded inventory only
+        for barcode in inventory(app, last_id)[0]:
+            scenarios._request('DELETE', f'/api/records/{barcode}')
+
+        return {
+            'meta': {
+                'rows': len(barcodes),
+                'repeat': args.repeat,
+                'read_model': app.config.get('READ_MODEL', 'join'),
+                'response_cache': args.response_cache,
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            },
+            'scenarios': {result.name: result.to_dict() for result in results},
+        }
+
+
+def diff(before: dict, after: dict, threshold: float) -> list[str]:
+    """
+    Compare two saved runs.
+
+    Args:
+        before (dict): The baseline results.
+        after (dict): The new results.
+        threshold (float): The p95 slowdown in percent that counts as a regression.
+
+    Returns:
+        list[str]: The names of the regressed scenarios.
+    """
+    print(f'{"scenario":<16} {"metric":<10} {"before":>10} {"after":>10} {"change":>8}')
+    regressions = []
+    for name, new in after['scenarios'].items():
+        old = before['scenarios'].get(name)
+        if old is None:
+            print(f'{name:<16} (new scenario)')
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'rows_per_s'):
+            change = (new[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0.0
+            print(f'{name:<16} {metric:<10} {old[metric]:>10.2f} {new[metric]:>10.2f} {change:>+7.1f}%')
+        if old['p95_ms'] and (new['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the scenarios')
+    run_parser.add_argument('--rows', default='10k', help=f'a row count or one of {", ".join(SIZES)}')
+    run_parser.add_argument('--repeat', type=int, default=200)
+    run_parser.add_argument('--database', help='a SQLite file to keep the loaded inventory in')
+    run_parser.add_argument('--output', help='the JSON file to save the results to')
+    run_parser.add_argument('--scenario', action='append', help='run only this scenario; can be repeated')
+    run_parser.add_argument('--response-cache', action='store_true', help='keep the response cache enabled')
+
+    diff_parser = commands.add_parser('diff', help='compare two saved runs')
+    diff_parser.add_argument('before')
+    diff_parser.add_argument('after')
+    diff_parser.add_argument('--threshold', type=float, default=10.0,
+                             help='the p95 slowdown in percent that fails the comparison')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        results = run(args)
+        output = json.dumps(results, indent=2)
+        if args.output:
+            with open(args.output, 'w') as file:
+                file.write(output + '\n')
+        else:
+            print(output)
+    else:
+        with open(args.before) as before, open(args.after) as after:
+            regressions = diff(json.load(before), json.load(after), args.threshold)
+        if regressions:
+            print(f'p95 regressions over {args.threshold:g}%: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Command line interface of the BatteryHub application.
+
+The commands are registered on the Flask CLI under the 'batteryhub' group:
+
+    flask batteryhub rebuild-flat
+    flask batteryhub migrate
+    flask batteryhub check-plans
+    flask batteryhub import PATH
+    flask batteryhub compact
+    flask batteryhub replicas
+"""
+
+import click
+from flask.cli import AppGroup
+
+batteryhub = AppGroup('batteryhub', help='BatteryHub maintenance commands.')
+
+
+@batteryhub.command('rebuild-flat')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows copied per transaction.')
+def rebuild_flat(batch_size):
+    """Rebuild the denormalized 'battery_flat' read table."""
+    from app.services.db import Database
+
+    count = Database.rebuild_flat(batch_size=batch_size)
+    click.echo(f'battery_flat rebuilt with {count} rows.')
+
+
+@batteryhub.command('migrate')
+def migrate():
+    """Create missing tables and apply pending schema migrations."""
+    from app.extensions import db
+    from app.migrations import upgrade
+
+    applied = upgrade(db.engine, db.metadata)
+    click.echo(f'Applied migrations: {", ".join(applied)}' if applied else 'Database is up to date.')
+
+
+@batteryhub.command('check-plans')
+@click.option('--database-url', default=None,
+              help='Empty scratch database to run on. Defaults to a temporary SQLite file.')
+@click.option('--verbose', is_flag=True, help='Print the plan of every statement.')
+def check_plans(database_url, verbose):
+    """Fail if any query issued by the API falls back to a full table or index scan."""
+    from app.services.query_plan import check_query_plans
+
+    reports = check_query_plans(database_url)
+    failures = [report for report in reports if report.full_scans]
+
+    for report in reports:
+        if verbose or report.full_scans:
+            status = 'FULL SCAN' if report.full_scans else 'ok'
+            click.echo(f'[{status}] {report.scenario} ({report.read_model}): {" ".join(report.statement.split())}')
+            for step in report.plan:
+                click.echo(f'    {step}')
+
+    click.echo(f'{len(reports)} statements explained, {len(failures)} with full scans.')
+    if failures:
+        raise SystemExit(1)
+
+
+@batteryhub.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='File format. Detected from the file extension by default.')
+@click.option('--chunk-size', type=click.IntRange(min=1), default=None,
+              help='Rows per transaction. Defaults to IMPORT_CHUNK_SIZE.')
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help='Validation processes. Defaults to IMPORT_WORKERS.')
+@click.option('--reject-file', default=None,
+              help='File for the invalid rows. Defaults to PATH with a .rejects suffix.')
+@click.option('--restart', is_flag=True,
+              help='Import the file from its first row, even if it was (partly) imported before.')
+def import_records(path, file_format, chunk_size, workers, reject_file, restart):
+    """Import records from a CSV or NDJSON file, resuming an interrupted import."""
+    from flask import current_app
+    from app.services.importer import RecordImporter
+
+    importer = RecordImporter(path, file_format=file_format,
+                              chunk_size=chunk_size or current_app.config.get('IMPORT_CHUNK_SIZE', 5000),
+                              workers=workers or current_app.config.get('IMPORT_WORKERS', 1),
+                              reject_path=reject_file)
+
+    def progress(state):
+        click.echo(f'{state.rows_read} rows read, {state.rows_imported} imported, '
+                   f'{state.rows_rejected} rejected ({state.rows_per_second:.0f} rows/s)')
+
+    try:
+        result = importer.run(restart=restart, progress=progress)
+    except (ValueError, RuntimeError) as ex:
+        raise click.ClickException(str(ex))
+
+    click.echo(f'Import of {importer.path} finished: {result.rows_imported} records imported, '
+               f'{result.rows_rejected} rejected.')
+    if result.rows_rejected:
+        click.echo(f'Rejected rows written to {importer.reject_path}')
+
+
+@batteryhub.command('compact')
+@click.option('--retention', type=click.IntRange(min=0), default=None,
+              help='Seconds soft-deleted records are kept. Defaults to COMPACTION_RETENTION.')
+@click.option('--batch-size', type=click.IntRange(min=1), default=None,
+              help='Rows deleted per transaction. Defaults to COMPACTION_BATCH_SIZE.')
+def compact(retention, batch_size):
+    """Purge old soft-deleted records and delete unused parameter and lookup rows."""
+    from flask import current_app
+    from app.services.compaction import Compaction
+
+    if retention is None:
+        retention = current_app.config.get('COMPACTION_RETENTION', 86400)
+    result = Compaction.run(retention, batch_size or current_app.config.get('COMPACTION_BATCH_SIZE', 1000))
+    lookups = ', '.join(f'{table}: {count}' for table, count in result.lookups_deleted.items())
+    click.echo(f'{result.tombstones_purged} soft-deleted records purged, '
+               f'{result.parameters_deleted} parameter combinations and lookup rows ({lookups}) deleted, '
+               f'{result.idempotency_keys_purged} expired idempotency keys, '
+               f'{result.changes_purged} change log rows and '
+               f'{result.ingest_failures_purged} ingest failures purged '
+               f'in {result.seconds:.1f} s.')
+
+
+@batteryhub.command('replicas')
+def replicas():
+    """Check the read replicas and print their availability and lag."""
+    from app.services.replica import replica_router
+
+    if not replica_router.binds:
+        click.echo('No read replicas configured (DATABASE_REPLICA_URLS).')
+        return
+    for key, state in replica_router.check().items():
+        status = 'healthy' if state.healthy else 'unhealthy'
+        lag = 'not checked' if state.lag is None else f'{state.lag:.3f} s'
+        click.echo(f'{key}: {status}, lag {lag}' + (f', error: {state.error}' if state.error else ''))
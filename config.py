@@ -1,5 +1,35 @@
 import os
 from dotenv import load_dotenv
+from sqlalchemy.engine import make_url
+
+
+def is_memory_sqlite(url: str) -> bool:
+    """
+    Whether a database URL is an in-memory SQLite database, whose engine keeps a single connection
+    (StaticPool or SingletonThreadPool) instead of a sized pool.
+    """
+    url = make_url(url)
+    return (url.get_backend_name() == 'sqlite'
+            and (url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'))
+
+
+def engine_options(url: str | None, pool_sizing: dict, pool_recycle: int) -> dict:
+    """
+    The engine options of a database URL: recycling and pre-ping for every engine,
+    the pool sizing only for engines with a sized pool.
+    """
+    options = {'pool_recycle': pool_recycle, 'pool_pre_ping': True}
+    if url and not is_memory_sqlite(url):
+        options.update(pool_sizing)
+    return options
+
+
+def replica_binds(urls: list[str], pool_sizing: dict, pool_recycle: int) -> dict:
+    """
+    The Flask-SQLAlchemy binds 'replica0', 'replica1', ... of the replica URLs with their engine options.
+    """
+    return {f'replica{index}': dict(engine_options(url, pool_sizing, pool_recycle), url=url)
+            for index, url in enumerate(urls)}
 
 
 class Config:
@@ -10,7 +40,146 @@ class Config:
     load_dotenv('.env')
 
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URL')
-    SQLALCHEMY_TRACK_MODIFICATIONS = True
+    # The ORM change tracking of Flask-SQLAlchemy is not used; writes are reported by the records_changed signal
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Production server (gunicorn.conf.py): WEB_CONCURRENCY worker processes with WEB_THREADS threads each
+    CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 2 * CPU_COUNT + 1))
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', 4))
+
+    # Connection pool of every worker: a connection per request thread plus room for the background threads.
+    # A database serves up to WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', WEB_THREADS))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 4))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    # In-memory SQLite has no sized pool and takes only the recycling and pre-ping options
+    DB_POOL_SIZING = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+    }
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, DB_POOL_SIZING, DB_POOL_RECYCLE)
+
+    # Read replicas: comma-separated database URLs, registered as the binds 'replica0', 'replica1', ...
+    # with the pool settings of the primary (SQLALCHEMY_ENGINE_OPTIONS only applies to the primary)
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                             if url.strip()]
+    SQLALCHEMY_BINDS = replica_binds(DATABASE_REPLICA_URLS, DB_POOL_SIZING, DB_POOL_RECYCLE)
+    # Replicas more than REPLICA_MAX_LAG seconds behind serve no reads (0 disables the lag check)
+    REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+    REPLICA_CHECK_SECONDS = float(os.environ.get('REPLICA_CHECK_SECONDS', 1))
+    # Seconds a client that wrote reads from the primary
+    READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
+
+    # Barcode allocator
+    BARCODE_BLOCK_SIZE = int(os.environ.get('BARCODE_BLOCK_SIZE', 100))
+    BARCODE_LEASE_SECONDS = int(os.environ.get('BARCODE_LEASE_SECONDS', 3600))
+
+    # Process-local cache of lookup-table ids
+    DIMENSION_CACHE_SIZE = int(os.environ.get('DIMENSION_CACHE_SIZE', 4096))
+    # Seconds between checks whether compaction deleted cached lookup rows
+    DIMENSION_CACHE_CHECK_SECONDS = float(os.environ.get('DIMENSION_CACHE_CHECK_SECONDS', 5))
+
+    # Batch ingest
+    BATCH_MAX_RECORDS = int(os.environ.get('BATCH_MAX_RECORDS', 10000))
+    BATCH_INSERT_CHUNK_SIZE = int(os.environ.get('BATCH_INSERT_CHUNK_SIZE', 500))
+
+    # Write-behind ingest of POST /api/records: records are queued and written in group commits
+    INGEST_ASYNC = os.environ.get('INGEST_ASYNC', 'false').lower() in ('1', 'true', 'yes')
+    INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 10000))
+    INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 500))
+    INGEST_FLUSH_MS = float(os.environ.get('INGEST_FLUSH_MS', 20))
+    INGEST_ENQUEUE_TIMEOUT = float(os.environ.get('INGEST_ENQUEUE_TIMEOUT', 1.0))
+    INGEST_STATUS_SIZE = int(os.environ.get('INGEST_STATUS_SIZE', 100000))
+    # Seconds the failed writes are kept for GET /api/records/<barcode>/status of every worker
+    INGEST_FAILURE_RETENTION = int(os.environ.get('INGEST_FAILURE_RETENTION', 86400))
+
+    # Idempotency-Key on record creation: 'db' shares the keys between workers, 'memory' keeps them per worker
+    IDEMPOTENCY_ENABLED = os.environ.get('IDEMPOTENCY_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    IDEMPOTENCY_BACKEND = os.environ.get('IDEMPOTENCY_BACKEND', 'db')
+    IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 86400))
+    IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+    IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', 30))
+    IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 10))
+
+    # Server-Sent Events change feed, opt-in: with the 'db' backend every write is also logged in 'record_change'.
+    # 'memory' sees the writes of its own worker, 'db' those of every worker and of the stream server
+    # (gunicorn.stream.conf.py), so 'memory' is only the default of a single worker
+    CHANGE_FEED_ENABLED = os.environ.get('CHANGE_FEED_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    CHANGE_FEED_BACKEND = os.environ.get('CHANGE_FEED_BACKEND', 'db' if WEB_CONCURRENCY > 1 else 'memory')
+    CHANGE_FEED_BUFFER_SIZE = int(os.environ.get('CHANGE_FEED_BUFFER_SIZE', 1000))
+    CHANGE_FEED_MAX_RECORDS = int(os.environ.get('CHANGE_FEED_MAX_RECORDS', 100))
+    CHANGE_FEED_MAX_SUBSCRIBERS = int(os.environ.get('CHANGE_FEED_MAX_SUBSCRIBERS', 500))
+    CHANGE_FEED_HEARTBEAT = float(os.environ.get('CHANGE_FEED_HEARTBEAT', 15))
+    CHANGE_FEED_POLL_MS = int(os.environ.get('CHANGE_FEED_POLL_MS', 500))
+    CHANGE_FEED_RETENTION = int(os.environ.get('CHANGE_FEED_RETENTION', 3600))
+    # Seconds between two purges of the change log by a writing worker (0 leaves it to the compaction job)
+    CHANGE_FEED_PURGE_SECONDS = int(os.environ.get('CHANGE_FEED_PURGE_SECONDS', 300))
+
+    # File import of 'flask batteryhub import'
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+    IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', os.cpu_count() or 1))
+
+    # Deletes: SOFT_DELETE keeps deleted records as tombstones until compaction purges them
+    SOFT_DELETE = os.environ.get('SOFT_DELETE', 'false').lower() in ('1', 'true', 'yes')
+    # Background compaction every COMPACTION_INTERVAL seconds (0 disables); tombstones are
+    # kept for COMPACTION_RETENTION seconds
+    COMPACTION_INTERVAL = int(os.environ.get('COMPACTION_INTERVAL', 0))
+    COMPACTION_RETENTION = int(os.environ.get('COMPACTION_RETENTION', 86400))
+    COMPACTION_BATCH_SIZE = int(os.environ.get('COMPACTION_BATCH_SIZE', 1000))
+
+    # Photos: images are files of a content-addressed store, thumbnails are made by THUMBNAIL_WORKERS processes
+    PHOTO_STORE_PATH = os.environ.get('PHOTO_STORE_PATH', 'photos')
+    PHOTO_MAX_BYTES = int(os.environ.get('PHOTO_MAX_BYTES', 10 * 1024 * 1024))
+    PHOTO_MAX_AGE = int(os.environ.get('PHOTO_MAX_AGE', 86400))
+    THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 256))
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+    THUMBNAIL_TIMEOUT = float(os.environ.get('THUMBNAIL_TIMEOUT', 10))
+
+    # Record list pagination
+    RECORDS_PAGE_SIZE = int(os.environ.get('RECORDS_PAGE_SIZE', 100))
+    RECORDS_MAX_PAGE_SIZE = int(os.environ.get('RECORDS_MAX_PAGE_SIZE', 1000))
+
+    # Streaming export
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 65536))
+
+    # Read model: 'join' reads the normalized tables, 'flat' reads the 'battery_flat' table
+    READ_MODEL = os.environ.get('READ_MODEL', 'join')
+    FLAT_TABLE_SYNC = os.environ.get('FLAT_TABLE_SYNC', str(READ_MODEL == 'flat')).lower() in ('1', 'true', 'yes')
+
+    # Response cache of the read endpoints. Opt-in: the in-process cache is invalidated by the writes of its own
+    # worker at once and, with several workers, by the writes of the others when the 'db' change feed reads them
+    # (CHANGE_FEED_POLL_MS); with several workers and without the 'db' change feed the cache stays off
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 10))
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+
+    # Pack matching
+    PACK_MAX_CELLS = int(os.environ.get('PACK_MAX_CELLS', 5000))
+    PACK_MAX_ITERATIONS = int(os.environ.get('PACK_MAX_ITERATIONS', 5000))
+
+    # Similar cell search: grid cell edge in standard deviations and reload interval of the index
+    SIMILARITY_CELL_SIZE = float(os.environ.get('SIMILARITY_CELL_SIZE', 0.25))
+    SIMILARITY_INDEX_TTL = int(os.environ.get('SIMILARITY_INDEX_TTL', 300))
+    SIMILAR_MAX_K = int(os.environ.get('SIMILAR_MAX_K', 100))
+
+    # In-process filter index of the record list, reloaded every RANGE_INDEX_TTL seconds
+    RANGE_INDEX_ENABLED = os.environ.get('RANGE_INDEX_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    RANGE_INDEX_TTL = int(os.environ.get('RANGE_INDEX_TTL', 300))
+
+    # Inventory statistics
+    STATS_MAX_BINS = int(os.environ.get('STATS_MAX_BINS', 200))
+
+    # Logging: LOG_FORMAT is 'text' or 'json'
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+
+    # Request metrics on /metrics; requests slower than SLOW_REQUEST_MS are logged with their SQL (0 disables)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 0))
 
     # Secret Key
     SECRET_KEY = os.environ.get('SECRET_KEY')
@@ -4,3 +4,36 @@ class EmptyFieldError(Exception):
 
     def __str__(self):
         return f'Field is empty: {self.field_name}'
+
+
+class BarcodeSpaceExhaustedError(Exception):
+    def __init__(self, lower, upper):
+        self.lower = lower
+        self.upper = upper
+
+    def __str__(self):
+        return f'No free barcodes left in range {self.lower}-{self.upper}'
+
+
+class BlobTooLargeError(ValueError):
+    def __init__(self, limit):
+        self.limit = limit
+
+    def __str__(self):
+        return f'File is larger than {self.limit} bytes'
+
+
+class IngestQueueFullError(Exception):
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+    def __str__(self):
+        return f'Ingest queue is full ({self.capacity} records)'
+
+
+class TooManySubscribersError(Exception):
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+    def __str__(self):
+        return f'Change feed has the maximum of {self.capacity} subscribers'
@@ -0,0 +1,58 @@
+"""
+Gunicorn settings of the production server.
+
+    gunicorn -c app/gunicorn.conf.py app.wsgi:app
+
+Workers are threaded (gthread): WEB_CONCURRENCY processes, by default twice
+the CPU count plus one, each with WEB_THREADS request threads and a
+connection pool of the same size (see Config). Every open change feed stream
+holds a thread of its worker, so a worker accepts at most half of its threads
+in streams unless CHANGE_FEED_MAX_SUBSCRIBERS says otherwise; the streams are
+meant for the gevent server of gunicorn.stream.conf.py.
+
+The application is loaded once before the workers are forked. The services
+start their threads per process, and every worker drops the database
+connections it inherited.
+
+State kept in a worker is shared through the database when WEB_CONCURRENCY
+is above 1: the opt-in change feed defaults to its 'db' backend, the opt-in
+response cache is invalidated by the changes that feed reads and stays off
+without it, the status of write-behind ingests is answered from the database
+by every worker, and compaction waits DIMENSION_CACHE_CHECK_SECONDS before
+deleting lookup rows other workers may have cached. With the 'memory' change
+feed backend a stream only sees the writes of its own worker.
+"""
+
+import os
+
+os.environ.setdefault('CHANGE_FEED_MAX_SUBSCRIBERS', str(max(1, int(os.environ.get('WEB_THREADS', 4)) // 2)))
+
+from app.config import Config  # noqa: E402  the stream limit must be set before the settings are read
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5011)}")
+workers = Config.WEB_CONCURRENCY
+worker_class = 'gthread'
+threads = Config.WEB_THREADS
+preload_app = os.environ.get('PRELOAD_APP', 'true').lower() in ('1', 'true', 'yes')
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# Restarting workers drops their caches and indexes, so it is off unless asked for
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+
+
+def post_fork(server, worker):
+    # Pooled connections opened by the preloaded application belong to the arbiter
+    if not server.cfg.preload_app:
+        return
+    from app.extensions import db
+
+    with server.app.wsgi().app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,39 @@
+"""
+Gunicorn settings of the change feed stream server.
+
+    gunicorn -c app/gunicorn.stream.conf.py app.wsgi:app
+
+Serves GET /api/records/stream next to the API server of gunicorn.conf.py.
+The workers are gevent workers: an open stream is a greenlet waiting on the
+change feed instead of a thread of a request worker, so STREAM_WORKERS
+processes hold up to CHANGE_FEED_MAX_SUBSCRIBERS streams each without taking
+threads from the API. The reverse proxy routes /api/records/stream to
+STREAM_BIND and every other path to the API server.
+
+The stream server sees the writes of the API workers through the change log,
+so the change feed is enabled with the 'db' backend here; the API server
+needs CHANGE_FEED_ENABLED and CHANGE_FEED_BACKEND=db as well to log its writes. The application is
+loaded in every worker after gevent has patched the standard library, so
+the locks and threads of the services are cooperative.
+"""
+
+import os
+
+os.environ['CHANGE_FEED_ENABLED'] = 'true'
+os.environ['CHANGE_FEED_BACKEND'] = 'db'
+
+from app.config import Config  # noqa: E402  the feed settings must be set before the settings are read
+
+bind = os.environ.get('STREAM_BIND', f"0.0.0.0:{os.environ.get('STREAM_PORT', 5012)}")
+workers = int(os.environ.get('STREAM_WORKERS', 1))
+worker_class = 'gevent'
+worker_connections = Config.CHANGE_FEED_MAX_SUBSCRIBERS + 100
+preload_app = False
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = os.environ.get('ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
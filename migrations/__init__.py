@@ -0,0 +1,83 @@
+"""
+Schema migrations of the BatteryHub database.
+
+Every migration is a module in this package with a VERSION string and an
+upgrade(conn) function. Applied versions are recorded in the
+'schema_migrations' table. Tables that do not exist yet are created from the
+models before the migrations run, so a fresh database only records the versions.
+
+Usage:
+    flask batteryhub migrate
+"""
+
+import datetime
+import importlib
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, insert, select
+
+MIGRATIONS = (
+    'm0001_indexes',
+    'm0002_soft_delete',
+    'm0003_photo_blobs',
+    'm0004_barcode_blocks',
+    'm0005_battery_flat',
+    'm0006_lookup_generation',
+    'm0007_import_checkpoint',
+    'm0008_idempotency_keys',
+    'm0009_record_changes',
+    'm0010_replica_heartbeat',
+    'm0011_ingest_failures',
+    'm0012_idempotency_claims',
+    'm0013_compaction_lease',
+)
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations', metadata,
+    Column('version', String(32), primary_key=True),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def pending(conn) -> list:
+    """
+    The migration modules that were not applied to the database yet.
+
+    Args:
+        conn: An open SQLAlchemy connection.
+
+    Returns:
+        list: The pending migration modules in order.
+    """
+    schema_migrations.create(conn, checkfirst=True)
+    applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+    modules = [importlib.import_module(f'{__name__}.{name}') for name in MIGRATIONS]
+    return [module for module in modules if module.VERSION not in applied]
+
+
+def upgrade(engine, metadata_to_create=None) -> list[str]:
+    """
+    Apply the pending migrations, each in its own transaction.
+
+    Args:
+        engine: The SQLAlchemy engine of the database.
+        metadata_to_create: Model metadata whose missing tables are created first.
+
+    Returns:
+        list[str]: The versions that were applied.
+    """
+    if metadata_to_create is not None:
+        metadata_to_create.create_all(engine)
+
+    with engine.begin() as conn:
+        modules = pending(conn)
+
+    applied = []
+    for module in modules:
+        with engine.begin() as conn:
+            module.upgrade(conn)
+            conn.execute(insert(schema_migrations).values(version=module.VERSION,
+                                                          applied_at=datetime.datetime.utcnow()))
+        applied.append(module.VERSION)
+    return applied
@@ -0,0 +1,74 @@
+"""
+Add the indexes used by the record lookups and filters.
+
+- battery_data: datetime (GET /api/records/last), real_params_id and source_id
+- real_parameters: the foreign keys used by filter joins and a unique index
+  over the whole parameter combination
+
+Duplicate parameter combinations are merged into the row with the lowest id
+before the unique index is created.
+"""
+
+from sqlalchemy import Index, MetaData, Table, bindparam, delete, select, update
+
+VERSION = '0001'
+
+BATTERY_DATA_INDEXES = (
+    ('ix_battery_data_datetime', ('datetime',)),
+    ('ix_battery_data_real_params_id', ('real_params_id',)),
+    ('ix_battery_data_source_id', ('source_id',)),
+)
+
+REAL_PARAMETERS_INDEXES = (
+    ('ix_real_parameters_color_id', ('color_id',)),
+    ('ix_real_parameters_capacity_id', ('capacity_id',)),
+    ('ix_real_parameters_resistance_id', ('resistance_id',)),
+    ('ix_real_parameters_voltage_id', ('voltage_id',)),
+    ('ix_real_parameters_weight_id', ('weight_id',)),
+)
+
+COMBINATION = ('name_id', 'color_id', 'capacity_id', 'resistance_id', 'voltage_id', 'weight_id')
+
+
+def merge_duplicate_combinations(conn, battery_data, real_parameters):
+    rows = conn.execute(
+        select(real_parameters.c.id, *(real_parameters.c[name] for name in COMBINATION))
+        .order_by(real_parameters.c.id)
+    ).all()
+
+    keep = {}
+    duplicates = {}
+    for row in rows:
+        combination = tuple(row[1:])
+        if combination in keep:
+            duplicates[row.id] = keep[combination]
+        else:
+            keep[combination] = row.id
+
+    if not duplicates:
+        return
+
+    conn.execute(
+        update(battery_data)
+        .where(battery_data.c.real_params_id == bindparam('duplicate_id'))
+        .values(real_params_id=bindparam('keep_id')),
+        [{'duplicate_id': duplicate_id, 'keep_id': keep_id} for duplicate_id, keep_id in duplicates.items()]
+    )
+    ids = list(duplicates)
+    for start in range(0, len(ids), 500):
+        conn.execute(delete(real_parameters).where(real_parameters.c.id.in_(ids[start:start + 500])))
+
+
+def upgrade(conn):
+    metadata = MetaData()
+    battery_data = Table('battery_data', metadata, autoload_with=conn)
+    real_parameters = Table('real_parameters', metadata, autoload_with=conn)
+
+    merge_duplicate_combinations(conn, battery_data, real_parameters)
+
+    for table, indexes in ((battery_data, BATTERY_DATA_INDEXES), (real_parameters, REAL_PARAMETERS_INDEXES)):
+        for name, columns in indexes:
+            Index(name, *(table.c[column] for column in columns)).create(conn, checkfirst=True)
+
+    Index('uq_real_parameters_combination', *(real_parameters.c[name] for name in COMBINATION),
+          unique=True).create(conn, checkfirst=True)
@@ -0,0 +1,20 @@
+"""
+Add the soft-delete tombstone of the records.
+
+- battery_data: a nullable deleted_at column and its index, used by the
+  compaction job to find the tombstones to purge
+"""
+
+from sqlalchemy import Column, DateTime, Index, MetaData, Table, inspect, text
+
+VERSION = '0002'
+
+
+def upgrade(conn):
+    if 'deleted_at' not in {column['name'] for column in inspect(conn).get_columns('battery_data')}:
+        column = Column('deleted_at', DateTime)
+        conn.execute(text(f'ALTER TABLE battery_data ADD COLUMN deleted_at '
+                          f'{column.type.compile(dialect=conn.dialect)}'))
+
+    battery_data = Table('battery_data', MetaData(), autoload_with=conn)
+    Index('ix_battery_data_deleted_at', battery_data.c.deleted_at).create(conn, checkfirst=True)
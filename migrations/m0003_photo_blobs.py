@@ -0,0 +1,84 @@
+"""
+Move the photo images out of the database into the blob store.
+
+- photo: sha256, content_type, size, width, height and created_at columns and
+  a unique index over sha256; the 'photo' LargeBinary column is dropped
+
+Every image is written to the blob store (PHOTO_STORE_PATH) and its row gets
+the hash and metadata. Rows with the same image are merged into the row with
+the lowest id, and rows without an image are removed. Blob files are written
+before the transaction commits; a failed migration only leaves unreferenced
+files behind, which the next run reuses.
+"""
+
+import datetime
+
+from sqlalchemy import (BigInteger, Column, DateTime, Index, Integer, MetaData, String, Table, delete, inspect,
+                        select, text, update)
+
+VERSION = '0003'
+
+COLUMNS = (
+    Column('sha256', String(64)),
+    Column('content_type', String(50)),
+    Column('size', BigInteger),
+    Column('width', Integer),
+    Column('height', Integer),
+    Column('created_at', DateTime),
+)
+
+BATCH_SIZE = 100
+
+
+def image_metadata(path: str) -> tuple:
+    from app.services.photos import inspect_image
+
+    try:
+        return inspect_image(path)
+    except ValueError:
+        return 'application/octet-stream', None, None
+
+
+def move_blobs(conn, battery_data, photo):
+    from app.services.blob_store import blob_store
+
+    keep = {}
+    ids = conn.execute(select(photo.c.id).order_by(photo.c.id)).scalars().all()
+    now = datetime.datetime.utcnow()
+    for start in range(0, len(ids), BATCH_SIZE):
+        # The images of one batch at a time are held in memory
+        rows = conn.execute(select(photo.c.id, photo.c.photo).where(photo.c.id.in_(ids[start:start + BATCH_SIZE])))
+        for photo_id, data in rows:
+            if data is None:
+                conn.execute(update(battery_data).where(battery_data.c.photo_id == photo_id).values(photo_id=None))
+                conn.execute(delete(photo).where(photo.c.id == photo_id))
+                continue
+
+            digest, size = blob_store.put_bytes(bytes(data))
+            if digest in keep:
+                conn.execute(update(battery_data).where(battery_data.c.photo_id == photo_id)
+                             .values(photo_id=keep[digest]))
+                conn.execute(delete(photo).where(photo.c.id == photo_id))
+                continue
+
+            keep[digest] = photo_id
+            content_type, width, height = image_metadata(blob_store.path(digest))
+            conn.execute(update(photo).where(photo.c.id == photo_id).values(
+                sha256=digest, size=size, content_type=content_type, width=width, height=height, created_at=now))
+
+
+def upgrade(conn):
+    existing = {column['name'] for column in inspect(conn).get_columns('photo')}
+    for column in COLUMNS:
+        if column.name not in existing:
+            conn.execute(text(f'ALTER TABLE photo ADD COLUMN {column.name} '
+                              f'{column.type.compile(dialect=conn.dialect)}'))
+
+    metadata = MetaData()
+    battery_data = Table('battery_data', metadata, autoload_with=conn)
+    photo = Table('photo', metadata, autoload_with=conn)
+    if 'photo' in existing:
+        move_blobs(conn, battery_data, photo)
+        conn.execute(text('ALTER TABLE photo DROP COLUMN photo'))
+
+    Index('ix_photo_sha256', photo.c.sha256, unique=True).create(conn, checkfirst=True)
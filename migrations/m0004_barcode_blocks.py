@@ -0,0 +1,21 @@
+"""
+Add the table of the barcode blocks reserved by the application workers.
+
+- barcode_block: one row per reserved block of barcodes with its owner and
+  the time of the last lease renewal
+"""
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+
+VERSION = '0004'
+
+barcode_block = Table(
+    'barcode_block', MetaData(),
+    Column('start', Integer, primary_key=True, autoincrement=False),
+    Column('owner', String(64), nullable=False),
+    Column('leased_at', DateTime, nullable=False),
+)
+
+
+def upgrade(conn):
+    barcode_block.create(conn, checkfirst=True)
@@ -0,0 +1,31 @@
+"""
+Add the denormalized 'battery_flat' read table.
+
+- battery_flat: one row per battery_data row with the parameter values
+  copied from the lookup tables, indexed by the sort and filter columns
+
+The table is created empty; fill it with 'flask batteryhub rebuild-flat'
+before switching READ_MODEL to 'flat'.
+"""
+
+from sqlalchemy import DECIMAL, Column, DateTime, Integer, MetaData, String, Table
+
+VERSION = '0005'
+
+battery_flat = Table(
+    'battery_flat', MetaData(),
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('barcode', Integer, unique=True, nullable=False),
+    Column('datetime', DateTime, index=True),
+    Column('name', String(50), index=True),
+    Column('color', String(20), index=True, nullable=False),
+    Column('voltage', DECIMAL(precision=3, scale=2), index=True, nullable=False),
+    Column('resistance', DECIMAL(precision=5, scale=2), index=True, nullable=False),
+    Column('source', String(50), index=True),
+    Column('weight', DECIMAL(precision=4, scale=3)),
+    Column('capacity', Integer, index=True),
+)
+
+
+def upgrade(conn):
+    battery_flat.create(conn, checkfirst=True)
@@ -0,0 +1,21 @@
+"""
+Add the generation counter of the lookup tables.
+
+- lookup_generation: a single row incremented by the compaction job whenever
+  it deletes lookup rows, so the dimension caches of all workers drop their ids
+"""
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table
+
+VERSION = '0006'
+
+lookup_generation = Table(
+    'lookup_generation', MetaData(),
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('generation', Integer, nullable=False, default=0),
+    Column('updated_at', DateTime, nullable=False),
+)
+
+
+def upgrade(conn):
+    lookup_generation.create(conn, checkfirst=True)
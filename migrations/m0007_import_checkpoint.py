@@ -0,0 +1,26 @@
+"""
+Add the progress table of 'flask batteryhub import'.
+
+- import_checkpoint: one row per imported file with its fingerprint and the
+  rows covered by committed chunks, so an interrupted import resumes
+"""
+
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Integer, MetaData, String, Table
+
+VERSION = '0007'
+
+import_checkpoint = Table(
+    'import_checkpoint', MetaData(),
+    Column('source', String(255), primary_key=True),
+    Column('fingerprint', String(64), nullable=False),
+    Column('rows_read', Integer, nullable=False, default=0),
+    Column('rows_imported', Integer, nullable=False, default=0),
+    Column('rows_rejected', Integer, nullable=False, default=0),
+    Column('reject_offset', BigInteger, nullable=False, default=0),
+    Column('finished', Boolean, nullable=False, default=False),
+    Column('updated_at', DateTime, nullable=False),
+)
+
+
+def upgrade(conn):
+    import_checkpoint.create(conn, checkfirst=True)
@@ -0,0 +1,24 @@
+"""
+Add the stored responses of the Idempotency-Key requests.
+
+- idempotency_key: one row per key with the request fingerprint and the
+  stored response, indexed by created_at for the expiry purge
+"""
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text
+
+VERSION = '0008'
+
+idempotency_key = Table(
+    'idempotency_key', MetaData(),
+    Column('key', String(64), primary_key=True),
+    Column('fingerprint', String(64), nullable=False),
+    Column('status_code', Integer),
+    Column('body', Text),
+    Column('mimetype', String(100)),
+    Column('created_at', DateTime, nullable=False, index=True),
+)
+
+
+def upgrade(conn):
+    idempotency_key.create(conn, checkfirst=True)
@@ -0,0 +1,22 @@
+"""
+Add the change log read by the change feed of the 'db' backend.
+
+- record_change: one row per committed write with its action and barcodes,
+  indexed by created_at for the retention purge
+"""
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text
+
+VERSION = '0009'
+
+record_change = Table(
+    'record_change', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('action', String(10), nullable=False),
+    Column('barcodes', Text, nullable=False),
+    Column('created_at', DateTime, nullable=False, index=True),
+)
+
+
+def upgrade(conn):
+    record_change.create(conn, checkfirst=True)
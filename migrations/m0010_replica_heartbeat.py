@@ -0,0 +1,22 @@
+"""
+Add the heartbeat used to measure the lag of the read replicas.
+
+- replica_heartbeat: a single row updated on the primary; its age on a
+  replica is the replication lag
+
+Replicas receive the table through replication, like every other table.
+"""
+
+from sqlalchemy import BigInteger, Column, Integer, MetaData, Table
+
+VERSION = '0010'
+
+replica_heartbeat = Table(
+    'replica_heartbeat', MetaData(),
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('beat_ms', BigInteger, nullable=False),
+)
+
+
+def upgrade(conn):
+    replica_heartbeat.create(conn, checkfirst=True)
@@ -0,0 +1,22 @@
+"""
+Add the failed writes of the write-behind ingest.
+
+- ingest_failure: one row per record accepted by POST /api/records that could
+  not be stored, so every worker reports it as failed; indexed by failed_at
+  for the retention purge
+"""
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table, Text
+
+VERSION = '0011'
+
+ingest_failure = Table(
+    'ingest_failure', MetaData(),
+    Column('barcode', Integer, primary_key=True, autoincrement=False),
+    Column('error', Text, nullable=False),
+    Column('failed_at', DateTime, nullable=False, index=True),
+)
+
+
+def upgrade(conn):
+    ingest_failure.create(conn, checkfirst=True)
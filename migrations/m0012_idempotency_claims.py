@@ -0,0 +1,18 @@
+"""
+Add the claim token of the idempotency keys.
+
+- idempotency_key: a nullable 'claim' column identifying the request that
+  holds the key, so a request whose claim was taken over can not store its
+  response
+"""
+
+from sqlalchemy import Column, String, inspect, text
+
+VERSION = '0012'
+
+
+def upgrade(conn):
+    if 'claim' not in {column['name'] for column in inspect(conn).get_columns('idempotency_key')}:
+        column = Column('claim', String(32))
+        conn.execute(text(f'ALTER TABLE idempotency_key ADD COLUMN claim '
+                          f'{column.type.compile(dialect=conn.dialect)}'))
@@ -0,0 +1,21 @@
+"""
+Add the lease of the background compaction job.
+
+- compaction_lease: a single row naming the worker that runs the job and
+  until when, so one worker compacts per COMPACTION_INTERVAL
+"""
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+
+VERSION = '0013'
+
+compaction_lease = Table(
+    'compaction_lease', MetaData(),
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('owner', String(64), nullable=False),
+    Column('expires_at', DateTime, nullable=False),
+)
+
+
+def upgrade(conn):
+    compaction_lease.create(conn, checkfirst=True)
@@ -14,7 +14,7 @@ Class and Model Descriptions:
 - Source: Represents the 'source' table storing battery sources.
 - Voltage: Represents the 'voltage' table storing battery voltage values.
 - Resistance: Represents the 'resistance' table storing battery resistance values.
-- Photo: Represents the 'photo' table storing battery photos.
+- Photo: Represents the 'photo' table storing the hash and metadata of battery photos.
 - Weight: Represents the 'weight' table storing battery weights.
 """
 
@@ -85,7 +85,12 @@ class Resistance(db.Model):
 class Photo(db.Model):
     __tablename__ = 'photo'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    photo = db.Column(db.LargeBinary)
+    sha256 = db.Column(db.String(64), unique=True, index=True, nullable=False)
+    content_type = db.Column(db.String(50), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime)
 
 
 class Weight(db.Model):
@@ -2,6 +2,8 @@
 Provides database functionality and integration with SQLAlchemy.
 """
 
+from sqlalchemy import DECIMAL
+
 from app.extensions import db
 
 
@@ -18,16 +20,18 @@ class BatteryData(db.Model):
     source_id (int): Foreign key referencing the 'source' table.
     photo_id (int): Foreign key referencing the 'photo' table.
     timestamp (DateTime): The timestamp of the battery data.
+    deleted_at (DateTime): The time the record was soft-deleted; NULL for live records.
     """
 
     __tablename__ = 'battery_data'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     barcode = db.Column(db.Integer, unique=True, nullable=False)
     stock_params_id = db.Column(db.ForeignKey('stock_parameters.id'))
-    real_params_id = db.Column(db.ForeignKey('real_parameters.id'))
-    source_id = db.Column(db.Integer, db.ForeignKey('source.id'))
+    real_params_id = db.Column(db.ForeignKey('real_parameters.id'), index=True)
+    source_id = db.Column(db.Integer, db.ForeignKey('source.id'), index=True)
     photo_id = db.Column(db.Integer, db.ForeignKey('photo.id'))
-    datetime = db.Column(db.DateTime)
+    datetime = db.Column(db.DateTime, index=True)
+    deleted_at = db.Column(db.DateTime, index=True)
 
     stock_params = db.relationship('StockParameters', backref='battery_data')
     real_params = db.relationship('RealParameters', backref='battery_data')
@@ -65,7 +69,9 @@ class StockParameters(db.Model):
 class RealParameters(db.Model):
     """
         Model representing the 'real_parameters' table.
-        This is a table model where the actual battery parameters are stored
+        This is a table model where the actual battery parameters are stored.
+        Every parameter combination is stored once; the combination index also
+        serves lookups by name_id.
 
         Attributes:
         id (int): The primary key of the table.
@@ -78,13 +84,17 @@ class RealParameters(db.Model):
         """
 
     __tablename__ = 'real_parameters'
+    __table_args__ = (
+        db.Index('uq_real_parameters_combination', 'name_id', 'color_id', 'capacity_id',
+                 'resistance_id', 'voltage_id', 'weight_id', unique=True),
+    )
     id = db.Column(db. Integer, primary_key=True, autoincrement=True)
     name_id = db.Column(db.Integer, db.ForeignKey('name.id'))
-    color_id = db.Column(db.Integer, db.ForeignKey('color.id'), nullable=False)
-    capacity_id = db.Column(db.Integer, db.ForeignKey('capacity.id'))
-    resistance_id = db.Column(db.Integer, db.ForeignKey('resistance.id'), nullable=False)
-    voltage_id = db.Column(db.Integer, db.ForeignKey('voltage.id'), nullable=False)
-    weight_id = db.Column(db.Integer, db.ForeignKey('weight.id'))
+    color_id = db.Column(db.Integer, db.ForeignKey('color.id'), nullable=False, index=True)
+    capacity_id = db.Column(db.Integer, db.ForeignKey('capacity.id'), index=True)
+    resistance_id = db.Column(db.Integer, db.ForeignKey('resistance.id'), nullable=False, index=True)
+    voltage_id = db.Column(db.Integer, db.ForeignKey('voltage.id'), nullable=False, index=True)
+    weight_id = db.Column(db.Integer, db.ForeignKey('weight.id'), index=True)
 
     name = db.relationship('Name', backref='real_parameters')
     color = db.relationship('Color', backref='real_parameters')
@@ -92,3 +102,189 @@ class RealParameters(db.Model):
     resistance = db.relationship('Resistance', backref='real_parameters')
     voltage = db.relationship('Voltage', backref='real_parameters')
     weight = db.relationship('Weight', backref='real_parameters')
+
+
+class BarcodeBlock(db.Model):
+    """
+        Model representing the 'barcode_block' table.
+        Barcode ranges reserved by application workers
+
+        Attributes:
+        start (int): The first barcode of the block, the primary key of the table.
+        owner (str): Identifier of the worker process holding the block.
+        leased_at (DateTime): The last time the owner renewed its lease.
+        """
+
+    __tablename__ = 'barcode_block'
+    start = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    owner = db.Column(db.String(64), nullable=False)
+    leased_at = db.Column(db.DateTime, nullable=False)
+
+
+class LookupGeneration(db.Model):
+    """
+        Model representing the 'lookup_generation' table.
+        A single row counting the compactions that deleted lookup rows
+
+        Attributes:
+        id (int): The primary key of the table, always 1.
+        generation (int): Incremented whenever rows of the lookup tables are deleted.
+        updated_at (DateTime): The time of the last increment.
+        """
+
+    __tablename__ = 'lookup_generation'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+class ReplicaHeartbeat(db.Model):
+    """
+        Model representing the 'replica_heartbeat' table.
+        A single row updated on the primary database; its age on a read replica is the replication lag
+
+        Attributes:
+        id (int): The primary key of the table, always 1.
+        beat_ms (int): The time of the last update in milliseconds since the epoch.
+        """
+
+    __tablename__ = 'replica_heartbeat'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    beat_ms = db.Column(db.BigInteger, nullable=False)
+
+
+class ImportCheckpoint(db.Model):
+    """
+        Model representing the 'import_checkpoint' table.
+        Progress of the file imports of 'flask batteryhub import'
+
+        Attributes:
+        source (str): The absolute path of the imported file, the primary key of the table.
+        fingerprint (str): Hash of the file size and head, to detect a changed file.
+        rows_read (int): The number of data rows of the file covered by committed chunks.
+        rows_imported (int): The number of imported records.
+        rows_rejected (int): The number of rows written to the reject file.
+        reject_offset (int): The size of the reject file after the last committed chunk.
+        finished (bool): Whether the whole file was imported.
+        updated_at (DateTime): The time of the last committed chunk.
+        """
+
+    __tablename__ = 'import_checkpoint'
+    source = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    rows_read = db.Column(db.Integer, nullable=False, default=0)
+    rows_imported = db.Column(db.Integer, nullable=False, default=0)
+    rows_rejected = db.Column(db.Integer, nullable=False, default=0)
+    reject_offset = db.Column(db.BigInteger, nullable=False, default=0)
+    finished = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+class IdempotencyKey(db.Model):
+    """
+        Model representing the 'idempotency_key' table.
+        Responses of record creation requests sent with an Idempotency-Key header
+
+        Attributes:
+        key (str): SHA-256 of the method, path and header value, the primary key of the table.
+        fingerprint (str): SHA-256 of the request body, to detect a key reused for another request.
+        status_code (int): The status of the stored response; NULL while the first request runs.
+        body (str): The stored response body.
+        mimetype (str): The content type of the stored response.
+        created_at (DateTime): The time the first request started.
+        claim (str): Random token of the request holding the key; only that request stores its response.
+        """
+
+    __tablename__ = 'idempotency_key'
+    key = db.Column(db.String(64), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    body = db.Column(db.Text)
+    mimetype = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    claim = db.Column(db.String(32))
+
+
+class RecordChange(db.Model):
+    """
+        Model representing the 'record_change' table.
+        The log of committed writes read by the change feed of every worker
+
+        Attributes:
+        id (int): The primary key of the table, the id of the change event.
+        action (str): 'create', 'update' or 'delete'.
+        barcodes (str): JSON array of the barcodes of the changed records.
+        created_at (DateTime): The time the change was logged.
+        """
+
+    __tablename__ = 'record_change'
+    id = db.Column(db.Integer, primary_key=True)
+    action = db.Column(db.String(10), nullable=False)
+    barcodes = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class BatteryFlat(db.Model):
+    """
+        Model representing the 'battery_flat' table.
+        Denormalized read model with one row per 'battery_data' row and the
+        parameter values copied from the lookup tables
+
+        Attributes:
+        id (int): The primary key of the table, equal to 'battery_data.id'.
+        barcode (int): The unique barcode of the battery.
+        datetime (DateTime): The timestamp of the battery data.
+        name (str): The battery name.
+        color (str): The battery color.
+        voltage (Decimal): The measured voltage.
+        resistance (Decimal): The measured internal resistance.
+        source (str): The battery source.
+        weight (Decimal): The battery weight.
+        capacity (int): The measured capacity.
+        """
+
+    __tablename__ = 'battery_flat'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    barcode = db.Column(db.Integer, unique=True, nullable=False)
+    datetime = db.Column(db.DateTime, index=True)
+    name = db.Column(db.String(50), index=True)
+    color = db.Column(db.String(20), index=True, nullable=False)
+    voltage = db.Column(DECIMAL(precision=3, scale=2), index=True, nullable=False)
+    resistance = db.Column(DECIMAL(precision=5, scale=2), index=True, nullable=False)
+    source = db.Column(db.String(50), index=True)
+    weight = db.Column(DECIMAL(precision=4, scale=3))
+    capacity = db.Column(db.Integer, index=True)
+
+
+class IngestFailure(db.Model):
+    """
+        Model representing the 'ingest_failure' table.
+        Records accepted by the write-behind ingest that could not be stored
+
+        Attributes:
+        barcode (int): The barcode given to the client, the primary key of the table.
+        error (str): The error of the failed write.
+        failed_at (DateTime): The time the write failed.
+        """
+
+    __tablename__ = 'ingest_failure'
+    barcode = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    error = db.Column(db.Text, nullable=False)
+    failed_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class CompactionLease(db.Model):
+    """
+        Model representing the 'compaction_lease' table.
+        A single row naming the worker that runs the background compaction
+
+        Attributes:
+        id (int): The primary key of the table, always 1.
+        owner (str): Identifier of the worker process holding the lease.
+        expires_at (DateTime): The time (UTC) another worker may take the lease over.
+        """
+
+    __tablename__ = 'compaction_lease'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    owner = db.Column(db.String(64), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
@@ -1,113 +1,506 @@
 import datetime
+import json
 
-from flask import request
-from app.models.parameters import Voltage, Capacity, Resistance, Name, Color, Source
-from app.services.barcode_gen import barcode_gen
+from flask import current_app, request
+from app.services.barcode_gen import allocator, barcode_gen
+from app.services.db import Database
+from app.services.packing import SELECTIONS, parse_topology
+from app.services.similarity import FEATURES
+from app.services.stats import DEFAULT_PERCENTILES
+from app.validator.batch import validate_batch
 from app.validator.records_model import APIData
 
+FILTER_ARGS = ('min_voltage', 'max_voltage',
+               'min_capacity', 'max_capacity', 'min_resistance',
+               'max_resistance', 'name', 'color', 'source')
+
+# The record fields a bulk update can change
+UPDATABLE_FIELDS = ('name', 'color', 'resistance', 'voltage', 'capacity', 'weight', 'source')
+
 
 class APIHandler:
     @classmethod
-    def sorting_args_handler(cls, args_list):
+    def filter_args(cls, args_list) -> dict:
         """
-        Handle sorting arguments and generate sorting conditions for SQLAlchemy query.
+        Pick the non-empty filter arguments.
 
         Args:
-        - args_list: a dictionary of sorting arguments
+        - args_list: a dictionary of request arguments
 
         Returns:
-        - A list of SQLAlchemy filtering conditions
+        - A dictionary with the given filter arguments
         """
-        args = ['min_voltage', 'max_voltage',
-                'min_capacity', 'max_capacity', 'min_resistance',
-                'max_resistance', 'name', 'color', 'source']
-
         args_validate = {}
 
-        for arg in args:
+        for arg in FILTER_ARGS:
             if arg in args_list and args_list[arg] != '':
                 args_validate[arg] = args_list[arg]
 
+        return args_validate
+
+    @classmethod
+    def sorting_args_handler(cls, args_list):
+        """
+        Handle sorting arguments and generate sorting conditions for SQLAlchemy query.
+
+        Args:
+        - args_list: a dictionary of sorting arguments
+
+        Returns:
+        - A list of SQLAlchemy filtering conditions
+        """
+        args_validate = cls.filter_args(args_list)
+
+        columns = Database.read_columns()
         sorting_conditions = []
 
         if 'min_voltage' in args_validate and 'max_voltage' in args_validate:
-            sorting_conditions.append(Voltage.voltage.between(
+            sorting_conditions.append(columns['voltage'].between(
                 args_validate['min_voltage'],
                 args_validate['max_voltage']
             ))
 
         if 'min_voltage' in args_validate:
-            sorting_conditions.append(Voltage.voltage > args_validate['min_voltage'])
+            sorting_conditions.append(columns['voltage'] > args_validate['min_voltage'])
 
         if 'max_voltage' in args_validate:
-            sorting_conditions.append(Voltage.voltage < args_validate['max_voltage'])
+            sorting_conditions.append(columns['voltage'] < args_validate['max_voltage'])
 
         if 'min_resistance' in args_validate and 'max_resistance' in args_validate:
-            sorting_conditions.append(Resistance.resistance.between(
+            sorting_conditions.append(columns['resistance'].between(
                 args_validate['min_resistance'],
                 args_validate['max_resistance']
             ))
 
         if 'min_resistance' in args_validate:
-            sorting_conditions.append(Resistance.resistance > args_validate['min_resistance'])
+            sorting_conditions.append(columns['resistance'] > args_validate['min_resistance'])
 
         if 'max_resistance' in args_validate:
-            sorting_conditions.append(Resistance.resistance < args_validate['max_resistance'])
+            sorting_conditions.append(columns['resistance'] < args_validate['max_resistance'])
 
         if 'min_capacity' in args_validate and 'max_capacity' in args_validate:
-            sorting_conditions.append(Capacity.capacity.between(
+            sorting_conditions.append(columns['capacity'].between(
                 args_validate['min_capacity'],
                 args_validate['max_capacity']
             ))
 
         if 'min_capacity' in args_validate:
-            sorting_conditions.append(Capacity.capacity > args_validate['min_capacity'])
+            sorting_conditions.append(columns['capacity'] > args_validate['min_capacity'])
 
         if 'max_capacity' in args_validate:
-            sorting_conditions.append(Capacity.capacity < args_validate['max_capacity'])
+            sorting_conditions.append(columns['capacity'] < args_validate['max_capacity'])
 
         if 'name' in args_validate:
-            sorting_conditions.append(Name.name == args_validate['name'])
+            sorting_conditions.append(columns['name'] == args_validate['name'])
 
         if 'color' in args_validate:
-            sorting_conditions.append(Color.color == args_validate['color'])
+            sorting_conditions.append(columns['color'] == args_validate['color'])
 
         if 'source' in args_validate:
-            sorting_conditions.append(Source.source == args_validate['source'])
+            sorting_conditions.append(columns['source'] == args_validate['source'])
 
         return sorting_conditions
 
     @classmethod
-    def records_handler(cls, data_form: request):
+    def pagination_args_handler(cls, args_list, sort_columns) -> dict | str:
         """
-        Handle records data from the request and convert it into a list of APIData objects.
+        Handle sorting and pagination arguments of a records list request.
 
         Args:
-        - data_form: the request object
+        - args_list: a dictionary of request arguments
+        - sort_columns: the names of the columns records can be sorted by
+
+        Returns:
+        - A dictionary with 'sort_by', 'order_by', 'limit' and 'cursor',
+          or an error message if an argument is invalid
+        """
+        sort_by = args_list.get('sort_by') or 'id'
+        order_by = args_list.get('order_by') or 'asc'
+
+        if sort_by not in sort_columns:
+            return f"Invalid sort_by: {sort_by}. Expected one of: {', '.join(sort_columns)}"
+        if order_by not in ('asc', 'desc'):
+            return "Invalid order_by. Expected 'asc' or 'desc'"
+
+        limit = None
+        cursor = args_list.get('cursor') or None
+        max_page_size = current_app.config.get('RECORDS_MAX_PAGE_SIZE', 1000)
+
+        if args_list.get('limit') or cursor:
+            try:
+                limit = int(args_list.get('limit') or current_app.config.get('RECORDS_PAGE_SIZE', 100))
+            except ValueError:
+                return "Limit must be an integer"
+            if not 1 <= limit <= max_page_size:
+                return f"Limit must be between 1 and {max_page_size}"
+
+        return {'sort_by': sort_by, 'order_by': order_by, 'limit': limit, 'cursor': cursor}
+
+    @classmethod
+    def pack_args_handler(cls, args_list) -> dict | str:
+        """
+        Handle the arguments of a pack matching request.
+
+        Args:
+        - args_list: a dictionary of request arguments
+
+        Returns:
+        - A dictionary with 'topology', 'selection' and 'ir_weight',
+          or an error message if an argument is invalid
+        """
+        try:
+            topology = parse_topology(args_list.get('topology'))
+        except ValueError as ex:
+            return str(ex)
+
+        max_cells = current_app.config.get('PACK_MAX_CELLS', 5000)
+        if topology.cells > max_cells:
+            return f"A pack must not have more than {max_cells} cells"
+
+        selection = args_list.get('selection') or 'uniform'
+        if selection not in SELECTIONS:
+            return f"Invalid selection: {selection}. Expected one of: {', '.join(SELECTIONS)}"
+
+        try:
+            ir_weight = float(args_list.get('ir_weight') or 1.0)
+        except ValueError:
+            return "ir_weight must be a number"
+        if ir_weight < 0:
+            return "ir_weight must not be negative"
+
+        return {'topology': topology, 'selection': selection, 'ir_weight': ir_weight}
+
+    @classmethod
+    def similar_args_handler(cls, args_list, target_required: bool = True) -> dict | str:
+        """
+        Handle the arguments of a similar cells request.
+
+        Args:
+        - args_list: a dictionary of request arguments
+        - target_required: whether at least one target value must be given
+
+        Returns:
+        - A dictionary with 'k' and the 'target' values,
+          or an error message if an argument is invalid
+        """
+        max_k = current_app.config.get('SIMILAR_MAX_K', 100)
+        try:
+            k = int(args_list.get('k') or 10)
+        except ValueError:
+            return "k must be an integer"
+        if not 1 <= k <= max_k:
+            return f"k must be between 1 and {max_k}"
+
+        target = {}
+        for feature in FEATURES:
+            if args_list.get(feature):
+                try:
+                    target[feature] = float(args_list[feature])
+                except ValueError:
+                    return f"{feature} must be a number"
+
+        if target_required and not target:
+            return f"At least one of {', '.join(FEATURES)} is required"
+
+        return {'k': k, 'target': target}
+
+    @classmethod
+    def stats_args_handler(cls, args_list) -> dict | str:
+        """
+        Handle the histogram and percentile arguments of a statistics request.
+
+        Args:
+        - args_list: a dictionary of request arguments
 
         Returns:
-        - A list of APIData objects representing the records data
+        - A dictionary with 'bins' and 'percentiles',
+          or an error message if an argument is invalid
         """
+        max_bins = current_app.config.get('STATS_MAX_BINS', 200)
         try:
-            json_records = data_form.get_json()
-            current_datetime = \
-                datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            api_data = APIData(
-                    barcode=int(barcode_gen()),
-                    name=json_records['name'],
-                    color=json_records['color'],
-                    resistance=float(json_records['resistance']),
-                    voltage=float(json_records['voltage']),
-                    source=json_records['source'],
-                    capacity=int(json_records['capacity']),
-                    weight=float(json_records['weight']),
-                    datetime=current_datetime
-            )
-            return api_data
-        except KeyError as ex:
+            bins = int(args_list.get('bins') or 20)
+        except ValueError:
+            return "bins must be an integer"
+        if not 1 <= bins <= max_bins:
+            return f"bins must be between 1 and {max_bins}"
+
+        percentiles = DEFAULT_PERCENTILES
+        if args_list.get('percentiles'):
+            try:
+                percentiles = sorted({float(value) for value in args_list['percentiles'].split(',')})
+            except ValueError:
+                return "percentiles must be a comma separated list of numbers"
+            if not all(0 < value <= 100 for value in percentiles):
+                return "percentiles must be greater than 0 and at most 100"
+
+        return {'bins': bins, 'percentiles': percentiles}
+
+    @classmethod
+    def record_to_api_data(cls, json_record: dict, barcode: int, current_datetime: str) -> APIData:
+        """
+        Convert one JSON record into an APIData object.
+
+        Args:
+        - json_record: a dictionary with the record fields
+        - barcode: the barcode assigned to the record
+        - current_datetime: the record datetime in the '%Y-%m-%d %H:%M:%S' format
+
+        Returns:
+        - An APIData object representing the record
+        """
+        return APIData(
+                barcode=int(barcode),
+                name=json_record['name'],
+                color=json_record['color'],
+                resistance=float(json_record['resistance']),
+                voltage=float(json_record['voltage']),
+                source=json_record['source'],
+                capacity=int(json_record['capacity']),
+                weight=float(json_record['weight']),
+                datetime=current_datetime
+        )
+
+    @classmethod
+    def record_error(cls, ex: Exception) -> str:
+        """
+        The error message of a record that could not be converted.
+
+        Args:
+        - ex: the exception raised while converting the record
+
+        Returns:
+        - The error message
+        """
+        if isinstance(ex, KeyError):
             return f"Missing key in JSON record: {ex}"
-        except (TypeError, ValueError) as ex:
+        if isinstance(ex, (TypeError, ValueError)):
             return f"Invalid value in JSON record: {ex}"
+        return f"Error processing JSON records: {ex}"
+
+    @classmethod
+    def records_to_api_data(cls, json_records: list, barcodes: list[int], datetimes: list[str]) -> list[APIData | str]:
+        """
+        Convert many JSON records into APIData objects at once.
+
+        The batch is validated column by column with validate_batch; the records it
+        leaves out are converted one by one with record_to_api_data. The results are
+        the same as converting every record with record_to_api_data.
+
+        Args:
+        - json_records: the record dictionaries
+        - barcodes: the barcode assigned to every record
+        - datetimes: the datetime of every record in the '%Y-%m-%d %H:%M:%S' format
+
+        Returns:
+        - A list with an APIData object or an error message for every record
+        """
+        results = validate_batch(json_records, barcodes, datetimes)
+        for index, result in enumerate(results):
+            if type(result) is APIData:
+                continue
+            if result is None:
+                try:
+                    result = cls.record_to_api_data(json_records[index], barcodes[index], datetimes[index])
+                except Exception as ex:
+                    result = ex
+            results[index] = cls.record_error(result) if isinstance(result, Exception) else result
+        return results
+
+    @classmethod
+    def records_handler(cls, data_form: request) -> APIData | str:
+        """
+        Handle a single record from the request and convert it into an APIData object.
+
+        The record gets a new barcode, which is released again if the record is invalid.
+
+        Args:
+        - data_form: the request object
+
+        Returns:
+        - The APIData object of the record, or an error message
+        """
+        json_record = cls.json_body(data_form)
+        if isinstance(json_record, str):
+            return json_record
+
+        current_datetime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        barcode = barcode_gen()
+        try:
+            return cls.record_to_api_data(json_record, barcode, current_datetime)
+        except Exception as ex:
+            allocator.release(barcode)
+            return cls.record_error(ex)
+
+    @classmethod
+    def batch_records_handler(cls, data_form: request) -> list[APIData | str] | str:
+        """
+        Handle a batch of records from the request.
+
+        The body is either a JSON array of records (optionally encoded as a JSON string)
+        or NDJSON with one record per line when sent as 'application/x-ndjson'.
+        Every record gets a barcode; barcodes of invalid records are released again.
+
+        Args:
+        - data_form: the request object
+
+        Returns:
+        - A list with an APIData object or an error message for every record,
+          or an error message if the body can not be parsed
+        """
+        try:
+            if data_form.mimetype == 'application/x-ndjson':
+                lines = data_form.get_data(as_text=True).splitlines()
+                json_records = [json.loads(line) for line in lines if line.strip()]
+            else:
+                json_records = data_form.get_json()
+                if isinstance(json_records, str):
+                    json_records = json.loads(json_records)
+        except ValueError as ex:
+            return f"Invalid JSON body: {ex}"
+
+        if not isinstance(json_records, list):
+            return "Batch body must be a list of records"
+
+        max_records = current_app.config.get('BATCH_MAX_RECORDS', 10000)
+        if len(json_records) > max_records:
+            return f"Batch must not contain more than {max_records} records"
+
+        current_datetime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        barcodes = allocator.allocate_many(len(json_records))
+
+        results = cls.records_to_api_data(json_records, barcodes, [current_datetime] * len(json_records))
+        for result, barcode in zip(results, barcodes):
+            if isinstance(result, str):
+                allocator.release(barcode)
+
+        return results
+
+    @classmethod
+    def json_body(cls, data_form: request) -> dict | str:
+        """
+        The JSON object in the body of a request; a JSON encoded string is decoded once more.
+
+        Args:
+        - data_form: the request object
+
+        Returns:
+        - The body as a dictionary, or an error message if it is not a JSON object
+        """
+        try:
+            body = data_form.get_json()
+            if isinstance(body, str):
+                body = json.loads(body)
+        except ValueError as ex:
+            return f"Invalid JSON body: {ex}"
+        if not isinstance(body, dict):
+            return "Body must be a JSON object"
+        return body
+
+    @classmethod
+    def selection_handler(cls, body: dict) -> dict | str:
+        """
+        Check the records selected by a bulk request body: either 'barcodes' (a list
+        of barcodes) or 'filter' (the filter arguments of the records list).
+
+        Args:
+        - body: the request body
+
+        Returns:
+        - A dictionary with either 'barcodes' or 'conditions', or an error message
+        """
+        if ('barcodes' in body) == ('filter' in body):
+            return "Either 'barcodes' or 'filter' is required"
+
+        if 'barcodes' in body:
+            barcodes = body['barcodes']
+            if not isinstance(barcodes, list) or not barcodes:
+                return "'barcodes' must be a non-empty list"
+            max_records = current_app.config.get('BATCH_MAX_RECORDS', 10000)
+            if len(barcodes) > max_records:
+                return f"'barcodes' must not contain more than {max_records} barcodes"
+            try:
+                barcodes = sorted({int(barcode) for barcode in barcodes})
+            except (TypeError, ValueError):
+                return "Barcodes must be integers"
+            return {'barcodes': barcodes}
+
+        filters = body['filter']
+        if not isinstance(filters, dict):
+            return "'filter' must be an object"
+        unknown = sorted(set(filters) - set(FILTER_ARGS))
+        if unknown:
+            return f"Unknown filter arguments: {', '.join(unknown)}"
+        # An empty filter would select every record
+        if not cls.filter_args(filters):
+            return "'filter' must have at least one non-empty argument"
+        return {'conditions': cls.sorting_args_handler(filters)}
+
+    @classmethod
+    def patch_records_handler(cls, data_form: request) -> dict | str:
+        """
+        Handle the body of a bulk update request.
+
+        The body is a JSON object with the fields to change in 'set' and the records
+        to change in either 'barcodes' (a list of barcodes) or 'filter' (the filter
+        arguments of the records list, like {"source": "laptop", "max_voltage": "2.5"}).
+
+        Args:
+        - data_form: the request object
+
+        Returns:
+        - A dictionary with the validated 'values' and either 'barcodes' or 'conditions',
+          or an error message if the body is invalid
+        """
+        body = cls.json_body(data_form)
+        if isinstance(body, str):
+            return body
+
+        values = body.get('set')
+        if not isinstance(values, dict) or not values:
+            return f"'set' must be an object with at least one of: {', '.join(UPDATABLE_FIELDS)}"
+        unknown = sorted(set(values) - set(UPDATABLE_FIELDS))
+        if unknown:
+            return f"Fields can not be updated: {', '.join(unknown)}. Expected any of: {', '.join(UPDATABLE_FIELDS)}"
+
+        # The given fields are validated by APIData with valid values for the other fields
+        placeholder = {'name': 'x', 'color': 'xx', 'resistance': 1, 'voltage': 1,
+                       'source': 'x', 'capacity': 1, 'weight': 1}
+        try:
+            record = cls.record_to_api_data(dict(placeholder, **values), 100000,
+                                            datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
         except Exception as ex:
-            return f"Error processing JSON records: {ex}"
+            return cls.record_error(ex)
+        values = {field: getattr(record, field) for field in values}
+
+        selection = cls.selection_handler(body)
+        if isinstance(selection, str):
+            return selection
+        return dict(selection, values=values)
+
+    @classmethod
+    def delete_records_handler(cls, data_form: request) -> dict | str:
+        """
+        Handle the body of a bulk delete request.
+
+        The body selects the records with either 'barcodes' or 'filter' like a bulk
+        update and may set 'soft' to override the SOFT_DELETE setting.
+
+        Args:
+        - data_form: the request object
+
+        Returns:
+        - A dictionary with 'soft' and either 'barcodes' or 'conditions',
+          or an error message if the body is invalid
+        """
+        body = cls.json_body(data_form)
+        if isinstance(body, str):
+            return body
+
+        soft = body.get('soft', current_app.config.get('SOFT_DELETE', False))
+        if not isinstance(soft, bool):
+            return "'soft' must be true or false"
 
+        selection = cls.selection_handler(body)
+        if isinstance(selection, str):
+            return selection
+        return dict(selection, soft=soft)
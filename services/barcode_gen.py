@@ -1,22 +1,352 @@
+import datetime
+import os
 import random
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import exc, insert, or_, select, update
+
 from app import db
-from app.models.records import BatteryData
+from app.exceptions import BarcodeSpaceExhaustedError
+from app.models.records import BarcodeBlock, BatteryData
+
+BARCODE_MIN = 100000
+BARCODE_MAX = 999999
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+# Random blocks tried before scanning all blocks for free space
+PICK_BLOCK_PROBES = 32
+
+
+class BarcodeAllocator:
+    """
+    Allocates unique barcodes from the six-digit barcode space.
+
+    The allocator keeps an occupancy bitmap over the 100000-999999 range that is
+    seeded from the database once per process. Barcodes are handed out from blocks
+    that the worker reserves in the 'barcode_block' table, so several worker
+    processes never hand out the same barcode. Blocks are leased: a block whose
+    owner stopped renewing it can be taken over by another worker.
+
+    Attributes:
+        block_size (int): Number of barcodes in a reserved block.
+        lease_seconds (int): How long a block stays reserved without renewal.
+    """
+
+    def __init__(self, block_size: int = 100, lease_seconds: int = 3600):
+        self.block_size = block_size
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._reset()
+
+    def init_app(self, app):
+        """
+        Read the allocator settings from the application config.
+
+        Args:
+            app: The Flask application.
+        """
+        self.block_size = app.config.get('BARCODE_BLOCK_SIZE', self.block_size)
+        self.lease_seconds = app.config.get('BARCODE_LEASE_SECONDS', self.lease_seconds)
+        app.extensions['barcode_allocator'] = self
+        self._reset()
+
+    def _reset(self):
+        span = BARCODE_MAX - BARCODE_MIN + 1
+        self._pid = os.getpid()
+        self._owner = f'{socket.gethostname()[:40]}:{self._pid}:{uuid.uuid4().hex[:8]}'
+        self._bitmap = bytearray((span + 7) // 8)
+        self._block_count = (span + self.block_size - 1) // self.block_size
+        self._block_used = [0] * self._block_count
+        self._foreign_blocks = set()
+        self._seeded = False
+        self._used = 0
+        self._block = None
+        self._block_cursor = 0
+        self._leased_at = None
+        self._metrics = {
+            'allocations': 0,
+            'blocks_reserved': 0,
+            'latency_seconds_sum': 0.0,
+            'latency_seconds_max': 0.0,
+            'latency_buckets': [0] * len(LATENCY_BUCKETS),
+        }
+
+    def _is_used(self, barcode: int) -> bool:
+        offset = barcode - BARCODE_MIN
+        return bool(self._bitmap[offset >> 3] & (1 << (offset & 7)))
+
+    def _mark(self, barcode: int, used: bool):
+        offset = barcode - BARCODE_MIN
+        if used == self._is_used(barcode):
+            return
+        if used:
+            self._bitmap[offset >> 3] |= 1 << (offset & 7)
+        else:
+            self._bitmap[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+        delta = 1 if used else -1
+        self._block_used[offset // self.block_size] += delta
+        self._used += delta
+
+    def _block_range(self, index: int) -> tuple[int, int]:
+        start = BARCODE_MIN + index * self.block_size
+        return start, min(start + self.block_size - 1, BARCODE_MAX)
+
+    def _block_capacity(self, index: int) -> int:
+        start, end = self._block_range(index)
+        return end - start + 1
+
+    def _lease_expiry(self) -> datetime.datetime:
+        return datetime.datetime.utcnow() - datetime.timedelta(seconds=self.lease_seconds)
+
+    def _seed(self):
+        """
+        Load the used barcodes and the blocks reserved by other workers.
+        """
+        with db.engine.begin() as conn:
+            self._bitmap = bytearray(len(self._bitmap))
+            self._block_used = [0] * self._block_count
+            self._used = 0
+            for barcode in conn.execute(select(BatteryData.barcode)).scalars():
+                if BARCODE_MIN <= barcode <= BARCODE_MAX:
+                    self._mark(barcode, True)
+
+            blocks = conn.execute(
+                select(BarcodeBlock.start).where(
+                    BarcodeBlock.owner != self._owner,
+                    BarcodeBlock.leased_at >= self._lease_expiry()
+                )
+            ).scalars()
+            self._foreign_blocks = {(start - BARCODE_MIN) // self.block_size for start in blocks}
+        self._seeded = True
+
+    def _has_room(self, index: int) -> bool:
+        return index not in self._foreign_blocks and self._block_used[index] < self._block_capacity(index)
+
+    def _pick_block(self) -> int | None:
+        # Unless the space is nearly full a random probe finds a free block without a full scan
+        for _ in range(PICK_BLOCK_PROBES):
+            index = random.randrange(self._block_count)
+            if self._has_room(index):
+                return index
+        candidates = [index for index in range(self._block_count) if self._has_room(index)]
+        if not candidates:
+            return None
+        return random.choice(candidates)
+
+    def _reserve(self, index: int) -> bool:
+        """
+        Try to reserve a block for this worker.
+
+        Args:
+            index (int): The block index.
+
+        Returns:
+            bool: True if the block now belongs to this worker.
+        """
+        start, end = self._block_range(index)
+        now = datetime.datetime.utcnow()
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(BarcodeBlock).values(start=start, owner=self._owner, leased_at=now))
+        except exc.IntegrityError:
+            with db.engine.begin() as conn:
+                result = conn.execute(
+                    update(BarcodeBlock)
+                    .where(BarcodeBlock.start == start,
+                           or_(BarcodeBlock.owner == self._owner,
+                               BarcodeBlock.leased_at < self._lease_expiry()))
+                    .values(owner=self._owner, leased_at=now)
+                )
+            if result.rowcount != 1:
+                self._foreign_blocks.add(index)
+                return False
+
+        with db.engine.connect() as conn:
+            used = conn.execute(
+                select(BatteryData.barcode).where(BatteryData.barcode.between(start, end))
+            ).scalars().all()
+        for barcode in used:
+            self._mark(barcode, True)
+
+        self._block = index
+        self._block_cursor = start
+        self._leased_at = now
+        self._metrics['blocks_reserved'] += 1
+        return True
+
+    def _renew_lease(self) -> bool:
+        now = datetime.datetime.utcnow()
+        if (now - self._leased_at).total_seconds() < self.lease_seconds / 2:
+            return True
+        start, _ = self._block_range(self._block)
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                update(BarcodeBlock)
+                .where(BarcodeBlock.start == start, BarcodeBlock.owner == self._owner)
+                .values(leased_at=now)
+            )
+        if result.rowcount != 1:
+            self._block = None
+            return False
+        self._leased_at = now
+        return True
+
+    def _next_in_block(self) -> int | None:
+        if self._block is None or not self._renew_lease():
+            return None
+        _, end = self._block_range(self._block)
+        for barcode in range(self._block_cursor, end + 1):
+            if not self._is_used(barcode):
+                self._mark(barcode, True)
+                self._block_cursor = barcode + 1
+                return barcode
+        self._block = None
+        return None
+
+    def _release(self, barcode: int):
+        if not BARCODE_MIN <= barcode <= BARCODE_MAX:
+            return
+        self._mark(barcode, False)
+        if self._block is not None and (barcode - BARCODE_MIN) // self.block_size == self._block:
+            self._block_cursor = min(self._block_cursor, barcode)
+
+    def _allocate(self) -> int:
+        if self._pid != os.getpid():
+            self._reset()
+        if not self._seeded:
+            self._seed()
+
+        reseeded = False
+        while True:
+            barcode = self._next_in_block()
+            if barcode is not None:
+                return barcode
+
+            index = self._pick_block()
+            if index is None:
+                if reseeded:
+                    raise BarcodeSpaceExhaustedError(BARCODE_MIN, BARCODE_MAX)
+                self._seed()
+                reseeded = True
+                continue
+            self._reserve(index)
+
+    def _observe(self, elapsed: float):
+        self._metrics['allocations'] += 1
+        self._metrics['latency_seconds_sum'] += elapsed
+        self._metrics['latency_seconds_max'] = max(self._metrics['latency_seconds_max'], elapsed)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                self._metrics['latency_buckets'][i] += 1
+                break
+
+    def allocate(self) -> int:
+        """
+        Allocate one unused barcode.
+
+        Returns:
+            int: The allocated barcode.
+
+        Raises:
+            BarcodeSpaceExhaustedError: If no free barcode is left.
+        """
+        with self._lock:
+            started = time.perf_counter()
+            barcode = self._allocate()
+            self._observe(time.perf_counter() - started)
+            return barcode
+
+    def allocate_many(self, count: int) -> list[int]:
+        """
+        Allocate several unused barcodes at once.
+
+        Args:
+            count (int): The number of barcodes to allocate.
+
+        Returns:
+            list[int]: The allocated barcodes.
+        """
+        with self._lock:
+            barcodes = []
+            try:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    barcodes.append(self._allocate())
+                    self._observe(time.perf_counter() - started)
+            except BarcodeSpaceExhaustedError:
+                for barcode in barcodes:
+                    self._release(barcode)
+                raise
+            return barcodes
+
+    def is_leased(self, barcode: int) -> bool:
+        """
+        Whether the block of a barcode is reserved by a worker, which may hand it out.
+
+        Args:
+            barcode (int): The barcode.
+
+        Returns:
+            bool: True if a worker holds a current lease on the block.
+        """
+        if not BARCODE_MIN <= barcode <= BARCODE_MAX:
+            return False
+        start, _ = self._block_range((barcode - BARCODE_MIN) // self.block_size)
+        with db.engine.connect() as conn:
+            leased = conn.execute(select(BarcodeBlock.start).where(BarcodeBlock.start == start,
+                                                                  BarcodeBlock.leased_at >= self._lease_expiry()))
+            return leased.first() is not None
+
+    def release(self, barcode: int):
+        """
+        Return an allocated but unused barcode to the free space.
+
+        Args:
+            barcode (int): The barcode that was not stored.
+        """
+        with self._lock:
+            self._release(barcode)
+
+    def stats(self) -> dict:
+        """
+        Occupancy and allocation latency metrics of this worker.
+
+        Returns:
+            dict: The allocator metrics.
+        """
+        with self._lock:
+            capacity = BARCODE_MAX - BARCODE_MIN + 1
+            allocations = self._metrics['allocations']
+            return {
+                'capacity': capacity,
+                'used': self._used,
+                'occupancy': self._used / capacity,
+                'blocks_foreign': len(self._foreign_blocks),
+                'current_block': self._block_range(self._block)[0] if self._block is not None else None,
+                'allocations': allocations,
+                'blocks_reserved': self._metrics['blocks_reserved'],
+                'latency_seconds_sum': self._metrics['latency_seconds_sum'],
+                'latency_seconds_avg': self._metrics['latency_seconds_sum'] / allocations if allocations else 0.0,
+                'latency_seconds_max': self._metrics['latency_seconds_max'],
+                'latency_buckets': dict(zip(LATENCY_BUCKETS, self._metrics['latency_buckets'])),
+            }
+
+
+allocator = BarcodeAllocator()
 
 
 def barcode_gen() -> int:
     """
       Generate a unique barcode number.
 
-      This function checks for the presence of a barcode in the database table.
-      If no barcode exists, it generates a unique barcode number and returns it.
+      The barcode is taken from the process-wide allocator, which only reads
+      the database when it reserves a new block of barcodes.
 
       Returns:
           int: Unique barcode number.
       """
-    existing_barcodes = db.session.query(BatteryData.barcode).all()
-    existing_barcodes = set(barcode[0] for barcode in existing_barcodes)
-
-    while True:
-        barcode = random.randint(100000, 999999)
-        if barcode not in existing_barcodes:
-            return barcode
+    return allocator.allocate()
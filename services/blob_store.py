@@ -0,0 +1,131 @@
+"""
+Content-addressed file store on local disk.
+
+Every blob is stored once under the SHA-256 of its content, in a two-level
+directory fan-out (ab/cd/abcd...). Blobs are written to a temporary file
+while they are hashed and moved into place with an atomic rename, so a
+reader never sees a partial blob and storing the same content twice keeps
+the first file. Derived files, like thumbnails, are stored next to the
+blobs under a variant directory.
+"""
+
+import hashlib
+import io
+import os
+import re
+import tempfile
+from typing import BinaryIO, Callable
+
+from app.exceptions import BlobTooLargeError
+
+COPY_CHUNK_SIZE = 65536
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobStore:
+    """
+    Hash-named, deduplicated blob files under a root directory.
+
+    Attributes:
+        root (str): The directory of the store.
+    """
+
+    def __init__(self, root: str = 'photos'):
+        self.root = os.path.abspath(root)
+
+    def init_app(self, app):
+        """
+        Read the store directory from the application config.
+
+        Args:
+            app: The Flask application.
+        """
+        self.root = os.path.abspath(app.config.get('PHOTO_STORE_PATH', self.root))
+        app.extensions['blob_store'] = self
+
+    @staticmethod
+    def is_digest(value: str) -> bool:
+        return bool(DIGEST_PATTERN.match(value))
+
+    def path(self, digest: str, variant: str | None = None, suffix: str = '') -> str:
+        """
+        The file of a blob, or of a variant of it.
+
+        Args:
+            digest (str): The SHA-256 of the blob.
+            variant (str | None): The name of a derived file, like 'thumb-256'.
+            suffix (str): The file name extension of the variant.
+        """
+        if not self.is_digest(digest):
+            raise ValueError(f'Invalid blob digest: {digest!r}')
+        parts = [self.root] if variant is None else [self.root, 'variants', variant]
+        return os.path.join(*parts, digest[:2], digest[2:4], digest + suffix)
+
+    def exists(self, digest: str, variant: str | None = None, suffix: str = '') -> bool:
+        return os.path.isfile(self.path(digest, variant, suffix))
+
+    def _temporary_file(self):
+        directory = os.path.join(self.root, 'tmp')
+        os.makedirs(directory, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=directory, delete=False)
+
+    def _move_into_place(self, temporary: str, target: str):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            # Same content: keep the stored file
+            os.unlink(temporary)
+        else:
+            os.replace(temporary, target)
+
+    def put(self, stream: BinaryIO, max_bytes: int | None = None,
+            check: Callable[[str], None] | None = None) -> tuple[str, int]:
+        """
+        Store the content of a stream.
+
+        Args:
+            stream: A binary stream, read in chunks until its end.
+            max_bytes (int | None): The largest accepted blob.
+            check: Called with the path of the complete temporary file; an exception
+                it raises discards the blob.
+
+        Returns:
+            tuple[str, int]: The SHA-256 hex digest and the size of the blob.
+
+        Raises:
+            BlobTooLargeError: If the stream is larger than max_bytes; nothing is stored.
+            Exception: Any exception raised by check; nothing is stored.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with self._temporary_file() as file:
+            try:
+                for chunk in iter(lambda: stream.read(COPY_CHUNK_SIZE), b''):
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise BlobTooLargeError(max_bytes)
+                    digest.update(chunk)
+                    file.write(chunk)
+                file.flush()
+                os.fsync(file.fileno())
+                if check is not None:
+                    check(file.name)
+            except BaseException:
+                file.close()
+                os.unlink(file.name)
+                raise
+
+        self._move_into_place(file.name, self.path(digest.hexdigest()))
+        return digest.hexdigest(), size
+
+    def put_bytes(self, data: bytes) -> tuple[str, int]:
+        """
+        Store a blob that is already in memory.
+
+        Returns:
+            tuple[str, int]: The SHA-256 hex digest and the size of the blob.
+        """
+        return self.put(io.BytesIO(data))
+
+
+blob_store = BlobStore()
@@ -0,0 +1,478 @@
+"""
+Server-Sent Events feed of record changes.
+
+Every committed write reported by the records_changed signal becomes a change
+event with the action, the barcodes and, for creates and updates of at most
+CHANGE_FEED_MAX_RECORDS records, the records themselves. A publisher thread
+per worker reads the records of new events once and appends the events to a
+ring buffer of the last CHANGE_FEED_BUFFER_SIZE events; subscribers wait on a
+condition and send the events of the buffer they have not seen yet, so an
+idle subscriber costs no database query. Under the threaded request workers
+it holds a thread; the gevent stream server of gunicorn.stream.conf.py serves
+the streams as greenlets instead. The records are read when the event is
+published and show the record as it is at that time.
+
+With CHANGE_FEED_BACKEND 'memory' the events are the writes of the worker
+itself, so it suits a single worker; its event ids carry a random namespace
+of the process. With 'db' every write is logged in the 'record_change' table
+and the publisher of each worker polls it every CHANGE_FEED_POLL_MS
+milliseconds, so subscribers of every worker see every write and event ids
+are the same on all of them. The polled writes are also sent as the
+changes_received signal, which the response cache invalidates on.
+
+Concurrent writers may commit log ids out of order, so a poll publishes ids
+in sequence only: a missing id holds back the ids after it until it shows up
+or GAP_WAIT_SECONDS passed, after which the id is taken as never committed.
+Every worker that logs writes deletes the log rows older than
+CHANGE_FEED_RETENTION every CHANGE_FEED_PURGE_SECONDS.
+
+The feed is off unless CHANGE_FEED_ENABLED is set, so writes are not logged
+when no client can subscribe.
+
+A client resumes after the event in its Last-Event-ID header (or the
+'last_event_id' argument) while that event is still in the buffer; otherwise,
+or with an id of another worker or an earlier process of the 'memory'
+backend, it gets a 'reset' event and has to reload the records.
+"""
+
+import datetime
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Iterator
+
+from sqlalchemy import delete, insert, select
+
+from app.exceptions import TooManySubscribersError
+from app.extensions import db
+from app.models.records import RecordChange
+from app.services.api import APIHandler
+from app.services.range_index import CATEGORY_FIELDS, RANGE_FILTERS
+from app.services.signals import ACTION_CREATE, ACTION_DELETE, ACTION_UPDATE, changes_received, records_changed
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = (ACTION_CREATE, ACTION_UPDATE, ACTION_DELETE)
+EVENT_RESET = 'reset'
+
+# Reconnection delay sent to the clients
+RETRY_MS = 3000
+
+# Log rows read per poll
+POLL_BATCH_SIZE = 500
+
+# Barcodes per query when reading the records of new events
+READ_CHUNK_SIZE = 500
+
+# Seconds a missing log id holds back the ids after it
+GAP_WAIT_SECONDS = 2.0
+
+# Event ids of the 'memory' backend: a random process namespace above a sequence number
+NAMESPACE_BITS = 20
+SEQUENCE_BITS = 32
+
+
+@dataclass
+class ChangeEvent:
+    id: int
+    action: str
+    barcodes: list[int]
+    time: datetime.datetime
+    records: list[dict[str, Any]] | None = None
+    message: str = ''
+
+
+def matches(record: dict[str, Any], filters: dict) -> bool:
+    """
+    Whether a serialized record passes the filters of GET /api/records.
+    """
+    for field, (low_arg, high_arg) in RANGE_FILTERS.items():
+        value = record.get(field)
+        if low_arg in filters or high_arg in filters:
+            if not isinstance(value, (int, float)):
+                return False
+            if low_arg in filters and not value > filters[low_arg]:
+                return False
+            if high_arg in filters and not value < filters[high_arg]:
+                return False
+    return all(record.get(field) == filters[field] for field in CATEGORY_FIELDS if field in filters)
+
+
+class Subscription:
+    """
+    The event stream of one client; closing it unregisters the subscriber.
+    """
+
+    def __init__(self, feed: 'ChangeFeed', cursor: int | None, actions: set[str], filters: dict):
+        self._feed = feed
+        self._events = feed.follow(cursor, actions, filters)
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        return next(self._events)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._events.close()
+            self._feed.unsubscribe()
+
+
+class ChangeFeed:
+    """
+    Ring buffer of change events shared by the Server-Sent Events subscribers of a worker.
+
+    Attributes:
+        enabled (bool): Whether GET /api/records/stream is served.
+        backend (str): 'db' to share the events of all workers through the database, or 'memory'.
+        buffer_size (int): The number of events a client can resume from.
+        max_records (int): The largest write whose records are sent with the event.
+        max_subscribers (int): The most open streams per worker.
+        heartbeat (float): The seconds between two keep-alive comments on an idle stream.
+        poll_interval (float): The seconds between two reads of the change log.
+        retention (int): The seconds rows of the change log are kept.
+        purge_interval (int): The seconds between two purges of the change log; 0 disables them.
+    """
+
+    def __init__(self, buffer_size: int = 1000):
+        self.enabled = False
+        self.backend = 'memory'
+        self.buffer_size = buffer_size
+        self.max_records = 100
+        self.max_subscribers = 500
+        self.heartbeat = 15.0
+        self.poll_interval = 0.5
+        self.retention = 3600
+        self.purge_interval = 300
+        self.subscribers = 0
+        self._app = None
+        self._buffer = deque(maxlen=buffer_size)
+        self._floor = 0
+        self._namespace = None
+        self._pending = queue.Queue()
+        self._wakeup = threading.Event()
+        self._changed = threading.Condition()
+        self._lock = threading.RLock()
+        self._pid = None
+        self._purge_due = 0.0
+        self._gap = None
+
+    def init_app(self, app):
+        """
+        Read the change feed settings and subscribe the feed to record changes of the application.
+
+        Args:
+            app: The Flask application.
+        """
+        self.enabled = app.config.get('CHANGE_FEED_ENABLED', self.enabled)
+        self.backend = app.config.get('CHANGE_FEED_BACKEND', self.backend)
+        self.buffer_size = app.config.get('CHANGE_FEED_BUFFER_SIZE', self.buffer_size)
+        self.max_records = app.config.get('CHANGE_FEED_MAX_RECORDS', self.max_records)
+        self.max_subscribers = app.config.get('CHANGE_FEED_MAX_SUBSCRIBERS', self.max_subscribers)
+        self.heartbeat = app.config.get('CHANGE_FEED_HEARTBEAT', self.heartbeat)
+        self.poll_interval = app.config.get('CHANGE_FEED_POLL_MS', self.poll_interval * 1000) / 1000
+        self.retention = app.config.get('CHANGE_FEED_RETENTION', self.retention)
+        self.purge_interval = app.config.get('CHANGE_FEED_PURGE_SECONDS', self.purge_interval)
+        self._buffer = deque(maxlen=self.buffer_size)
+        app.extensions['change_feed'] = self
+        if self.enabled:
+            self._app = app
+            records_changed.connect(self._on_records_changed, app, weak=False)
+            if self.backend != 'db' and app.config.get('WEB_CONCURRENCY', 1) > 1:
+                logger.warning("change feed streams only see the writes of their worker with the 'memory' backend")
+
+    def start(self):
+        """
+        Start the publisher thread of this worker unless it runs already.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # The publisher thread of the parent of a forked worker does not run in the worker
+            self._buffer = deque(maxlen=self.buffer_size)
+            self._pending = queue.Queue()
+            if self.backend == 'db':
+                self._namespace = None
+                self._load_history()
+            else:
+                # Ids of other workers and earlier processes have another namespace and lead to a reset
+                self._namespace = secrets.randbits(NAMESPACE_BITS)
+                self._floor = self._namespace << SEQUENCE_BITS
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='change-feed', daemon=True).start()
+
+    def _on_records_changed(self, sender, action: str, barcodes: list[int]):
+        if self.backend != 'db':
+            self.start()
+            self._pending.put((action, barcodes, datetime.datetime.now()))
+            return
+        try:
+            # Logged on a connection of its own: the write is already committed
+            with db.engine.begin() as conn:
+                conn.execute(insert(RecordChange).values(action=action, barcodes=json.dumps(barcodes),
+                                                         created_at=datetime.datetime.now()))
+            self._wakeup.set()
+        except Exception:
+            logger.exception('change log write failed', extra={'action': action, 'count': len(barcodes)})
+        self._schedule_purge()
+
+    def _schedule_purge(self):
+        if not self.purge_interval:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now < self._purge_due:
+                return
+            self._purge_due = now + self.purge_interval
+        threading.Thread(target=self._purge_log, name='change-feed-purge', daemon=True).start()
+
+    def _purge_log(self):
+        try:
+            with self._app.app_context():
+                purged = self.purge()
+            if purged:
+                logger.info('change log purged', extra={'rows': purged})
+        except Exception:
+            logger.exception('change log purge failed')
+
+    def _load_history(self):
+        rows = db.session.execute(select(RecordChange).order_by(RecordChange.id.desc())
+                                  .limit(self.buffer_size + 1)).scalars().all()
+        rows.reverse()
+        if len(rows) > self.buffer_size:
+            self._floor = rows.pop(0).id
+        else:
+            self._floor = rows[0].id - 1 if rows else 0
+        self._publish([(row.id, row.action, json.loads(row.barcodes), row.created_at) for row in rows])
+
+    def _poll(self) -> list[tuple]:
+        self._wakeup.wait(self.poll_interval)
+        self._wakeup.clear()
+        newest = self.newest_id
+        rows = db.session.execute(select(RecordChange).where(RecordChange.id > newest)
+                                  .order_by(RecordChange.id).limit(POLL_BATCH_SIZE)).scalars().all()
+        changes = []
+        for row in rows:
+            if row.id != newest + 1 and not self._gap_expired(newest):
+                # The row after the newest one may not be committed yet; it is read again by the next poll
+                break
+            changes.append((row.id, row.action, json.loads(row.barcodes), row.created_at))
+            newest = row.id
+        return changes
+
+    def _gap_expired(self, newest: int) -> bool:
+        """
+        Whether the id after `newest` has been missing for GAP_WAIT_SECONDS.
+        """
+        now = time.monotonic()
+        if self._gap is None or self._gap[0] != newest:
+            self._gap = (newest, now)
+        return now - self._gap[1] >= GAP_WAIT_SECONDS
+
+    def _drain(self) -> list[tuple]:
+        changes = [self._pending.get()]
+        while True:
+            try:
+                changes.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        newest = self.newest_id
+        return [(newest + offset, *change) for offset, change in enumerate(changes, 1)]
+
+    def _run(self):
+        while True:
+            try:
+                with self._app.app_context():
+                    changes = self._poll() if self.backend == 'db' else self._drain()
+                    if changes:
+                        self._publish(changes)
+                    if self.backend == 'db':
+                        for _, action, barcodes, _ in changes:
+                            changes_received.send(self._app, action=action, barcodes=barcodes)
+                    db.session.remove()
+            except Exception:
+                logger.exception('change feed publish failed')
+                time.sleep(self.poll_interval)
+
+    def _publish(self, changes: list[tuple]):
+        from app.services.db import Database
+
+        wanted = {barcode
+                  for _, action, barcodes, _ in changes
+                  if action != ACTION_DELETE and len(barcodes) <= self.max_records
+                  for barcode in barcodes}
+        wanted = sorted(wanted)
+        records = {}
+        for start in range(0, len(wanted), READ_CHUNK_SIZE):
+            records.update(Database.get_records_by_barcodes(wanted[start:start + READ_CHUNK_SIZE]))
+
+        events = []
+        for event_id, action, barcodes, changed_at in changes:
+            event = ChangeEvent(event_id, action, barcodes, changed_at)
+            if action != ACTION_DELETE and len(barcodes) <= self.max_records:
+                event.records = [records[barcode] for barcode in barcodes if barcode in records]
+            event.message = self.encode(event, event.barcodes, event.records)
+            events.append(event)
+
+        with self._changed:
+            for event in events:
+                if len(self._buffer) == self._buffer.maxlen:
+                    self._floor = self._buffer[0].id
+                self._buffer.append(event)
+            self._changed.notify_all()
+
+    def encode(self, event: ChangeEvent, barcodes: list[int], records: list[dict] | None) -> str:
+        data = {'action': event.action, 'barcodes': barcodes, 'time': event.time}
+        if records is not None:
+            data['records'] = records
+        return f'id: {event.id}\nevent: {event.action}\ndata: {self._app.json.dumps(data)}\n\n'
+
+    @property
+    def newest_id(self) -> int:
+        buffer = self._buffer
+        return buffer[-1].id if buffer else self._floor
+
+    def _after(self, cursor: int) -> list[ChangeEvent] | None:
+        """
+        The buffered events after an event id, or None if events after it were dropped.
+        """
+        if cursor < self._floor:
+            return None
+        if self._namespace is not None and cursor >> SEQUENCE_BITS != self._namespace:
+            return None
+        events = []
+        for event in reversed(self._buffer):
+            if event.id <= cursor:
+                break
+            events.append(event)
+        events.reverse()
+        return events
+
+    def _message(self, event: ChangeEvent, actions: set[str], filters: dict) -> str:
+        if event.action not in actions:
+            return ''
+        if not filters or event.records is None:
+            return event.message
+        records = [record for record in event.records if matches(record, filters)]
+        if len(records) == len(event.records):
+            return event.message
+        if not records:
+            return ''
+        return self.encode(event, [record['barcode'] for record in records], records)
+
+    def follow(self, cursor: int | None, actions: set[str], filters: dict) -> Iterator[str]:
+        """
+        The Server-Sent Events of the changes after an event id.
+
+        Args:
+            cursor (int | None): The id of the last event the client received; None to start with the next change.
+            actions (set[str]): The actions to send.
+            filters (dict): Filters of GET /api/records the records of creates and updates must pass.
+
+        Yields:
+            str: Events, a 'reset' event when the client missed events, and keep-alive comments.
+        """
+        yield f'retry: {RETRY_MS}\n\n'
+        if cursor is None:
+            cursor = self.newest_id
+        while True:
+            with self._changed:
+                events = self._after(cursor)
+                if events == []:
+                    self._changed.wait(self.heartbeat)
+                    events = self._after(cursor)
+
+            if events is None:
+                cursor = self.newest_id
+                data = json.dumps({'last_event_id': cursor})
+                yield f'id: {cursor}\nevent: {EVENT_RESET}\ndata: {data}\n\n'
+            elif events:
+                cursor = events[-1].id
+                chunk = ''.join(self._message(event, actions, filters) for event in events)
+                if chunk:
+                    yield chunk
+            else:
+                yield ': keep-alive\n\n'
+
+    @staticmethod
+    def parse_args(args_list: dict) -> tuple[set[str], dict] | str:
+        """
+        The actions and record filters of a stream request.
+
+        Returns:
+            tuple[set[str], dict] | str: The actions and filters, or an error message.
+        """
+        actions = {action.strip() for action in (args_list.get('action') or ','.join(ACTIONS)).split(',')}
+        unknown = actions - set(ACTIONS)
+        if unknown:
+            return f"Invalid action: {', '.join(sorted(unknown))}. Expected any of: {', '.join(ACTIONS)}"
+
+        filters = APIHandler.filter_args(args_list)
+        for low_arg, high_arg in RANGE_FILTERS.values():
+            for arg in (low_arg, high_arg):
+                if arg in filters:
+                    try:
+                        filters[arg] = float(filters[arg])
+                    except ValueError:
+                        return f'Invalid {arg}: {filters[arg]}. Expected a number'
+        return actions, filters
+
+    def subscribe(self, args_list: dict, last_event_id: str | None = None) -> Subscription | str:
+        """
+        Open the event stream of a client.
+
+        Args:
+            args_list (dict): The 'action' and filter arguments of the request.
+            last_event_id (str | None): The id of the last event the client received.
+
+        Returns:
+            Subscription | str: The stream, or an error message if an argument is invalid.
+
+        Raises:
+            TooManySubscribersError: If max_subscribers streams are open.
+        """
+        parsed = self.parse_args(args_list)
+        if isinstance(parsed, str):
+            return parsed
+        if last_event_id is not None and not last_event_id.isdigit():
+            return 'Last-Event-ID must be an integer'
+
+        self.start()
+        with self._lock:
+            if self.subscribers >= self.max_subscribers:
+                raise TooManySubscribersError(self.max_subscribers)
+            self.subscribers += 1
+        return Subscription(self, int(last_event_id) if last_event_id else None, *parsed)
+
+    def unsubscribe(self):
+        with self._lock:
+            self.subscribers -= 1
+
+    def purge(self, batch_size: int = 1000) -> int:
+        """
+        Delete the rows of the change log older than the retention in batches.
+
+        Returns:
+            int: The number of deleted rows.
+        """
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=self.retention)
+        purged = 0
+        while True:
+            ids = db.session.execute(select(RecordChange.id).where(RecordChange.created_at <= cutoff)
+                                     .order_by(RecordChange.id).limit(batch_size)).scalars().all()
+            if not ids:
+                return purged
+            purged += db.session.execute(delete(RecordChange).where(RecordChange.id.in_(ids))).rowcount
+            db.session.commit()
+
+
+change_feed = ChangeFeed()
@@ -0,0 +1,303 @@
+"""
+Compaction of soft-deleted records and unused lookup rows.
+
+Compaction runs in batches of COMPACTION_BATCH_SIZE rows with one short
+transaction each, so it can run next to the API without long table locks:
+
+1. tombstones older than COMPACTION_RETENTION seconds are purged from 'battery_data',
+2. 'real_parameters' rows that no record refers to are deleted,
+3. rows of the lookup tables that no record or parameter set refers to are deleted,
+4. expired idempotency keys, change log rows and ingest failures are deleted.
+
+Workers cache the ids of lookup rows and see a change of the lookup
+generation only every DIMENSION_CACHE_CHECK_SECONDS (see DimensionCache). So
+unreferenced rows are not deleted when they are found: compaction increments
+the lookup generation first and deletes them after a grace period, when every
+worker has dropped the ids it cached. Each DELETE checks again in the
+statement itself that the rows are not referenced, so a row that got a
+reference in the meantime is kept, and the generation is incremented again
+after the rows are gone.
+
+The job runs in a background thread of every worker process when
+COMPACTION_INTERVAL is set, or once with 'flask batteryhub compact'. The
+threads of the workers compete for the 'compaction_lease' row, so only the
+worker holding the lease compacts in an interval.
+"""
+
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from sqlalchemy import delete, exc, exists, insert, or_, select, update
+
+from app.extensions import db
+from app.models.parameters import Capacity, Color, Name, Resistance, Source, Voltage, Weight
+from app.models.records import BatteryData, CompactionLease, LookupGeneration, RealParameters
+from app.services.change_feed import change_feed
+from app.services.dimension_cache import dimension_cache
+from app.services.idempotency import idempotency_store
+from app.services.ingest import ingest_queue
+
+logger = logging.getLogger(__name__)
+
+# The lookup tables written by the record endpoints
+LOOKUP_MODELS = (Name, Color, Capacity, Resistance, Voltage, Weight, Source)
+
+# Seconds added to the generation check interval of the workers for the writes in flight
+GRACE_MARGIN = 1.0
+
+# The longest run a lease covers; the job of a worker that died during a run is taken over after it
+MAX_RUN_SECONDS = 3600
+
+
+@dataclass
+class CompactionResult:
+    tombstones_purged: int = 0
+    parameters_deleted: int = 0
+    lookups_deleted: dict[str, int] = field(default_factory=dict)
+    idempotency_keys_purged: int = 0
+    changes_purged: int = 0
+    ingest_failures_purged: int = 0
+    seconds: float = 0.0
+
+
+def referencing_columns(model) -> list:
+    """
+    All columns of the mapped tables with a foreign key to the id of a model.
+    """
+    return [column
+            for table in db.metadata.tables.values()
+            for column in table.columns
+            for foreign_key in column.foreign_keys
+            if foreign_key.column.table is model.__table__]
+
+
+class Compaction:
+    """
+    Batched purging of tombstones and garbage collection of unreferenced rows.
+    """
+
+    @classmethod
+    def purge_tombstones(cls, retention: int, batch_size: int = 1000) -> int:
+        """
+        Delete the records that were soft-deleted more than `retention` seconds ago.
+
+        Args:
+            retention (int): The seconds a tombstone is kept.
+            batch_size (int): The rows deleted per transaction.
+
+        Returns:
+            int: The number of purged records.
+        """
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=retention)
+        expired = BatteryData.deleted_at <= cutoff
+        purged = 0
+        while True:
+            ids = db.session.execute(
+                select(BatteryData.id).where(expired).order_by(BatteryData.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                return purged
+            purged += db.session.execute(delete(BatteryData).where(BatteryData.id.in_(ids), expired)).rowcount
+            db.session.commit()
+
+    @classmethod
+    def unreferenced_ids(cls, model, batch_size: int = 1000) -> list[int]:
+        """
+        The ids of the rows of a table that no foreign key refers to, read in batches in id order.
+        """
+        unreferenced = [~exists().where(column == model.id) for column in referencing_columns(model)]
+        ids = []
+        while True:
+            query = select(model.id).where(*unreferenced).order_by(model.id).limit(batch_size)
+            if ids:
+                query = query.where(model.id > ids[-1])
+            batch = db.session.execute(query).scalars().all()
+            if not batch:
+                return ids
+            ids.extend(batch)
+
+    @classmethod
+    def collect_unreferenced(cls, models, batch_size: int = 1000, grace: float = 0.0) -> dict[str, int]:
+        """
+        Delete the rows of tables that no foreign key refers to.
+
+        If there are any, the lookup generation is incremented and the rows are
+        deleted `grace` seconds later, so no worker still uses a cached id of a
+        deleted row. Every batch of ids is deleted with one statement that keeps
+        the rows that got a reference in the meantime.
+
+        Args:
+            models: The models of the tables.
+            batch_size (int): The ids deleted per transaction.
+            grace (float): The seconds between the increment of the generation and the deletes.
+
+        Returns:
+            dict[str, int]: The number of deleted rows by table name.
+        """
+        candidates = {model: cls.unreferenced_ids(model, batch_size) for model in models}
+        deleted = {model.__tablename__: 0 for model in models}
+        if not any(candidates.values()):
+            return deleted
+
+        cls.bump_lookup_generation()
+        db.session.commit()
+        time.sleep(grace)
+
+        for model, ids in candidates.items():
+            unreferenced = [~exists().where(column == model.id) for column in referencing_columns(model)]
+            for start in range(0, len(ids), batch_size):
+                result = db.session.execute(delete(model).where(model.id.in_(ids[start:start + batch_size]),
+                                                                *unreferenced))
+                deleted[model.__tablename__] += result.rowcount
+                db.session.commit()
+
+        if any(deleted.values()):
+            cls.bump_lookup_generation()
+            db.session.commit()
+        return deleted
+
+    @classmethod
+    def bump_lookup_generation(cls):
+        """
+        Increment the lookup generation in the current transaction and clear the local dimension cache.
+        """
+        now = datetime.datetime.now()
+        bumped = db.session.execute(
+            update(LookupGeneration).where(LookupGeneration.id == 1)
+            .values(generation=LookupGeneration.generation + 1, updated_at=now)
+        ).rowcount
+        if not bumped:
+            db.session.execute(insert(LookupGeneration).values(id=1, generation=1, updated_at=now))
+        dimension_cache.clear()
+
+    @classmethod
+    def run(cls, retention: int, batch_size: int = 1000, grace: float | None = None) -> CompactionResult:
+        """
+        Purge the expired tombstones, then the parameter combinations and lookup
+        rows they left unreferenced.
+
+        Args:
+            retention (int): The seconds a tombstone is kept.
+            batch_size (int): The rows handled per transaction.
+            grace (float | None): The seconds workers get to drop cached ids before rows are
+                deleted; the dimension cache check interval plus GRACE_MARGIN by default.
+
+        Returns:
+            CompactionResult: The number of deleted rows per step.
+        """
+        if grace is None:
+            grace = dimension_cache.check_interval + GRACE_MARGIN
+        started = time.perf_counter()
+        result = CompactionResult()
+        try:
+            result.tombstones_purged = cls.purge_tombstones(retention, batch_size)
+            # Combinations first: they hold the references to the lookup rows
+            deleted = cls.collect_unreferenced([RealParameters], batch_size, grace)
+            result.parameters_deleted = deleted[RealParameters.__tablename__]
+            result.lookups_deleted = cls.collect_unreferenced(LOOKUP_MODELS, batch_size, grace)
+            if idempotency_store.backend == 'db':
+                result.idempotency_keys_purged = idempotency_store.purge(batch_size)
+            if change_feed.backend == 'db':
+                result.changes_purged = change_feed.purge(batch_size)
+            result.ingest_failures_purged = ingest_queue.purge(batch_size)
+        except Exception:
+            db.session.rollback()
+            raise
+        result.seconds = round(time.perf_counter() - started, 3)
+        return result
+
+
+class CompactionJob:
+    """
+    Runs Compaction every COMPACTION_INTERVAL seconds in a background thread.
+
+    The thread is started by the first request of each worker process, so
+    workers forked from a preloaded application run their own job. Before a
+    run the job takes the lease of the 'compaction_lease' table; while another
+    worker holds it the run is skipped. After a run the lease is kept for
+    another interval, so the workers together compact once per interval.
+
+    Attributes:
+        interval (int): The seconds between two runs; 0 disables the job.
+        retention (int): The seconds a tombstone is kept.
+        batch_size (int): The rows handled per transaction.
+    """
+
+    def __init__(self):
+        self.interval = 0
+        self.retention = 86400
+        self.batch_size = 1000
+        self.last_result = None
+        self._app = None
+        self._pid = None
+        self._owner = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Read the compaction settings and start the job with the first request of a process.
+
+        Args:
+            app: The Flask application.
+        """
+        self.interval = app.config.get('COMPACTION_INTERVAL', self.interval)
+        self.retention = app.config.get('COMPACTION_RETENTION', self.retention)
+        self.batch_size = app.config.get('COMPACTION_BATCH_SIZE', self.batch_size)
+        app.extensions['compaction_job'] = self
+        if self.interval > 0:
+            self._app = app
+            app.before_request(self.start)
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._owner = f'{socket.gethostname()[:40]}:{self._pid}:{uuid.uuid4().hex[:8]}'
+        threading.Thread(target=self._loop, name='compaction', daemon=True).start()
+
+    def _lease(self, seconds: float) -> bool:
+        """
+        Take or extend the lease of the job until `seconds` from now.
+
+        Returns:
+            bool: True if this worker holds the lease.
+        """
+        now = datetime.datetime.utcnow()
+        expires_at = now + datetime.timedelta(seconds=seconds)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(CompactionLease).values(id=1, owner=self._owner, expires_at=expires_at))
+            return True
+        except exc.IntegrityError:
+            with db.engine.begin() as conn:
+                result = conn.execute(
+                    update(CompactionLease)
+                    .where(CompactionLease.id == 1,
+                           or_(CompactionLease.owner == self._owner, CompactionLease.expires_at < now))
+                    .values(owner=self._owner, expires_at=expires_at)
+                )
+            return result.rowcount == 1
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self._app.app_context():
+                    if not self._lease(self.interval + MAX_RUN_SECONDS):
+                        continue
+                    self.last_result = Compaction.run(self.retention, self.batch_size)
+                    db.session.remove()
+                    self._lease(self.interval)
+                logger.info('compaction finished', extra=vars(self.last_result))
+            except Exception:
+                logger.exception('compaction failed')
+
+
+compaction_job = CompactionJob()
@@ -1,18 +1,30 @@
 import datetime
 import importlib
 import json
+import logging
+from decimal import Decimal
 from pprint import pprint
-from typing import List, Dict, Any
-from app.services.barcode_gen import barcode_gen
-from flask import abort
-from sqlalchemy import exc, asc, text, desc, update
+from typing import List, Dict, Any, Callable, Iterator
+from app.services.barcode_gen import allocator, barcode_gen
+from app.services.dimension_cache import dimension_cache
+from app.services.metrics import metrics
+from app.services.signals import ACTION_CREATE, ACTION_DELETE, ACTION_UPDATE, records_changed
+from app.services.pagination import DIRECTION_NEXT, DIRECTION_PREV, decode_cursor, encode_cursor
+from app.services.replica import replica_router
+from flask import abort, current_app
+from sqlalchemy import exc, asc, text, desc, update, insert, delete, func, case, and_, or_
 
 from app.extensions import db
 from app.models.parameters import Name, Color, Source, Voltage, Resistance, Capacity, Weight
-from app.models.records import BatteryData, RealParameters, StockParameters
+from app.models.records import BatteryData, BatteryFlat, RealParameters, StockParameters
 from app.validator.records_model import APIData
 from sqlalchemy.exc import SQLAlchemyError
-from app.exceptions import EmptyFieldError
+from app.exceptions import EmptyFieldError, BarcodeSpaceExhaustedError
+
+logger = logging.getLogger(__name__)
+
+NULLABLE_SORT_COLUMNS = {'datetime', 'name', 'source', 'weight', 'capacity'}
+NATIVE_NULLS_FIRST_DIALECTS = {'sqlite', 'mysql'}
 
 
 class Database:
@@ -23,20 +35,30 @@ class Database:
 
     Methods:
         serialize_record(record): Serialize a database record to a dictionary.
-        query_to_db(): Generate the base query for retrieving records from the database.
+        read_session(): The session of the record reads, on a read replica where possible.
+        query_to_db(): Generate the base query for retrieving records from the configured read model.
+        notify_changed(action, barcodes): Send the records_changed signal after a committed write.
+        sync_flat(barcodes): Refresh the denormalized 'battery_flat' rows of the given barcodes.
+        rebuild_flat(batch_size): Rebuild the whole 'battery_flat' table.
         get_or_create_record(model, field_name, value): Get or create a record in the specified table.
         add_record(records): Add multiple records to the database.
-        get_records_by_sorting(res): Get records from the database based on sorting conditions.
+        add_records_batch(records): Add a batch of validated records in one transaction.
+        get_records_by_sorting(res, sort_by, order_by): Get sorted records from the database based on filtering conditions.
+        get_records_page(res, sort_by, order_by, limit, cursor): Get one page of records with keyset pagination.
+        get_field_rows(res, fields): Get only the given fields of the filtered records.
+        iter_records(res, sort_by, order_by, batch_size): Stream filtered records from a server-side cursor.
         get_record_by_barcode(barcode): Get a record from the database by barcode.
+        get_records_by_barcodes(barcodes): Get the records with the given barcodes.
         get_records_by_limit(limit_records): Get a specified number of records from the database.
         get_records(): Get all records from the database.
-        delete(barcode): Delete a record from the database by barcode.
+        delete(barcode, soft): Delete a record from the database by barcode.
+        delete_records(barcodes, conditions, soft): Delete many records in one transaction.
     """
 
     @classmethod
     def process_data_to_database(cls, record_data: dict):
         try:
-            print(f'process_data_to_database: {record_data}')
+            logger.debug('process_data_to_database', extra={'record': record_data})
 
             name_id = cls.get_or_create_record(Name, 'name',
                                                record_data['name'])
@@ -52,7 +74,11 @@ class Database:
                                                  record_data['weight'])
             source_id = cls.get_or_create_record(Source, 'source',
                                                  record_data['source'])
-            print('before params')
+            combination = (name_id, color_id, resistance_id, voltage_id, capacity_id, weight_id)
+            params_id = dimension_cache.get(RealParameters.__tablename__, combination)
+            if params_id is not None:
+                return {'params_id': params_id, 'source_id': source_id}
+
             params = RealParameters.query.filter_by(name_id=name_id,
                                                     color_id=color_id,
                                                     resistance_id=resistance_id,
@@ -60,7 +86,6 @@ class Database:
                                                     capacity_id=capacity_id,
                                                     weight_id=weight_id
                                                     ).first()
-            print(params)
             if not params:
                 new_params = RealParameters(name_id=name_id,
                                             color_id=color_id,
@@ -69,11 +94,25 @@ class Database:
                                             capacity_id=capacity_id,
                                             weight_id=weight_id
                                             )
-                db.session.add(new_params)
-                db.session.flush()
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(new_params)
+                except exc.IntegrityError:
+                    # Another worker inserted the same combination first
+                    params = RealParameters.query.filter_by(name_id=name_id,
+                                                            color_id=color_id,
+                                                            resistance_id=resistance_id,
+                                                            voltage_id=voltage_id,
+                                                            capacity_id=capacity_id,
+                                                            weight_id=weight_id
+                                                            ).one()
+                    dimension_cache.set(RealParameters.__tablename__, combination, params.id)
+                    return {'params_id': params.id, 'source_id': source_id}
                 params_id = new_params.id
+                dimension_cache.set(RealParameters.__tablename__, combination, params_id, created=True)
             else:
                 params_id = params.id
+                dimension_cache.set(RealParameters.__tablename__, combination, params_id)
 
             return {'params_id': params_id, 'source_id': source_id}
         except SQLAlchemyError as ex:
@@ -92,7 +131,9 @@ class Database:
                 datetime=datetime.datetime.now()
             )
             db.session.execute(update_stmt)
+            cls.sync_flat([barcode])
             db.session.commit()
+            cls.notify_changed(ACTION_UPDATE, [barcode])
 
             return {'status': 'Record updated successfully.'}
         except SQLAlchemyError as ex:
@@ -121,10 +162,45 @@ class Database:
             error_msg = f"Error occurred while serializing record: {ex}"
             return {'error': error_msg, 'description': 'Serialization error'}
 
+    @classmethod
+    def read_model(cls) -> str:
+        """
+        The model read queries are served from: 'join' or 'flat'.
+        """
+        return current_app.config.get('READ_MODEL', 'join')
+
+    @classmethod
+    def read_session(cls):
+        """
+        The session read queries run on: a read replica for GET requests when one is healthy, else db.session.
+        """
+        return replica_router.session()
+
     @classmethod
     def query_to_db(cls):
+        if cls.read_model() == 'flat':
+            return cls.flat_query()
+        return cls.join_query()
+
+    @classmethod
+    def flat_query(cls):
+        return cls.read_session().query(
+            BatteryFlat.id,
+            BatteryFlat.barcode,
+            BatteryFlat.datetime,
+            BatteryFlat.name,
+            BatteryFlat.color,
+            BatteryFlat.voltage,
+            BatteryFlat.resistance,
+            BatteryFlat.source,
+            BatteryFlat.weight,
+            BatteryFlat.capacity
+        )
+
+    @classmethod
+    def join_query(cls):
         try:
-            query = db.session.query(
+            query = cls.read_session().query(
                 BatteryData.id,
                 BatteryData.barcode,
                 BatteryData.datetime,
@@ -151,61 +227,665 @@ class Database:
                 Weight, RealParameters.weight_id == Weight.id
             ).outerjoin(
                 Capacity, RealParameters.capacity_id == Capacity.id
+            ).filter(
+                BatteryData.deleted_at.is_(None)
             )
             return query
         except Exception as ex:
             error_msg = f"Error occurred while generating the database query: {ex}"
 
+    @classmethod
+    def notify_changed(cls, action: str, barcodes: list[int]):
+        """
+        Send the records_changed signal for a committed write.
+
+        Args:
+            action (str): 'create', 'update' or 'delete'.
+            barcodes (list[int]): The barcodes of the changed records.
+        """
+        records_changed.send(current_app._get_current_object(), action=action,
+                             barcodes=[int(barcode) for barcode in barcodes])
+
+    @classmethod
+    def sync_flat(cls, barcodes: list[int]):
+        """
+        Refresh the 'battery_flat' rows of the given barcodes in the current transaction.
+
+        Rows of deleted records are removed. Does nothing unless FLAT_TABLE_SYNC is enabled.
+
+        Args:
+            barcodes (list[int]): The barcodes written by the current transaction.
+        """
+        if not current_app.config.get('FLAT_TABLE_SYNC', False):
+            return
+
+        db.session.flush()
+        barcodes = [int(barcode) for barcode in barcodes]
+        chunk_size = current_app.config.get('BATCH_INSERT_CHUNK_SIZE', 500)
+        columns = [column.name for column in BatteryFlat.__table__.columns]
+
+        for start in range(0, len(barcodes), chunk_size):
+            chunk = barcodes[start:start + chunk_size]
+            db.session.execute(delete(BatteryFlat).where(BatteryFlat.barcode.in_(chunk)))
+            select_stmt = cls.join_query().filter(BatteryData.barcode.in_(chunk)).statement
+            db.session.execute(insert(BatteryFlat).from_select(columns, select_stmt))
+
+    @classmethod
+    def rebuild_flat(cls, batch_size: int = 10000) -> int:
+        """
+        Rebuild the whole 'battery_flat' table from the normalized tables.
+
+        The table is rebuilt in id ranges with one commit per range, so the
+        rebuild can run against a live database.
+
+        Args:
+            batch_size (int): The size of the id range copied per transaction.
+
+        Returns:
+            int: The number of rows in the rebuilt table.
+        """
+        columns = [column.name for column in BatteryFlat.__table__.columns]
+
+        lowest, highest = db.session.query(func.min(BatteryData.id), func.max(BatteryData.id)).one()
+        if lowest is None:
+            db.session.execute(delete(BatteryFlat))
+            db.session.commit()
+            return 0
+
+        db.session.execute(delete(BatteryFlat).where(or_(BatteryFlat.id < lowest, BatteryFlat.id > highest)))
+        db.session.commit()
+
+        for start in range(lowest, highest + 1, batch_size):
+            end = start + batch_size - 1
+            db.session.execute(delete(BatteryFlat).where(BatteryFlat.id.between(start, end)))
+            select_stmt = cls.join_query().filter(BatteryData.id.between(start, end)).statement
+            db.session.execute(insert(BatteryFlat).from_select(columns, select_stmt))
+            db.session.commit()
+
+        return db.session.query(func.count(BatteryFlat.id)).scalar()
+
     @classmethod
     def get_or_create_record(cls, model, field_name, value) -> Any | None:
         try:
-            print('get or create record')
-            record = model.query.filter_by(**{field_name: value}).first()
             if model == Source and field_name == 'source' and value is None:
                 return None
 
-            if record is None:
-                new_record = model(**{field_name: value})
-                db.session.add(new_record)
-                db.session.flush()
-                db.session.refresh(new_record)
-                return new_record.id
-            return record.id
+            record_id = dimension_cache.get(model.__tablename__, value)
+            if record_id is not None:
+                return record_id
+
+            record = model.query.filter_by(**{field_name: value}).first()
+            if record is not None:
+                dimension_cache.set(model.__tablename__, value, record.id)
+                return record.id
+
+            try:
+                with db.session.begin_nested():
+                    new_record = model(**{field_name: value})
+                    db.session.add(new_record)
+            except exc.IntegrityError:
+                # Another worker inserted the same value first
+                record = model.query.filter_by(**{field_name: value}).one()
+                dimension_cache.set(model.__tablename__, value, record.id)
+                return record.id
+
+            dimension_cache.set(model.__tablename__, value, new_record.id, created=True)
+            return new_record.id
         except Exception as ex:
             return f"Error occurred while getting or creating a record: {ex}"
 
     @classmethod
     def add_record(cls, record: dict) -> dict[str, str] | dict[str, str] | list[dict[str, str | int]]:
+        barcode = None
         try:
-            print(f'add_record: {record}')
+            logger.debug('add_record', extra={'record': record})
+            barcode = barcode_gen()
             processed_data_ids = cls.process_data_to_database(record_data=record)
 
-            new_record = BatteryData(barcode=barcode_gen(),
+            new_record = BatteryData(barcode=barcode,
                                      real_params_id=processed_data_ids['params_id'],
                                      source_id=processed_data_ids['source_id'],
                                      datetime=datetime.datetime.now())
             db.session.add(new_record)
+            cls.sync_flat([barcode])
             db.session.commit()
-            return {'success': 'Record added successfully.'}
+        except BarcodeSpaceExhaustedError:
+            raise
         except SQLAlchemyError as ex:
+            db.session.rollback()
+            # The record was not stored, so its barcode goes back to the free space of the block
+            if barcode is not None:
+                allocator.release(barcode)
             error_msg = f"Error occurred while adding record: {ex}"
             return {'error': error_msg, 'description': 'Database error'}
         except Exception as ex:
+            db.session.rollback()
+            if barcode is not None:
+                allocator.release(barcode)
             error_msg = f"Error occurred while adding record: {ex}"
             return {'error': error_msg, 'description': 'Unknown error'}
 
+        cls.notify_changed(ACTION_CREATE, [barcode])
+        return {'success': 'Record added successfully.', 'barcode': barcode}
+
+    @staticmethod
+    def _dimension_key(value) -> Any:
+        """
+        Normalize a dimension value so that request values match the values read back from the database.
+        """
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            return Decimal(str(value)).normalize()
+        return value
+
     @classmethod
-    def get_records_by_sorting(cls, res: dict) -> list[dict[str, Any]] | dict[str, str]:
+    def resolve_dimension_ids(cls, model, field_name, values) -> dict[Any, int | None]:
+        """
+        Resolve many values of one dimension table to their ids.
+
+        Known values come from the dimension cache, the rest is read with a single
+        IN query, and values that are still missing are inserted in one statement.
+
+        Args:
+            model: The dimension model.
+            field_name (str): The value column of the model.
+            values: The values to resolve.
+
+        Returns:
+            dict[Any, int | None]: The id of every value; None values map to None.
+        """
+        table = model.__tablename__
+        column = getattr(model, field_name)
+        ids = {None: None}
+        missing = {}
+
+        for value in set(values):
+            if value is None:
+                continue
+            record_id = dimension_cache.get(table, value)
+            if record_id is None:
+                missing.setdefault(cls._dimension_key(value), []).append(value)
+            else:
+                ids[value] = record_id
+
+        def read_missing(created: bool):
+            values_to_read = [values[0] for values in missing.values()]
+            rows = db.session.query(model.id, column).filter(column.in_(values_to_read)).all()
+            for record_id, db_value in rows:
+                for value in missing.pop(cls._dimension_key(db_value), []):
+                    ids[value] = record_id
+                    dimension_cache.set(table, value, record_id, created=created)
+
+        if missing:
+            read_missing(created=False)
+
+        if missing:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(model), [{field_name: values[0]} for values in missing.values()])
+            except exc.IntegrityError:
+                # Another worker inserted some of the values first
+                pass
+            read_missing(created=True)
+
+        for values in missing.values():
+            for value in values:
+                ids[value] = cls.get_or_create_record(model, field_name, value)
+
+        return ids
+
+    @classmethod
+    def resolve_real_params_ids(cls, combinations) -> dict[tuple, int]:
+        """
+        Resolve many (name_id, color_id, resistance_id, voltage_id, capacity_id, weight_id)
+        combinations to RealParameters ids, inserting the missing ones in one statement.
+
+        Args:
+            combinations: The parameter id combinations.
+
+        Returns:
+            dict[tuple, int]: The RealParameters id of every combination.
+        """
+        table = RealParameters.__tablename__
+        columns = ('name_id', 'color_id', 'resistance_id', 'voltage_id', 'capacity_id', 'weight_id')
+        ids = {}
+        missing = set()
+
+        for combination in set(combinations):
+            params_id = dimension_cache.get(table, combination)
+            if params_id is None:
+                missing.add(combination)
+            else:
+                ids[combination] = params_id
+
+        def read_missing(created: bool):
+            rows = db.session.query(RealParameters.id, *(getattr(RealParameters, c) for c in columns)).filter(
+                RealParameters.color_id.in_({c[1] for c in missing}),
+                RealParameters.resistance_id.in_({c[2] for c in missing}),
+                RealParameters.voltage_id.in_({c[3] for c in missing})
+            ).order_by(RealParameters.id).all()
+            for row in rows:
+                combination = tuple(row[1:])
+                if combination in missing:
+                    missing.discard(combination)
+                    ids[combination] = row.id
+                    dimension_cache.set(table, combination, row.id, created=created)
+
+        if missing:
+            read_missing(created=False)
+
+        if missing:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(RealParameters), [dict(zip(columns, c)) for c in missing])
+            except exc.IntegrityError:
+                # Another worker inserted some of the combinations first
+                for combination in missing:
+                    with db.session.begin_nested():
+                        params = RealParameters.query.filter_by(**dict(zip(columns, combination))).first()
+                        if params is None:
+                            db.session.add(RealParameters(**dict(zip(columns, combination))))
+            read_missing(created=True)
+
+        return ids
+
+    @classmethod
+    def add_records_batch(cls, records: list[APIData], keep_datetime: bool = False,
+                          before_commit: Callable[[], None] | None = None) -> dict[str, Any]:
+        """
+        Add many validated records in a single transaction.
+
+        Dimension values are resolved per table with set-based queries and all
+        BatteryData rows are written with multi-row INSERT statements.
+
+        Args:
+            records (list[APIData]): The validated records with their assigned barcodes.
+            keep_datetime (bool): Store the datetime of the records instead of the current time.
+            before_commit: Called inside the transaction right before it is committed.
+
+        Returns:
+            dict[str, Any]: The number of inserted records, or an error.
+        """
         try:
-            query = cls.query_to_db()
-            records = query.filter(*res).all()
+            dimensions = {
+                'name': (Name, 'name'),
+                'color': (Color, 'color'),
+                'voltage': (Voltage, 'voltage'),
+                'resistance': (Resistance, 'resistance'),
+                'capacity': (Capacity, 'capacity'),
+                'weight': (Weight, 'weight'),
+                'source': (Source, 'source'),
+            }
+            dimension_ids = {
+                field: cls.resolve_dimension_ids(model, column, [getattr(r, field) for r in records])
+                for field, (model, column) in dimensions.items()
+            }
+
+            combinations = [
+                (dimension_ids['name'][r.name], dimension_ids['color'][r.color],
+                 dimension_ids['resistance'][r.resistance], dimension_ids['voltage'][r.voltage],
+                 dimension_ids['capacity'][r.capacity], dimension_ids['weight'][r.weight])
+                for r in records
+            ]
+            params_ids = cls.resolve_real_params_ids(combinations)
+
+            now = datetime.datetime.now()
+            rows = [
+                {'barcode': r.barcode,
+                 'real_params_id': params_ids[combination],
+                 'source_id': dimension_ids['source'][r.source],
+                 'datetime': datetime.datetime.strptime(r.datetime, '%Y-%m-%d %H:%M:%S') if keep_datetime else now}
+                for r, combination in zip(records, combinations)
+            ]
+            chunk_size = current_app.config.get('BATCH_INSERT_CHUNK_SIZE', 500)
+            for start in range(0, len(rows), chunk_size):
+                db.session.execute(insert(BatteryData), rows[start:start + chunk_size])
+            cls.sync_flat([row['barcode'] for row in rows])
+            if before_commit is not None:
+                before_commit()
+            db.session.commit()
+            cls.notify_changed(ACTION_CREATE, [row['barcode'] for row in rows])
+
+            return {'success': 'Records added successfully.', 'count': len(rows)}
+        except SQLAlchemyError as ex:
+            db.session.rollback()
+            error_msg = f"Error occurred while adding records: {ex}"
+            return {'error': error_msg, 'description': 'Database error'}
+        except Exception as ex:
+            db.session.rollback()
+            error_msg = f"Error occurred while adding records: {ex}"
+            return {'error': error_msg, 'description': 'Unknown error'}
+
+    @classmethod
+    def find_barcodes(cls, barcodes: list[int] | None = None, conditions: list | None = None) -> list[int]:
+        """
+        The barcodes of the live records selected by a barcode list or by filtering conditions.
+
+        Args:
+            barcodes (list[int] | None): The requested barcodes.
+            conditions (list | None): The filtering conditions, if no barcodes are given.
+
+        Returns:
+            list[int]: The sorted barcodes of the existing, not deleted records.
+        """
+        if barcodes is None:
+            found = cls.query_to_db().filter(*conditions).with_entities(cls.read_columns()['barcode']).all()
+            return sorted(barcode for barcode, in found)
+
+        chunk_size = current_app.config.get('BATCH_INSERT_CHUNK_SIZE', 500)
+        found = []
+        for start in range(0, len(barcodes), chunk_size):
+            found += db.session.query(BatteryData.barcode).filter(
+                BatteryData.barcode.in_(barcodes[start:start + chunk_size]),
+                BatteryData.deleted_at.is_(None)).all()
+        return sorted(barcode for barcode, in found)
+
+    @classmethod
+    def update_records(cls, values: dict[str, Any], barcodes: list[int] | None = None,
+                       conditions: list | None = None) -> dict[str, Any]:
+        """
+        Change some fields of many records in a single transaction.
+
+        The new dimension values are resolved once. A changed name, color or
+        measurement gives every parameter combination of the selected records a
+        new combination, which is resolved set-based like in add_records_batch;
+        the records are then updated with one UPDATE per chunk of barcodes that
+        maps the old combinations to the new ones with a CASE expression.
+
+        Args:
+            values (dict[str, Any]): The validated new values by field.
+            barcodes (list[int] | None): The barcodes of the records to update.
+            conditions (list | None): The filtering conditions selecting the records, if no barcodes are given.
+
+        Returns:
+            dict[str, Any]: The number of updated records and the barcodes that were not found, or an error.
+        """
+        dimensions = {
+            'name': (Name, 'name'),
+            'color': (Color, 'color'),
+            'resistance': (Resistance, 'resistance'),
+            'voltage': (Voltage, 'voltage'),
+            'capacity': (Capacity, 'capacity'),
+            'weight': (Weight, 'weight'),
+            'source': (Source, 'source'),
+        }
+        params_columns = ('name_id', 'color_id', 'resistance_id', 'voltage_id', 'capacity_id', 'weight_id')
+        chunk_size = current_app.config.get('BATCH_INSERT_CHUNK_SIZE', 500)
+
+        try:
+            targets = cls.find_barcodes(barcodes, conditions)
+
+            ids = {field: cls.resolve_dimension_ids(model, column, [values[field]])[values[field]]
+                   for field, (model, column) in dimensions.items() if field in values}
+            # Positions of the changed dimensions in a parameter combination
+            changed = {index: ids[field] for index, field in enumerate(('name', 'color', 'resistance',
+                                                                          'voltage', 'capacity', 'weight'))
+                       if field in ids}
+
+            now = datetime.datetime.now()
+            for start in range(0, len(targets), chunk_size):
+                chunk = targets[start:start + chunk_size]
+                changes = {'datetime': now}
+                if 'source' in ids:
+                    changes['source_id'] = ids['source']
+
+                if changed:
+                    old = db.session.query(RealParameters.id, *(getattr(RealParameters, c) for c in params_columns)) \
+                        .join(BatteryData, BatteryData.real_params_id == RealParameters.id) \
+                        .filter(BatteryData.barcode.in_(chunk)).distinct().all()
+                    replaced = {
+                        row[0]: tuple(changed.get(index, value) for index, value in enumerate(row[1:]))
+                        for row in old
+                    }
+                    params_ids = cls.resolve_real_params_ids(list(replaced.values()))
+                    mapping = {old_id: params_ids[combination] for old_id, combination in replaced.items()}
+                    changes['real_params_id'] = case(mapping, value=BatteryData.real_params_id,
+                                                     else_=BatteryData.real_params_id)
+
+                db.session.execute(update(BatteryData).where(BatteryData.barcode.in_(chunk)).values(**changes)
+                                   .execution_options(synchronize_session=False))
+
+            cls.sync_flat(targets)
+            db.session.commit()
+            cls.notify_changed(ACTION_UPDATE, targets)
+
+            result = {'success': 'Records updated successfully.', 'count': len(targets)}
+            if barcodes is not None:
+                result['not_found'] = sorted(set(barcodes) - set(targets))
+            return result
+        except SQLAlchemyError as ex:
+            db.session.rollback()
+            error_msg = f"Error occurred while updating records: {ex}"
+            return {'error': error_msg, 'description': 'Database error'}
+        except Exception as ex:
+            db.session.rollback()
+            error_msg = f"Error occurred while updating records: {ex}"
+            return {'error': error_msg, 'description': 'Unknown error'}
+
+    @classmethod
+    def read_columns(cls) -> dict[str, Any]:
+        """
+        Columns of the read query that records can be filtered and sorted by.
+
+        Returns:
+            dict[str, Any]: The column of every sortable record field.
+        """
+        if cls.read_model() == 'flat':
+            return {column.name: getattr(BatteryFlat, column.name) for column in BatteryFlat.__table__.columns}
+
+        return {
+            'id': BatteryData.id,
+            'barcode': BatteryData.barcode,
+            'datetime': BatteryData.datetime,
+            'name': Name.name,
+            'color': Color.color,
+            'voltage': Voltage.voltage,
+            'resistance': Resistance.resistance,
+            'source': Source.source,
+            'weight': Weight.weight,
+            'capacity': Capacity.capacity,
+        }
+
+    @classmethod
+    def order_clauses(cls, sort_by: str, descending: bool) -> list:
+        """
+        Build a deterministic ORDER BY for a sort column.
+
+        NULL values are sorted first in ascending and last in descending order
+        on every backend, and the id breaks ties. SQLite and MySQL already order
+        NULLs that way, so the plain column is used there and its index stays usable.
+
+        Args:
+            sort_by (str): The sort column name.
+            descending (bool): Whether to sort in descending order.
+
+        Returns:
+            list: The ORDER BY clauses.
+        """
+        column = cls.read_columns()[sort_by]
+        direction = desc if descending else asc
+        clauses = []
+        if sort_by in NULLABLE_SORT_COLUMNS and db.engine.dialect.name not in NATIVE_NULLS_FIRST_DIALECTS:
+            clauses.append(direction(case((column.is_(None), 0), else_=1)))
+        if sort_by != 'id':
+            clauses.append(direction(column))
+        clauses.append(direction(cls.read_columns()['id']))
+        return clauses
+
+    @classmethod
+    def keyset_condition(cls, sort_by: str, value: Any, record_id: int, descending: bool):
+        """
+        Build the condition selecting the rows after (value, record_id) in the sort order.
+
+        Args:
+            sort_by (str): The sort column name.
+            value: The sort value of the last row of the previous page.
+            record_id (int): The id of the last row of the previous page.
+            descending (bool): Whether the rows are sorted in descending order.
+
+        Returns:
+            The SQLAlchemy condition.
+        """
+        column = cls.read_columns()[sort_by]
+        id_column = cls.read_columns()['id']
+        after_id = id_column < record_id if descending else id_column > record_id
+
+        if sort_by == 'id':
+            return after_id
+        if value is None:
+            if descending:
+                return and_(column.is_(None), after_id)
+            return or_(column.is_not(None), and_(column.is_(None), after_id))
+
+        after_value = column < value if descending else column > value
+        condition = or_(after_value, and_(column == value, after_id))
+        if descending and sort_by in NULLABLE_SORT_COLUMNS:
+            condition = or_(condition, column.is_(None))
+        return condition
+
+    @classmethod
+    def get_records_by_sorting(cls, res: list, sort_by: str = 'id',
+                               order_by: str = 'asc') -> list[dict[str, Any]] | dict[str, str]:
+        rows = cls.get_rows_by_sorting(res, sort_by=sort_by, order_by=order_by)
+        if isinstance(rows, dict):
+            return rows
+
+        records_list = [cls.serialize_record(record) for record in rows]
+        return records_list
 
-            records_list = [cls.serialize_record(record) for record in records]
-            return records_list
+    @classmethod
+    def get_rows_by_sorting(cls, res: list, sort_by: str = 'id',
+                            order_by: str = 'asc') -> list | dict[str, str]:
+        """
+        Same as get_records_by_sorting, but returns the unserialized rows for RowEncoder.
+        """
+        try:
+            query = cls.query_to_db()
+            rows = query.filter(*res).order_by(*cls.order_clauses(sort_by, order_by == 'desc')).all()
+            metrics.observe_rows(len(rows))
+            return rows
         except Exception as ex:
             error_msg = f"Error occurred while retrieving records by sorting: {ex}"
             return {'error': error_msg, 'description': 'Unknown error'}
 
+    @classmethod
+    def get_field_rows(cls, res: list, fields: list[str]) -> list:
+        """
+        Retrieves only the given fields of the filtered records.
+
+        Args:
+            res (list): The filtering conditions.
+            fields (list[str]): The record fields to select, see read_columns().
+
+        Returns:
+            list: One row per record with the fields in the given order.
+        """
+        columns = cls.read_columns()
+        rows = cls.query_to_db().filter(*res).with_entities(*[columns[field] for field in fields]).all()
+        metrics.observe_rows(len(rows))
+        return rows
+
+    @classmethod
+    def iter_records(cls, res: list, sort_by: str = 'id', order_by: str = 'asc',
+                     batch_size: int = 1000) -> Iterator[dict[str, Any]]:
+        """
+        Iterates over the filtered records without loading them all into memory.
+
+        Rows are fetched from a server-side cursor in batches of batch_size.
+
+        Args:
+            res (list): The filtering conditions.
+            sort_by (str): The sort column name.
+            order_by (str): 'asc' or 'desc'.
+            batch_size (int): The number of rows fetched per round-trip.
+
+        Yields:
+            Dict[str, Any]: The serialized records.
+        """
+        for record in cls.iter_rows(res, sort_by=sort_by, order_by=order_by, batch_size=batch_size):
+            yield cls.serialize_record(record)
+
+    @classmethod
+    def iter_rows(cls, res: list, sort_by: str = 'id', order_by: str = 'asc', batch_size: int = 1000) -> Iterator:
+        """
+        Same as iter_records, but yields the unserialized rows for RowEncoder.
+        """
+        query = cls.query_to_db().filter(*res).order_by(*cls.order_clauses(sort_by, order_by == 'desc'))
+        for row in query.yield_per(batch_size):
+            metrics.observe_rows(1)
+            yield row
+
+    @classmethod
+    def get_records_page(cls, res: list, sort_by: str = 'id', order_by: str = 'asc',
+                         limit: int = 100, cursor: str | None = None) -> dict[str, Any]:
+        """
+        Retrieves one page of records with keyset pagination.
+
+        Args:
+            res (list): The filtering conditions.
+            sort_by (str): The sort column name.
+            order_by (str): 'asc' or 'desc'.
+            limit (int): The page size.
+            cursor (str | None): A cursor from a previous page, or None for the first page.
+
+        Returns:
+            Dict[str, Any]: The records and the cursors of the neighbouring pages.
+        """
+        page = cls.get_rows_page(res, sort_by=sort_by, order_by=order_by, limit=limit, cursor=cursor)
+        if 'error' in page:
+            return page
+
+        return {
+            'records': [cls.serialize_record(record) for record in page['rows']],
+            'next_cursor': page['next_cursor'],
+            'prev_cursor': page['prev_cursor'],
+        }
+
+    @classmethod
+    def get_rows_page(cls, res: list, sort_by: str = 'id', order_by: str = 'asc',
+                      limit: int = 100, cursor: str | None = None) -> dict[str, Any]:
+        """
+        Same as get_records_page, but returns the unserialized rows under 'rows' for RowEncoder.
+        """
+        descending = order_by == 'desc'
+        direction = DIRECTION_NEXT
+        query = cls.query_to_db().filter(*res)
+
+        if cursor:
+            python_type = cls.read_columns()[sort_by].type.python_type
+            value, record_id, direction = decode_cursor(cursor, sort_by, python_type)
+            backwards = descending != (direction == DIRECTION_PREV)
+            query = query.filter(cls.keyset_condition(sort_by, value, record_id, backwards))
+
+        backwards = descending != (direction == DIRECTION_PREV)
+        try:
+            records = query.order_by(*cls.order_clauses(sort_by, backwards)).limit(limit + 1).all()
+        except SQLAlchemyError as ex:
+            error_msg = f"Error occurred while retrieving records page: {ex}"
+            return {'error': error_msg, 'description': 'Database error'}
+        metrics.observe_rows(len(records))
+
+        has_more = len(records) > limit
+        records = records[:limit]
+        if direction == DIRECTION_PREV:
+            records.reverse()
+
+        has_next = has_more if direction == DIRECTION_NEXT else True
+        has_prev = has_more if direction == DIRECTION_PREV else cursor is not None
+
+        next_cursor = prev_cursor = None
+        if records and has_next:
+            last = records[-1]
+            next_cursor = encode_cursor(sort_by, getattr(last, sort_by), last.id, DIRECTION_NEXT)
+        if records and has_prev:
+            first = records[0]
+            prev_cursor = encode_cursor(sort_by, getattr(first, sort_by), first.id, DIRECTION_PREV)
+
+        return {
+            'rows': records,
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor,
+        }
+
     @classmethod
     def get_record_by_barcode(cls, barcode: int) -> Dict[str, Any]:
         """
@@ -220,13 +900,31 @@ class Database:
         if not isinstance(barcode, int) and len(str(barcode)) != 6:
             return {'error': 'Barcode must be an int and a 6-digit number.'}
 
-        record = cls.query_to_db().filter(BatteryData.barcode == int(barcode)).first()
+        record = cls.query_to_db().filter(cls.read_columns()['barcode'] == int(barcode)).first()
 
         if record is None:
             return {'error': 'Record is None or empty'}
+        metrics.observe_rows(1)
 
         return cls.serialize_record(record)
 
+    @classmethod
+    def get_records_by_barcodes(cls, barcodes: list[int]) -> dict[int, Dict[str, Any]]:
+        """
+        Retrieves the records with the given barcodes.
+
+        Args:
+            barcodes (list[int]): The barcodes of the records.
+
+        Returns:
+            dict[int, Dict[str, Any]]: The serialized records by barcode; missing barcodes are left out.
+        """
+        if not barcodes:
+            return {}
+        records = cls.query_to_db().filter(cls.read_columns()['barcode'].in_(barcodes)).all()
+        metrics.observe_rows(len(records))
+        return {record.barcode: cls.serialize_record(record) for record in records}
+
     @classmethod
     def get_records_by_limit(cls, limit_records: int) -> dict[str, str] | dict[str, str] | list[dict[str, Any]]:
         """
@@ -243,7 +941,8 @@ class Database:
         if not isinstance(limit_records, int) and limit_records < 0:
             return {'error': 'Limit records must be a positive integer'}
 
-        records = query.order_by(BatteryData.datetime.desc()).limit(limit_records).all()
+        records = query.order_by(cls.read_columns()['datetime'].desc()).limit(limit_records).all()
+        metrics.observe_rows(len(records))
 
         if not records:
             return {'error': 'Records is None or empty'}
@@ -262,6 +961,7 @@ class Database:
         query = cls.query_to_db()
 
         records = query.all()
+        metrics.observe_rows(len(records))
 
         if not records:
             return {'error': 'Records is None'}
@@ -270,27 +970,88 @@ class Database:
         return records_list
 
     @classmethod
-    def delete(cls, barcode: int) -> Dict[str, Any]:
+    def delete(cls, barcode: int, soft: bool | None = None) -> Dict[str, Any]:
         """
         Deletes a record from the database based on the barcode.
 
         Args:
             barcode (int): The barcode of the record to be deleted.
+            soft (bool | None): Keep the record as a tombstone; defaults to SOFT_DELETE.
 
         Returns:
             Dict[str, Any]: A dictionary representing the result of the deletion.
         """
+        if soft is None:
+            soft = current_app.config.get('SOFT_DELETE', False)
         try:
-            record = db.session.query(BatteryData).filter(
-                BatteryData.barcode == int(barcode)).first()
+            selected = and_(BatteryData.barcode == int(barcode), BatteryData.deleted_at.is_(None))
+            if soft:
+                stmt = update(BatteryData).where(selected).values(deleted_at=datetime.datetime.now())
+            else:
+                stmt = delete(BatteryData).where(selected)
+            deleted = db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount
 
-            if record:
-                db.session.delete(record)
+            if deleted:
+                cls.sync_flat([barcode])
                 db.session.commit()
+                cls.notify_changed(ACTION_DELETE, [barcode])
                 return {'success': 'Record deleted successfully.'}
             else:
+                db.session.rollback()
                 return {'error': 'Record not found.'}
 
         except exc.IntegrityError as ex:
             db.session.rollback()
             return {'error': f'Integrity error occurred: {ex}'}
+
+    @classmethod
+    def delete_records(cls, barcodes: list[int] | None = None, conditions: list | None = None,
+                       soft: bool | None = None) -> dict[str, Any]:
+        """
+        Delete many records in a single transaction.
+
+        A soft delete only sets the deleted_at tombstone of the records, which hides
+        them from every read; compaction purges the tombstones later. A hard delete
+        removes the rows right away. Either way the records are removed from the
+        'battery_flat' table and the records_changed signal reports them as deleted.
+
+        Args:
+            barcodes (list[int] | None): The barcodes of the records to delete.
+            conditions (list | None): The filtering conditions selecting the records, if no barcodes are given.
+            soft (bool | None): Keep the records as tombstones; defaults to SOFT_DELETE.
+
+        Returns:
+            dict[str, Any]: The number of deleted records and the barcodes that were not found, or an error.
+        """
+        if soft is None:
+            soft = current_app.config.get('SOFT_DELETE', False)
+        chunk_size = current_app.config.get('BATCH_INSERT_CHUNK_SIZE', 500)
+
+        try:
+            targets = cls.find_barcodes(barcodes, conditions)
+
+            now = datetime.datetime.now()
+            for start in range(0, len(targets), chunk_size):
+                selected = BatteryData.barcode.in_(targets[start:start + chunk_size])
+                if soft:
+                    stmt = update(BatteryData).where(selected).values(deleted_at=now)
+                else:
+                    stmt = delete(BatteryData).where(selected)
+                db.session.execute(stmt.execution_options(synchronize_session=False))
+
+            cls.sync_flat(targets)
+            db.session.commit()
+            cls.notify_changed(ACTION_DELETE, targets)
+
+            result = {'success': 'Records deleted successfully.', 'count': len(targets), 'soft': soft}
+            if barcodes is not None:
+                result['not_found'] = sorted(set(barcodes) - set(targets))
+            return result
+        except SQLAlchemyError as ex:
+            db.session.rollback()
+            error_msg = f"Error occurred while deleting records: {ex}"
+            return {'error': error_msg, 'description': 'Database error'}
+        except Exception as ex:
+            db.session.rollback()
+            error_msg = f"Error occurred while deleting records: {ex}"
+            return {'error': error_msg, 'description': 'Unknown error'}
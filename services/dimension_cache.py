@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from sqlalchemy import event, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.extensions import db
+from app.models.records import LookupGeneration
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'dimension_cache_pending'
+
+
+class LRUCache:
+    """
+    Thread-safe mapping with bounded size and least-recently-used eviction.
+
+    Attributes:
+        maxsize (int): The maximum number of entries kept in the cache.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+                return self._data[key]
+            except KeyError:
+                return default
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DimensionCache:
+    """
+    Process-local cache of lookup-table ids.
+
+    Keys are (table name, value) for the dimension tables and
+    ('real_parameters', (name_id, color_id, ...)) for parameter combinations.
+    Ids of rows created inside a transaction are kept in the session until the
+    transaction commits, so a rollback never leaves ids of missing rows behind.
+
+    Compaction increments the lookup generation in the database before it
+    deletes unused lookup rows. The cache reads the generation at most every
+    check_interval seconds and is cleared when it changed; compaction waits
+    longer than that before the deletes, so no worker keeps an id of a deleted row.
+    """
+
+    def __init__(self, maxsize: int = 4096, check_interval: float = 5.0):
+        self._cache = LRUCache(maxsize)
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._generation = None
+        self._checked_at = None
+
+    def init_app(self, app):
+        """
+        Read the cache size from the application config and hook the cache into
+        the session transaction events.
+
+        Args:
+            app: The Flask application.
+        """
+        self._cache.maxsize = app.config.get('DIMENSION_CACHE_SIZE', self._cache.maxsize)
+        self.check_interval = app.config.get('DIMENSION_CACHE_CHECK_SECONDS', self.check_interval)
+        # Ids cached for an earlier application may belong to another database
+        self.clear()
+        self._generation = None
+        self._checked_at = None
+        app.extensions['dimension_cache'] = self
+        if not event.contains(db.session, 'after_commit', self._after_commit):
+            event.listen(db.session, 'after_commit', self._after_commit)
+            event.listen(db.session, 'after_soft_rollback', self._after_soft_rollback)
+
+    def _after_commit(self, session):
+        for key, value in session.info.pop(PENDING_KEY, {}).items():
+            self._cache.set(key, value)
+
+    def _after_soft_rollback(self, session, previous_transaction):
+        if session.in_transaction():
+            return
+        session.info.pop(PENDING_KEY, None)
+
+    def _check_generation(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            # A connection of its own, so a missing table never breaks the transaction of the session
+            with db.engine.connect() as conn:
+                generation = conn.execute(select(LookupGeneration.generation)).scalar() or 0
+        except SQLAlchemyError:
+            logger.debug('lookup generation not readable', exc_info=True)
+            return
+        if generation != self._generation:
+            if self._generation is not None:
+                self._cache.clear()
+            self._generation = generation
+
+    def get(self, table: str, value: Hashable) -> int | None:
+        """
+        Look up a cached id.
+
+        Args:
+            table (str): The table name.
+            value: The column value or the parameter combination.
+
+        Returns:
+            int | None: The cached id, or None on a miss.
+        """
+        self._check_generation()
+        key = (table, value)
+        pending = db.session.info.get(PENDING_KEY)
+        if pending and key in pending:
+            return pending[key]
+        record_id = self._cache.get(key)
+        if record_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record_id
+
+    def set(self, table: str, value: Hashable, record_id: int, created: bool = False):
+        """
+        Store an id in the cache.
+
+        Args:
+            table (str): The table name.
+            value: The column value or the parameter combination.
+            record_id (int): The id of the row.
+            created (bool): True if the row was inserted by the current transaction.
+        """
+        if created:
+            db.session.info.setdefault(PENDING_KEY, {})[(table, value)] = record_id
+        else:
+            self._cache.set((table, value), record_id)
+
+    def clear(self):
+        self._cache.clear()
+
+
+dimension_cache = DimensionCache()
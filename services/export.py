@@ -0,0 +1,116 @@
+import csv
+import io
+import zlib
+from typing import Any, Iterable, Iterator
+
+from flask import current_app
+
+from app.services.serializer import row_encoder
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class RecordExporter:
+    """
+    Encodes a stream of serialized records as NDJSON or CSV chunks.
+
+    Rows are grouped into chunks of roughly chunk_size bytes, so the response can
+    be sent with chunked transfer encoding while memory use stays constant.
+    """
+
+    CSV_COLUMNS = ('id', 'barcode', 'name', 'color', 'voltage', 'resistance',
+                   'source', 'weight', 'capacity', 'datetime')
+
+    @classmethod
+    def ndjson_chunks(cls, rows: Iterable, chunk_size: int = 65536) -> Iterator[bytes]:
+        """
+        Encode rows of the read query as newline-delimited JSON.
+
+        Args:
+            rows: The unserialized rows, encoded with RowEncoder.
+            chunk_size (int): The approximate size of a yielded chunk in bytes.
+
+        Yields:
+            bytes: The encoded chunks.
+        """
+        encode_row = row_encoder.encode_row
+        buffer = []
+        size = 0
+        for row in rows:
+            line = encode_row(row) + '\n'
+            buffer.append(line)
+            size += len(line)
+            if size >= chunk_size:
+                yield ''.join(buffer).encode()
+                buffer, size = [], 0
+        if buffer:
+            yield ''.join(buffer).encode()
+
+    @classmethod
+    def csv_chunks(cls, records: Iterable[dict[str, Any]], chunk_size: int = 65536) -> Iterator[bytes]:
+        """
+        Encode records as CSV with a header row.
+
+        Args:
+            records: The serialized records.
+            chunk_size (int): The approximate size of a yielded chunk in bytes.
+
+        Yields:
+            bytes: The encoded chunks.
+        """
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=cls.CSV_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            if buffer.tell() >= chunk_size:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+
+    @classmethod
+    def gzip_chunks(cls, chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+        """
+        Compress a stream of chunks into a single gzip stream.
+
+        Args:
+            chunks: The uncompressed chunks.
+            level (int): The zlib compression level.
+
+        Yields:
+            bytes: The compressed chunks.
+        """
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    @classmethod
+    def export(cls, records: Iterable[dict[str, Any]], export_format: str,
+               compress: bool = False) -> Iterator[bytes]:
+        """
+        Encode records in the requested export format.
+
+        Args:
+            records: The unserialized rows for 'ndjson', the serialized records for 'csv'.
+            export_format (str): 'ndjson' or 'csv'.
+            compress (bool): Whether to gzip the stream.
+
+        Returns:
+            Iterator[bytes]: The response body chunks.
+        """
+        chunk_size = current_app.config.get('EXPORT_CHUNK_SIZE', 65536)
+        if export_format == 'csv':
+            chunks = cls.csv_chunks(records, chunk_size)
+        else:
+            chunks = cls.ndjson_chunks(records, chunk_size)
+        if compress:
+            chunks = cls.gzip_chunks(chunks)
+        return chunks
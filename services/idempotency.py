@@ -0,0 +1,306 @@
+"""
+Idempotency-Key support for the record creation endpoints.
+
+A request with an Idempotency-Key header is run once; repeating it with the
+same key returns the stored response, including the barcodes, without
+running the view again. Keys are scoped by method and path and expire after
+IDEMPOTENCY_TTL seconds.
+
+Responses are kept in a per-worker LRU cache and, with the 'db' backend, in
+the 'idempotency_key' table, which is what makes a retry that reaches another
+worker see the first response. A key is claimed by inserting its row before
+the view runs, so concurrent duplicates wait for the first request instead
+of running too: within a worker on an event, across workers by polling the
+row. A claim older than IDEMPOTENCY_LOCK_SECONDS belongs to a crashed request
+and is taken over; every claim has a token of its own, so a slow request
+whose claim was taken over stores nothing.
+
+Only definitive outcomes are stored. Responses with a 5xx status or a status
+asking to retry later, and the 400 responses of database errors
+('Database error', 'Unknown error'), release the key, so the request can be
+retried.
+"""
+
+import datetime
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from functools import wraps
+
+from flask import Response, current_app, jsonify, request
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models.records import IdempotencyKey
+from app.services.dimension_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+# Seconds between two reads of a key claimed by another worker
+POLL_INTERVAL = 0.05
+
+# Statuses that ask the client to retry later
+RETRY_STATUSES = (408, 409, 425, 429)
+
+# Descriptions of error responses of failures that a retry may not meet again
+TRANSIENT_ERRORS = ('Database error', 'Unknown error')
+
+
+def is_definitive(response: Response) -> bool:
+    """
+    Whether a response is the outcome of its request, so a retry must get it again.
+    """
+    if response.status_code >= 500 or response.status_code in RETRY_STATUSES or response.is_streamed:
+        return False
+    if response.status_code >= 400 and response.is_json:
+        body = response.get_json(silent=True)
+        if isinstance(body, dict) and body.get('description') in TRANSIENT_ERRORS:
+            return False
+    return True
+
+
+@dataclass
+class StoredResponse:
+    fingerprint: str
+    status_code: int
+    body: str
+    mimetype: str
+    expires_at: float
+
+
+class IdempotencyStore:
+    """
+    Stored responses by idempotency key.
+
+    Attributes:
+        enabled (bool): Whether the Idempotency-Key header is honoured.
+        backend (str): 'db' to share the keys between workers through the database, or 'memory'.
+        ttl (int): The seconds a response is stored.
+        lock_seconds (int): The seconds after which a claim of an unfinished request is taken over.
+        wait_seconds (float): The longest time a duplicate waits for the first request.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.enabled = True
+        self.backend = 'db'
+        self.ttl = 86400
+        self.lock_seconds = 30
+        self.wait_seconds = 10.0
+        self._cache = LRUCache(maxsize)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Read the idempotency settings from the application config.
+
+        Args:
+            app: The Flask application.
+        """
+        self.enabled = app.config.get('IDEMPOTENCY_ENABLED', self.enabled)
+        self.backend = app.config.get('IDEMPOTENCY_BACKEND', self.backend)
+        self.ttl = app.config.get('IDEMPOTENCY_TTL', self.ttl)
+        self.lock_seconds = app.config.get('IDEMPOTENCY_LOCK_SECONDS', self.lock_seconds)
+        self.wait_seconds = app.config.get('IDEMPOTENCY_WAIT_SECONDS', self.wait_seconds)
+        self._cache.maxsize = app.config.get('IDEMPOTENCY_CACHE_SIZE', self._cache.maxsize)
+        app.extensions['idempotency_store'] = self
+
+    @staticmethod
+    def make_key(header: str) -> str:
+        return hashlib.sha256(f'{request.method} {request.path} {header}'.encode()).hexdigest()
+
+    def _use_db(self) -> bool:
+        return self.backend == 'db'
+
+    def _get(self, key: str) -> StoredResponse | None:
+        entry = self._cache.get(key)
+        if entry is not None and entry.expires_at > time.time():
+            return entry
+        if not self._use_db():
+            return None
+
+        # The rows are read and written on connections of their own, outside the transaction of the view
+        with db.engine.connect() as conn:
+            row = conn.execute(select(IdempotencyKey).where(IdempotencyKey.key == key)).first()
+        if row is None or row.status_code is None:
+            return None
+        expires_at = row.created_at.timestamp() + self.ttl
+        if expires_at <= time.time():
+            return None
+        entry = StoredResponse(row.fingerprint, row.status_code, row.body, row.mimetype, expires_at)
+        self._cache.set(key, entry)
+        return entry
+
+    def _claim(self, key: str, fingerprint: str) -> str | None:
+        """
+        Insert the row of a key, or take over the row of an expired key or an abandoned request.
+
+        Returns:
+            str | None: The token of the claim, or None if another request holds the key.
+        """
+        claim = uuid.uuid4().hex
+        if not self._use_db():
+            return claim
+        now = datetime.datetime.now()
+        with db.engine.begin() as conn:
+            try:
+                with conn.begin_nested():
+                    conn.execute(insert(IdempotencyKey).values(key=key, fingerprint=fingerprint, created_at=now,
+                                                               claim=claim))
+                return claim
+            except IntegrityError:
+                pass
+
+            row = conn.execute(select(IdempotencyKey).where(IdempotencyKey.key == key)).first()
+            if row is None:
+                return None
+            expired = row.created_at <= now - datetime.timedelta(seconds=self.ttl)
+            abandoned = (row.status_code is None
+                         and row.created_at <= now - datetime.timedelta(seconds=self.lock_seconds))
+            if not (expired or abandoned):
+                return None
+            taken = conn.execute(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.key == key, IdempotencyKey.created_at == row.created_at)
+                .values(fingerprint=fingerprint, status_code=None, body=None, mimetype=None, created_at=now,
+                        claim=claim)
+            ).rowcount
+            return claim if taken == 1 else None
+
+    def _complete(self, key: str, claim: str, fingerprint: str, response: Response) -> bool:
+        """
+        Store the response of a request that still holds its claim.
+
+        Returns:
+            bool: False if the claim was taken over and the response was not stored.
+        """
+        body = response.get_data(as_text=True)
+        if self._use_db():
+            with db.engine.begin() as conn:
+                stored = conn.execute(
+                    update(IdempotencyKey)
+                    .where(IdempotencyKey.key == key, IdempotencyKey.claim == claim,
+                           IdempotencyKey.status_code.is_(None))
+                    .values(status_code=response.status_code, body=body, mimetype=response.mimetype)
+                ).rowcount
+            if stored != 1:
+                return False
+        self._cache.set(key, StoredResponse(fingerprint, response.status_code, body, response.mimetype,
+                                            time.time() + self.ttl))
+        return True
+
+    def _release(self, key: str, claim: str):
+        if self._use_db():
+            with db.engine.begin() as conn:
+                conn.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.claim == claim,
+                                                          IdempotencyKey.status_code.is_(None)))
+
+    @staticmethod
+    def _replay(entry: StoredResponse, fingerprint: str):
+        if entry.fingerprint != fingerprint:
+            return jsonify({'error': f'{HEADER} was already used for a different request.',
+                            'description': 'Idempotency key reused'}), 422
+        response = Response(entry.body, status=entry.status_code, mimetype=entry.mimetype)
+        response.headers[REPLAYED_HEADER] = 'true'
+        return response
+
+    def _run(self, key: str, claim: str, fingerprint: str, view):
+        try:
+            response = current_app.make_response(view())
+        except BaseException:
+            self._release(key, claim)
+            raise
+        if not is_definitive(response):
+            self._release(key, claim)
+        elif not self._complete(key, claim, fingerprint, response):
+            logger.warning('idempotency claim taken over, response not stored', extra={'key': key})
+        return response
+
+    def handle(self, header: str, view):
+        """
+        Run a view once per idempotency key.
+
+        Args:
+            header (str): The value of the Idempotency-Key header.
+            view: Called without arguments to produce the response of the first request.
+
+        Returns:
+            The response of the view or the stored response.
+        """
+        key = self.make_key(header)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        deadline = time.monotonic() + self.wait_seconds
+
+        while True:
+            entry = self._get(key)
+            if entry is not None:
+                return self._replay(entry, fingerprint)
+
+            with self._lock:
+                event = self._inflight.get(key)
+                owner = event is None
+                if owner:
+                    event = self._inflight[key] = threading.Event()
+
+            if owner:
+                try:
+                    claim = self._claim(key, fingerprint)
+                    if claim is not None:
+                        return self._run(key, claim, fingerprint, view)
+                finally:
+                    with self._lock:
+                        self._inflight.pop(key).set()
+                # Another worker runs the first request
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(min(POLL_INTERVAL, remaining))
+            elif not event.wait(max(deadline - time.monotonic(), 0)):
+                break
+
+        response = jsonify({'error': f'A request with this {HEADER} is still in progress.',
+                            'description': 'Idempotency key in use'})
+        response.headers['Retry-After'] = '1'
+        return response, 409
+
+    def purge(self, batch_size: int = 1000) -> int:
+        """
+        Delete the rows of expired keys in batches.
+
+        Returns:
+            int: The number of deleted rows.
+        """
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=self.ttl)
+        purged = 0
+        while True:
+            keys = db.session.execute(select(IdempotencyKey.key).where(IdempotencyKey.created_at <= cutoff)
+                                      .limit(batch_size)).scalars().all()
+            if not keys:
+                return purged
+            purged += db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.key.in_(keys))).rowcount
+            db.session.commit()
+
+    def idempotent(self, view):
+        """
+        Decorate a view so that requests with an Idempotency-Key header run it at most once per key.
+        """
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            header = request.headers.get(HEADER)
+            if not self.enabled or header is None:
+                return view(*args, **kwargs)
+            if not header or len(header) > MAX_KEY_LENGTH:
+                return jsonify({'error': f'{HEADER} must have 1 to {MAX_KEY_LENGTH} characters'}), 400
+            return self.handle(header, lambda: view(*args, **kwargs))
+        return wrapper
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,302 @@
+"""
+Resumable bulk import of record files.
+
+RecordImporter streams a CSV or NDJSON file in chunks. The rows of a chunk
+are validated with APIData in a process pool while the previous chunk is
+written, and every chunk is inserted with Database.add_records_batch in its
+own transaction. The checkpoint of the file is written in the same
+transaction, so an interrupted import continues after the last committed
+chunk. Invalid rows do not stop the import; they are written to a reject
+file together with the error.
+"""
+
+import collections
+import csv
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from app.extensions import db
+from app.models.records import ImportCheckpoint
+from app.services.api import APIHandler
+from app.services.barcode_gen import allocator
+from app.services.db import Database
+from app.validator.records_model import APIData
+
+FORMATS = ('csv', 'ndjson')
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+# Bytes of the file head hashed into the fingerprint
+FINGERPRINT_BYTES = 65536
+
+# Barcode the rows are validated with before the real barcodes are allocated
+PLACEHOLDER_BARCODE = 100000
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def detect_format(path: str) -> str:
+    """
+    The file format by the file extension.
+
+    Raises:
+        ValueError: If the extension is not known.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXTENSIONS:
+        raise ValueError(f'Unknown file format of {path}. Pass one of: {", ".join(FORMATS)}')
+    return EXTENSIONS[extension]
+
+
+def fingerprint(path: str) -> str:
+    """
+    Hash of the size and the head of a file, to recognize it when resuming.
+    """
+    digest = hashlib.sha1(str(os.path.getsize(path)).encode())
+    with open(path, 'rb') as file:
+        digest.update(file.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+
+def validate_records(records: list, current_datetime: str) -> list:
+    """
+    Validate parsed rows with APIHandler.records_to_api_data.
+
+    Runs in the worker processes of the import, so it only depends on its arguments.
+
+    Args:
+        records (list): The parsed rows, or the parse error of a row.
+        current_datetime (str): The datetime of rows without one.
+
+    Returns:
+        list: The validated fields or an error message for every row. The fields
+        are returned as a dict, which is much cheaper to send between processes.
+    """
+    results = [record if isinstance(record, str) else 'Record must be a JSON object' for record in records]
+    indexes = [index for index, record in enumerate(records) if isinstance(record, dict)]
+    batch = [records[index] for index in indexes]
+    datetimes = [record.get('datetime') or current_datetime for record in batch]
+    converted = APIHandler.records_to_api_data(batch, [PLACEHOLDER_BARCODE] * len(batch), datetimes)
+    for index, result in zip(indexes, converted):
+        results[index] = vars(result) if isinstance(result, APIData) else result
+    return results
+
+
+@dataclass
+class ImportProgress:
+    rows_read: int
+    rows_imported: int
+    rows_rejected: int
+    rows_per_second: float
+    finished: bool = False
+
+
+class RejectWriter:
+    """
+    Appends invalid rows to the reject file in the format of the imported file.
+
+    CSV rejects keep the original columns between a 'row' and an 'error'
+    column; NDJSON rejects keep the original object with '_row' and '_error' keys.
+    """
+
+    def __init__(self, path: str, file_format: str, offset: int):
+        self.path = path
+        self.file_format = file_format
+        # Rejects written after the last committed chunk are written again on resume
+        with open(path, 'a', encoding='utf-8', newline=''):
+            pass
+        with open(path, 'r+', encoding='utf-8', newline='') as file:
+            file.truncate(offset)
+        self._file = open(path, 'a', encoding='utf-8', newline='')
+        self._csv = None
+
+    def write(self, row: int, raw, error: str):
+        if self.file_format == 'csv':
+            if self._csv is None:
+                fields = ['row', *(key for key in raw if key not in ('row', 'error')), 'error']
+                self._csv = csv.DictWriter(self._file, fields, extrasaction='ignore')
+                if self._file.tell() == 0:
+                    self._csv.writeheader()
+            self._csv.writerow({**raw, 'row': row, 'error': error})
+        elif isinstance(raw, dict):
+            self._file.write(json.dumps({'_row': row, '_error': error, **raw}) + '\n')
+        else:
+            self._file.write(json.dumps({'_row': row, '_error': error, '_line': raw}) + '\n')
+
+    def flush(self) -> int:
+        """
+        Flush the rejects to disk.
+
+        Returns:
+            int: The size of the reject file.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+class RecordImporter:
+    """
+    Imports a record file chunk by chunk.
+
+    Attributes:
+        path (str): The imported file.
+        file_format (str): One of FORMATS.
+        chunk_size (int): The rows validated and committed together.
+        workers (int): The validation processes; 1 validates in the importing process.
+        reject_path (str): The file invalid rows are written to.
+    """
+
+    def __init__(self, path: str, file_format: str | None = None, chunk_size: int = 5000,
+                 workers: int = 1, reject_path: str | None = None):
+        self.path = os.path.abspath(path)
+        self.file_format = file_format or detect_format(path)
+        self.chunk_size = chunk_size
+        self.workers = workers
+        root, extension = os.path.splitext(self.path)
+        self.reject_path = reject_path or f'{root}.rejects{extension}'
+
+    def _rows(self, skip: int):
+        """
+        Yield the row number, the raw row and the parsed record of every data row after `skip`.
+        """
+        with open(self.path, encoding='utf-8-sig', newline='') as file:
+            if self.file_format == 'csv':
+                rows = ((raw, raw) for raw in csv.DictReader(file))
+            else:
+                rows = (self._parse_line(line) for line in file if line.strip())
+            for number, (raw, record) in enumerate(itertools.islice(rows, skip, None), start=skip + 1):
+                yield number, raw, record
+
+    @staticmethod
+    def _parse_line(line: str) -> tuple:
+        try:
+            record = json.loads(line)
+        except ValueError as ex:
+            return line.rstrip('\r\n'), f'Invalid JSON: {ex}'
+        return record, record
+
+    def _chunks(self, skip: int):
+        rows = self._rows(skip)
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _load_checkpoint(self, restart: bool) -> dict:
+        current = fingerprint(self.path)
+        checkpoint = db.session.get(ImportCheckpoint, self.path)
+        if checkpoint is not None and not restart and checkpoint.fingerprint != current:
+            raise ValueError(f'{self.path} changed since its import started. '
+                             f'Import it with restart to start over.')
+        if checkpoint is None or restart:
+            state = {'rows_read': 0, 'rows_imported': 0, 'rows_rejected': 0, 'reject_offset': 0, 'finished': False}
+        else:
+            state = {key: getattr(checkpoint, key)
+                     for key in ('rows_read', 'rows_imported', 'rows_rejected', 'reject_offset', 'finished')}
+        db.session.rollback()
+        return dict(state, source=self.path, fingerprint=current)
+
+    def _save_checkpoint(self, state: dict):
+        db.session.merge(ImportCheckpoint(**state, updated_at=datetime.datetime.now()))
+
+    def _commit_chunk(self, state: dict, chunk: list, results: list, rejects: RejectWriter) -> int:
+        records = []
+        for (number, raw, _), result in zip(chunk, results):
+            if isinstance(result, str):
+                rejects.write(number, raw, result)
+            else:
+                records.append(result)
+
+        barcodes = allocator.allocate_many(len(records))
+        # The fields were validated by the workers already
+        records = [APIData.construct(**dict(fields, barcode=barcode)) for fields, barcode in zip(records, barcodes)]
+        rejected = len(chunk) - len(records)
+
+        def before_commit():
+            state['rows_read'] += len(chunk)
+            state['rows_imported'] += len(records)
+            state['rows_rejected'] += rejected
+            state['reject_offset'] = rejects.flush()
+            self._save_checkpoint(state)
+
+        saved = dict(state)
+        result = Database.add_records_batch(records, keep_datetime=True, before_commit=before_commit)
+        if 'error' in result:
+            state.update(saved)
+            for barcode in barcodes:
+                allocator.release(barcode)
+            raise RuntimeError(f'Import stopped at row {chunk[0][0]}: {result["error"]}')
+        return len(chunk)
+
+    def run(self, restart: bool = False, progress=None) -> ImportProgress:
+        """
+        Import the file, continuing after the last committed chunk of an earlier run.
+
+        Args:
+            restart (bool): Ignore the checkpoint and import the file from its first row.
+            progress: Called with an ImportProgress after every committed chunk.
+
+        Returns:
+            ImportProgress: The totals of the file.
+
+        Raises:
+            ValueError: If the file changed since an unfinished import of it.
+            RuntimeError: If a chunk can not be stored; the import can be resumed.
+        """
+        state = self._load_checkpoint(restart)
+        started = time.perf_counter()
+        read = 0
+
+        def report(finished: bool = False) -> ImportProgress:
+            elapsed = time.perf_counter() - started
+            return ImportProgress(state['rows_read'], state['rows_imported'], state['rows_rejected'],
+                                  round(read / elapsed, 1) if elapsed else 0.0, finished)
+
+        if state['finished']:
+            return report(finished=True)
+
+        rejects = RejectWriter(self.reject_path, self.file_format, state['reject_offset'])
+        executor = ProcessPoolExecutor(self.workers) if self.workers > 1 else None
+        try:
+            pending = collections.deque()
+            chunks = self._chunks(state['rows_read'])
+            while True:
+                # Keep every worker busy with a chunk while the oldest one is written
+                while len(pending) <= (self.workers if executor else 0):
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    records = [record for _, _, record in chunk]
+                    now = datetime.datetime.now().strftime(DATETIME_FORMAT)
+                    if executor is None:
+                        pending.append((chunk, validate_records(records, now)))
+                    else:
+                        pending.append((chunk, executor.submit(validate_records, records, now)))
+                if not pending:
+                    break
+
+                chunk, results = pending.popleft()
+                if executor is not None:
+                    results = results.result()
+                read += self._commit_chunk(state, chunk, results, rejects)
+                if progress is not None:
+                    progress(report())
+
+            state['finished'] = True
+            self._save_checkpoint(state)
+            db.session.commit()
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            rejects.close()
+        return report(finished=True)
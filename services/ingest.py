@@ -0,0 +1,287 @@
+"""
+Write-behind ingest of single records.
+
+With INGEST_ASYNC enabled, POST /api/records validates the record, assigns
+its barcode and puts it on a bounded in-process queue; the response is sent
+before the record is written. A writer thread per worker process drains the
+queue in group commits: records are written with Database.add_records_batch
+in one transaction as soon as INGEST_BATCH_SIZE records are waiting or the
+oldest of them waited INGEST_FLUSH_MS milliseconds.
+
+When the queue is full, submitting waits up to INGEST_ENQUEUE_TIMEOUT seconds
+and then fails, so clients are slowed down instead of the queue growing
+without bound. The queue is flushed before the process exits.
+
+Every worker keeps the status of its last INGEST_STATUS_SIZE records and
+records the failed writes in the 'ingest_failure' table for
+INGEST_FAILURE_RETENTION seconds. A record that is not known to the worker
+is durable if it is in the database, failed if it has a failure row, and
+queued while the block of its barcode is reserved: the worker that holds the
+block may not have written it yet.
+"""
+
+import atexit
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import delete, insert, select
+
+from app.exceptions import IngestQueueFullError
+from app.extensions import db
+from app.models.records import IngestFailure
+from app.services.barcode_gen import allocator
+from app.services.db import Database
+from app.services.dimension_cache import LRUCache
+from app.validator.records_model import APIData
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = 'queued'
+STATUS_DURABLE = 'durable'
+STATUS_FAILED = 'failed'
+
+# Put on the queue by close(): the writer stops after the records before it
+_STOP = object()
+
+
+class IngestQueue:
+    """
+    Bounded queue of validated records with a group-committing writer thread.
+
+    Attributes:
+        enabled (bool): Whether POST /api/records goes through the queue.
+        maxsize (int): The most records waiting to be written.
+        batch_size (int): The most records written in one transaction.
+        flush_interval (float): The longest time in seconds a record waits for its group to fill.
+        enqueue_timeout (float): The longest time in seconds a request waits for room in a full queue.
+        failure_retention (int): The seconds a failed write is kept in the database.
+    """
+
+    def __init__(self, maxsize: int = 10000, batch_size: int = 500, flush_interval: float = 0.02,
+                 enqueue_timeout: float = 1.0, status_size: int = 100000):
+        self.enabled = False
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.failure_retention = 86400
+        self._statuses = LRUCache(status_size)
+        self._app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._metrics = {'enqueued': 0, 'rejected': 0, 'written': 0, 'failed': 0, 'groups': 0}
+
+    def init_app(self, app):
+        """
+        Read the ingest settings from the application config.
+
+        Args:
+            app: The Flask application.
+        """
+        self.enabled = app.config.get('INGEST_ASYNC', False)
+        self.maxsize = app.config.get('INGEST_QUEUE_SIZE', self.maxsize)
+        self.batch_size = app.config.get('INGEST_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('INGEST_FLUSH_MS', self.flush_interval * 1000) / 1000
+        self.enqueue_timeout = app.config.get('INGEST_ENQUEUE_TIMEOUT', self.enqueue_timeout)
+        self._statuses.maxsize = app.config.get('INGEST_STATUS_SIZE', self._statuses.maxsize)
+        self.failure_retention = app.config.get('INGEST_FAILURE_RETENTION', self.failure_retention)
+        app.extensions['ingest_queue'] = self
+        if self.enabled:
+            self._app = app
+            atexit.register(self.close)
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        # A writer thread of the parent of a forked worker does not run in the worker
+        self._queue = queue.Queue(self.maxsize)
+        self._pid = os.getpid()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, record: APIData):
+        """
+        Queue a validated record with its barcode for writing.
+
+        Args:
+            record (APIData): The record.
+
+        Raises:
+            IngestQueueFullError: If the queue stayed full for enqueue_timeout seconds.
+        """
+        with self._lock:
+            self._start()
+            closed = self._closed
+        if closed:
+            # The process is shutting down: write the record right away
+            self._write([record])
+            return
+
+        self._statuses.set(record.barcode, {'status': STATUS_QUEUED})
+        try:
+            self._queue.put(record, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._statuses.pop(record.barcode)
+            with self._lock:
+                self._metrics['rejected'] += 1
+            raise IngestQueueFullError(self.maxsize)
+        with self._lock:
+            self._metrics['enqueued'] += 1
+
+    def status(self, barcode: int) -> dict | None:
+        """
+        The ingest status of a record submitted to this worker.
+
+        Returns:
+            dict | None: The 'status' and, for failed records, the 'error'; None if the record is not known.
+        """
+        return self._statuses.get(barcode)
+
+    def lookup(self, barcode: int) -> dict | None:
+        """
+        The ingest status of a record submitted to any worker.
+
+        Returns:
+            dict | None: The 'status' and, for failed records, the 'error'; None if the record is not known.
+        """
+        status = self.status(barcode)
+        if status is not None:
+            return status
+        if Database.find_barcodes([barcode]):
+            return {'status': STATUS_DURABLE}
+        with db.engine.connect() as conn:
+            error = conn.execute(select(IngestFailure.error).where(IngestFailure.barcode == barcode)).scalar()
+        if error is not None:
+            return {'status': STATUS_FAILED, 'error': error}
+        if self.enabled and allocator.is_leased(barcode):
+            return {'status': STATUS_QUEUED}
+        return None
+
+    def _next_group(self) -> tuple[list, bool]:
+        group = [self._queue.get()]
+        if group[0] is _STOP:
+            return [], True
+        deadline = time.monotonic() + self.flush_interval
+        while len(group) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # After the deadline only the records that are already waiting join the group
+                record = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is _STOP:
+                return group, True
+            group.append(record)
+        return group, False
+
+    def _run(self):
+        while True:
+            group, stop = self._next_group()
+            if group:
+                self._write(group)
+            if stop:
+                return
+
+    def _write(self, group: list[APIData]):
+        try:
+            with self._app.app_context():
+                result = Database.add_records_batch(group, keep_datetime=True)
+                if 'error' in result and len(group) > 1:
+                    # Write the records one by one to fail only the ones that can not be stored
+                    results = [Database.add_records_batch([record], keep_datetime=True) for record in group]
+                else:
+                    results = [result] * len(group)
+                db.session.remove()
+        except Exception as ex:
+            logger.exception('ingest group failed')
+            results = [{'error': f'Error occurred while adding record: {ex}'}] * len(group)
+
+        failures = {}
+        for record, result in zip(group, results):
+            if 'error' in result:
+                # The client holds the barcode, so it is not handed out again
+                self._statuses.set(record.barcode, {'status': STATUS_FAILED, 'error': result['error']})
+                failures[record.barcode] = result['error']
+            else:
+                self._statuses.set(record.barcode, {'status': STATUS_DURABLE})
+        if failures:
+            self._record_failures(failures)
+        with self._lock:
+            self._metrics['groups'] += 1
+            self._metrics['written'] += len(group) - len(failures)
+            self._metrics['failed'] += len(failures)
+
+    def _record_failures(self, failures: dict[int, str]):
+        now = datetime.datetime.now()
+        try:
+            with self._app.app_context(), db.engine.begin() as conn:
+                conn.execute(delete(IngestFailure).where(IngestFailure.barcode.in_(list(failures))))
+                conn.execute(insert(IngestFailure), [{'barcode': barcode, 'error': error, 'failed_at': now}
+                                                     for barcode, error in failures.items()])
+        except Exception:
+            logger.exception('ingest failures not recorded', extra={'count': len(failures)})
+
+    def close(self, timeout: float = 30.0):
+        """
+        Write every queued record and stop the writer thread.
+
+        Args:
+            timeout (float): The longest time in seconds to wait for the writer.
+        """
+        with self._lock:
+            if self._closed or self._pid != os.getpid():
+                return
+            self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+        # Records submitted while the writer was stopping
+        leftover = []
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not _STOP:
+                leftover.append(record)
+        if leftover:
+            self._write(leftover)
+
+    def purge(self, batch_size: int = 1000) -> int:
+        """
+        Delete the failed writes older than the retention in batches.
+
+        Returns:
+            int: The number of deleted rows.
+        """
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=self.failure_retention)
+        purged = 0
+        while True:
+            barcodes = db.session.execute(select(IngestFailure.barcode).where(IngestFailure.failed_at <= cutoff)
+                                          .limit(batch_size)).scalars().all()
+            if not barcodes:
+                return purged
+            purged += db.session.execute(delete(IngestFailure).where(IngestFailure.barcode.in_(barcodes))).rowcount
+            db.session.commit()
+
+    def stats(self) -> dict:
+        """
+        Queue depth and write counters of this worker.
+
+        Returns:
+            dict: The ingest metrics.
+        """
+        with self._lock:
+            return dict(self._metrics, enabled=self.enabled, capacity=self.maxsize,
+                        depth=self._queue.qsize() if self._queue is not None else 0)
+
+
+ingest_queue = IngestQueue()
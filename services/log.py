@@ -0,0 +1,68 @@
+"""
+Logging setup of the application.
+
+Modules log through logging.getLogger(__name__), which places them under the
+application logger 'app'. Structured fields are passed with `extra=` and are
+rendered by JsonFormatter when LOG_FORMAT is 'json'.
+"""
+
+import json
+import logging
+
+from flask.logging import default_handler
+
+# Attributes every LogRecord has; anything else was passed with `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def record_fields(record: logging.LogRecord) -> dict:
+    """
+    The structured fields passed to a log call with `extra=`.
+    """
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a log record as one JSON object per line.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': self.formatTime(record),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage()}
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    The default Flask log format followed by the structured fields as key=value pairs.
+    """
+
+    def __init__(self):
+        super().__init__('[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            message += ' ' + ' '.join(f'{key}={value!r}' for key, value in fields.items())
+        return message
+
+
+def configure_logging(app):
+    """
+    Set the level and format of the application logger from LOG_LEVEL and LOG_FORMAT.
+
+    Args:
+        app: The Flask application.
+    """
+    app.logger.setLevel(app.config.get('LOG_LEVEL', 'INFO').upper())
+    if app.config.get('LOG_FORMAT', 'text') == 'json':
+        default_handler.setFormatter(JsonFormatter())
+    else:
+        default_handler.setFormatter(TextFormatter())
@@ -0,0 +1,244 @@
+"""
+Per-request instrumentation exposed in the Prometheus text format.
+
+Flask request hooks time every request and SQLAlchemy engine events count
+and time the statements it issues. Counters are kept per worker process;
+scrape every worker or aggregate them in the collector.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from app.extensions import db
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+# Statements kept per request for the slow request log
+MAX_CAPTURED_STATEMENTS = 50
+
+
+@dataclass
+class Histogram:
+    buckets: tuple
+    counts: list = field(default=None)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self):
+        self.counts = [0] * len(self.buckets)
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+@dataclass
+class EndpointMetrics:
+    duration: Histogram = field(default_factory=lambda: Histogram(DURATION_BUCKETS))
+    statements: Histogram = field(default_factory=lambda: Histogram(STATEMENT_BUCKETS))
+    responses: dict = field(default_factory=dict)
+    sql_seconds: float = 0.0
+    rows: int = 0
+    response_bytes: int = 0
+
+
+@dataclass
+class RequestStats:
+    started: float
+    statements: int = 0
+    sql_seconds: float = 0.0
+    rows: int = 0
+    captured: list = field(default_factory=list)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels) -> str:
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class RequestMetrics:
+    """
+    Collects latency, SQL and payload metrics per endpoint.
+
+    Attributes:
+        enabled (bool): Whether requests are instrumented.
+        slow_request_seconds (float): Requests slower than this are logged with
+            their statements; 0 disables the slow request log.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.slow_request_seconds = 0.0
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._engines = set()
+
+    def init_app(self, app):
+        """
+        Register the request hooks and the engine events of the application.
+
+        Args:
+            app: The Flask application.
+        """
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.slow_request_seconds = app.config.get('SLOW_REQUEST_MS', 0) / 1000
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        with app.app_context():
+            for engine in db.engines.values():
+                if id(engine) not in self._engines:
+                    self._engines.add(id(engine))
+                    event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                    event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_request(self):
+        g.request_stats = RequestStats(started=time.perf_counter())
+
+    @staticmethod
+    def _current() -> RequestStats | None:
+        return g.get('request_stats') if has_request_context() else None
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        stats = self._current()
+        if stats is None:
+            return
+        stats.statements += 1
+        stats.sql_seconds += elapsed
+        if self.slow_request_seconds and len(stats.captured) < MAX_CAPTURED_STATEMENTS:
+            stats.captured.append((round(elapsed * 1000, 3), statement))
+
+    def observe_rows(self, count: int):
+        """
+        Count rows read from the database for the current request.
+
+        Args:
+            count (int): The number of rows.
+        """
+        stats = self._current()
+        if stats is not None:
+            stats.rows += count
+
+    def _after_request(self, response):
+        stats = self._current()
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats.started
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        key = (endpoint, request.method)
+
+        with self._lock:
+            metrics = self._endpoints.setdefault(key, EndpointMetrics())
+            metrics.duration.observe(elapsed)
+            metrics.statements.observe(stats.statements)
+            metrics.responses[response.status_code] = metrics.responses.get(response.status_code, 0) + 1
+            metrics.sql_seconds += stats.sql_seconds
+            metrics.rows += stats.rows
+
+        if response.is_streamed:
+            response.response = self._count_stream(response.response, metrics, stats)
+        else:
+            with self._lock:
+                metrics.response_bytes += response.calculate_content_length() or 0
+
+        if self.slow_request_seconds and elapsed >= self.slow_request_seconds:
+            logger.warning('slow request', extra={
+                'method': request.method,
+                'path': request.full_path.rstrip('?'),
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 3),
+                'sql_statements': stats.statements,
+                'sql_ms': round(stats.sql_seconds * 1000, 3),
+                'statements': stats.captured,
+            })
+        return response
+
+    def _count_stream(self, chunks, metrics: EndpointMetrics, stats: RequestStats):
+        # A streamed body reads its rows after the request hooks have run
+        rows, sql_seconds = stats.rows, stats.sql_seconds
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            # Closing the wrapper must close the wrapped body, like the server would
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            with self._lock:
+                metrics.response_bytes += size
+                metrics.rows += stats.rows - rows
+                metrics.sql_seconds += stats.sql_seconds - sql_seconds
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition text.
+        """
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            lines = []
+
+            def header(name: str, kind: str, description: str):
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {kind}')
+
+            def histogram(name: str, attribute: str, description: str):
+                header(name, 'histogram', description)
+                for (endpoint, method), metrics in endpoints:
+                    values = getattr(metrics, attribute)
+                    cumulative = 0
+                    for bound, count in zip(values.buckets, values.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(endpoint=endpoint, method=method, le=bound)} {cumulative}')
+                    lines.append(f'{name}_bucket{_labels(endpoint=endpoint, method=method, le="+Inf")} {values.count}')
+                    lines.append(f'{name}_sum{_labels(endpoint=endpoint, method=method)} {values.total}')
+                    lines.append(f'{name}_count{_labels(endpoint=endpoint, method=method)} {values.count}')
+
+            def counter(name: str, attribute: str, description: str):
+                header(name, 'counter', description)
+                for (endpoint, method), metrics in endpoints:
+                    lines.append(f'{name}{_labels(endpoint=endpoint, method=method)} {getattr(metrics, attribute)}')
+
+            header('batteryhub_requests_total', 'counter', 'Finished requests by status code.')
+            for (endpoint, method), metrics in endpoints:
+                for status, count in sorted(metrics.responses.items()):
+                    lines.append(f'batteryhub_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+
+            histogram('batteryhub_request_duration_seconds', 'duration', 'Request latency.')
+            histogram('batteryhub_sql_statements', 'statements', 'SQL statements per request.')
+            counter('batteryhub_sql_duration_seconds_total', 'sql_seconds', 'Time spent executing SQL statements.')
+            counter('batteryhub_rows_returned_total', 'rows', 'Rows read from the database.')
+            counter('batteryhub_response_bytes_total', 'response_bytes', 'Response body bytes.')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = RequestMetrics()
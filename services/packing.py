@@ -0,0 +1,258 @@
+"""
+Assembly of balanced battery packs from the inventory.
+
+A pack of S groups in series, each of P cells in parallel (for example 13s4p),
+is limited by its weakest group. PackMatcher picks S*P cells from the
+candidates and partitions them so the total capacity and the internal
+resistance of the parallel groups are as even as possible.
+"""
+
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+TOPOLOGY_PATTERN = re.compile(r'^\s*(\d+)\s*s\s*(\d+)\s*p\s*$', re.IGNORECASE)
+
+# 'uniform' takes the cells of the tightest capacity window, 'capacity' the highest capacity cells
+SELECTIONS = ('uniform', 'capacity')
+
+
+@dataclass
+class PackTopology:
+    series: int
+    parallel: int
+
+    @property
+    def cells(self) -> int:
+        return self.series * self.parallel
+
+    def __str__(self) -> str:
+        return f'{self.series}s{self.parallel}p'
+
+
+def parse_topology(value: str) -> PackTopology:
+    """
+    Parse a topology like '13s4p'.
+
+    Raises:
+        ValueError: If the value is not a valid topology.
+    """
+    match = TOPOLOGY_PATTERN.match(value or '')
+    if not match:
+        raise ValueError(f"Invalid topology: {value}. Expected a value like '13s4p'")
+    topology = PackTopology(int(match.group(1)), int(match.group(2)))
+    if topology.series < 1 or topology.parallel < 1:
+        raise ValueError('Topology must have at least one cell in series and in parallel')
+    return topology
+
+
+def _spread(values: np.ndarray) -> float:
+    return float((values.max() - values.min()) / values.mean())
+
+
+class PackMatcher:
+    """
+    Greedy partitioning with local-search refinement.
+
+    The cells are first dealt to the groups in a snake order of descending
+    capacity. The refinement then repeatedly applies the swap of two cells
+    between two groups that lowers the cost the most, evaluating all P*P swaps
+    of a group pair at once. The cost is the relative capacity spread of the
+    groups plus ir_weight times the relative spread of their parallel resistance.
+
+    Attributes:
+        ir_weight (float): The weight of the resistance spread in the cost.
+        max_iterations (int): The maximum number of applied swaps.
+        seed (int): The seed for picking random group pairs.
+    """
+
+    def __init__(self, ir_weight: float = 1.0, max_iterations: int = 5000, seed: int = 0):
+        self.ir_weight = ir_weight
+        self.max_iterations = max_iterations
+        self.seed = seed
+
+    @staticmethod
+    def select(capacity: np.ndarray, cells: int, selection: str = 'uniform') -> np.ndarray:
+        """
+        Pick the cells the pack is built from.
+
+        Args:
+            capacity (np.ndarray): The capacity of every candidate.
+            cells (int): The number of cells to pick.
+            selection (str): One of SELECTIONS.
+
+        Returns:
+            np.ndarray: The indexes of the picked candidates.
+        """
+        if selection == 'capacity':
+            return np.argpartition(-capacity, cells - 1)[:cells]
+
+        order = np.argsort(capacity, kind='stable')
+        ordered = capacity[order]
+        window = ordered[cells - 1:] - ordered[:len(ordered) - cells + 1]
+        # Of equally tight windows take the one with the highest capacity
+        start = np.flatnonzero(window == window.min())[-1]
+        return order[start:start + cells]
+
+    @staticmethod
+    def snake_groups(capacity: np.ndarray, topology: PackTopology) -> np.ndarray:
+        """
+        Deal the cells to the groups in snake order of descending capacity.
+
+        Returns:
+            np.ndarray: A (series, parallel) array of cell indexes.
+        """
+        order = np.argsort(-capacity, kind='stable').reshape(topology.parallel, topology.series)
+        order[1::2] = order[1::2, ::-1]
+        return np.ascontiguousarray(order.T)
+
+    def cost(self, group_capacity: np.ndarray, group_resistance: np.ndarray) -> float:
+        return _spread(group_capacity) + self.ir_weight * _spread(group_resistance)
+
+    def _best_swap(self, groups, capacity, conductance, group_capacity, group_conductance, a, b):
+        """
+        The cost and cell positions of the best swap between groups a and b.
+        """
+        capacity_a, capacity_b = capacity[groups[a]], capacity[groups[b]]
+        conductance_a, conductance_b = conductance[groups[a]], conductance[groups[b]]
+
+        new_capacity_a = group_capacity[a] - capacity_a[:, None] + capacity_b[None, :]
+        new_capacity_b = group_capacity[b] + capacity_a[:, None] - capacity_b[None, :]
+        new_resistance_a = 1 / (group_conductance[a] - conductance_a[:, None] + conductance_b[None, :])
+        new_resistance_b = 1 / (group_conductance[b] + conductance_a[:, None] - conductance_b[None, :])
+
+        rest = np.ones(len(groups), dtype=bool)
+        rest[[a, b]] = False
+        rest_capacity = group_capacity[rest]
+        rest_resistance = 1 / group_conductance[rest]
+        if rest.any():
+            capacity_max, capacity_min = rest_capacity.max(), rest_capacity.min()
+            resistance_max, resistance_min = rest_resistance.max(), rest_resistance.min()
+        else:
+            capacity_max = resistance_max = -np.inf
+            capacity_min = resistance_min = np.inf
+
+        # Swaps keep the total capacity, so its mean is constant
+        capacity_spread = (np.maximum(np.maximum(new_capacity_a, new_capacity_b), capacity_max)
+                           - np.minimum(np.minimum(new_capacity_a, new_capacity_b), capacity_min))
+        capacity_spread /= group_capacity.mean()
+        resistance_mean = (rest_resistance.sum() + new_resistance_a + new_resistance_b) / len(groups)
+        resistance_spread = (np.maximum(np.maximum(new_resistance_a, new_resistance_b), resistance_max)
+                             - np.minimum(np.minimum(new_resistance_a, new_resistance_b), resistance_min))
+        costs = capacity_spread + self.ir_weight * resistance_spread / resistance_mean
+
+        i, j = np.unravel_index(np.argmin(costs), costs.shape)
+        return float(costs[i, j]), i, j
+
+    def refine(self, groups: np.ndarray, capacity: np.ndarray, resistance: np.ndarray) -> tuple[np.ndarray, int]:
+        """
+        Improve a partition with pairwise swaps until no swap lowers the cost.
+
+        Args:
+            groups (np.ndarray): The (series, parallel) array of cell indexes.
+            capacity (np.ndarray): The capacity of every cell.
+            resistance (np.ndarray): The internal resistance of every cell.
+
+        Returns:
+            tuple[np.ndarray, int]: The refined groups and the number of applied swaps.
+        """
+        series = len(groups)
+        if series < 2:
+            return groups, 0
+
+        rng = np.random.default_rng(self.seed)
+        conductance = 1 / resistance
+        group_capacity = capacity[groups].sum(axis=1)
+        group_conductance = conductance[groups].sum(axis=1)
+        current = self.cost(group_capacity, 1 / group_conductance)
+        random_pairs = min(series * (series - 1) // 2, 32)
+
+        swaps = 0
+        while swaps < self.max_iterations:
+            group_resistance = 1 / group_conductance
+            pairs = [(int(group_capacity.argmax()), int(group_capacity.argmin())),
+                     (int(group_resistance.argmax()), int(group_resistance.argmin()))]
+            best = None
+            for _ in range(2):
+                for a, b in pairs:
+                    if a == b:
+                        continue
+                    cost, i, j = self._best_swap(groups, capacity, conductance,
+                                                 group_capacity, group_conductance, a, b)
+                    if cost < current - 1e-12 and (best is None or cost < best[0]):
+                        best = (cost, a, b, i, j)
+                if best is not None:
+                    break
+                # The extreme groups can not be improved directly; try other pairs
+                pairs = [tuple(rng.choice(series, 2, replace=False)) for _ in range(random_pairs)]
+            if best is None:
+                break
+
+            current, a, b, i, j = best
+            cell_a, cell_b = groups[a, i], groups[b, j]
+            groups[a, i], groups[b, j] = cell_b, cell_a
+            group_capacity[a] += capacity[cell_b] - capacity[cell_a]
+            group_capacity[b] += capacity[cell_a] - capacity[cell_b]
+            group_conductance[a] += conductance[cell_b] - conductance[cell_a]
+            group_conductance[b] += conductance[cell_a] - conductance[cell_b]
+            swaps += 1
+
+        return groups, swaps
+
+    def match(self, barcodes, capacity, resistance, topology: PackTopology,
+              selection: str = 'uniform') -> dict:
+        """
+        Build a balanced pack from candidate cells.
+
+        Args:
+            barcodes: The barcode of every candidate.
+            capacity: The capacity of every candidate in mAh.
+            resistance: The internal resistance of every candidate in mOhm.
+            topology (PackTopology): The pack layout.
+            selection (str): One of SELECTIONS.
+
+        Returns:
+            dict: The barcodes of every parallel group and the balance statistics.
+
+        Raises:
+            ValueError: If there are fewer candidates than cells in the pack.
+        """
+        barcodes = np.asarray(barcodes, dtype=np.int64)
+        capacity = np.asarray(capacity, dtype=np.float64)
+        resistance = np.asarray(resistance, dtype=np.float64)
+        if len(barcodes) < topology.cells:
+            raise ValueError(f'Not enough cells for a {topology} pack: '
+                             f'{topology.cells} needed, {len(barcodes)} candidates')
+
+        picked = self.select(capacity, topology.cells, selection)
+        barcodes, capacity, resistance = barcodes[picked], capacity[picked], resistance[picked]
+
+        groups = self.snake_groups(capacity, topology)
+        initial_cost = self.cost(capacity[groups].sum(axis=1), 1 / (1 / resistance[groups]).sum(axis=1))
+        groups, swaps = self.refine(groups, capacity, resistance)
+
+        group_capacity = capacity[groups].sum(axis=1)
+        group_resistance = 1 / (1 / resistance[groups]).sum(axis=1)
+        return {
+            'topology': str(topology),
+            'groups': [
+                {'index': index,
+                 'barcodes': barcodes[cells].tolist(),
+                 'capacity': round(float(group_capacity[index]), 1),
+                 'resistance': round(float(group_resistance[index]), 3)}
+                for index, cells in enumerate(groups)
+            ],
+            'stats': {
+                'pack_capacity': round(float(group_capacity.min()), 1),
+                'pack_resistance': round(float(group_resistance.sum()), 3),
+                'capacity_spread': round(float(group_capacity.max() - group_capacity.min()), 1),
+                'capacity_spread_pct': round(_spread(group_capacity) * 100, 3),
+                'resistance_spread': round(float(group_resistance.max() - group_resistance.min()), 4),
+                'resistance_spread_pct': round(_spread(group_resistance) * 100, 3),
+                'cell_capacity_range': [float(capacity.min()), float(capacity.max())],
+                'initial_cost': round(initial_cost, 6),
+                'cost': round(self.cost(group_capacity, group_resistance), 6),
+                'swaps': swaps,
+            },
+        }
@@ -0,0 +1,78 @@
+"""
+Keyset cursors for paginated record lists.
+
+A cursor points at the (sort value, id) of a row at the edge of a page and
+remembers in which direction the next page lies. It is sent to clients as an
+opaque url-safe base64 string.
+"""
+
+import base64
+import datetime
+import json
+from decimal import Decimal
+from typing import Any
+
+DIRECTION_NEXT = 'next'
+DIRECTION_PREV = 'prev'
+
+
+def encode_cursor(sort_by: str, value: Any, record_id: int, direction: str) -> str:
+    """
+    Build an opaque cursor string.
+
+    Args:
+        sort_by (str): The sort column the cursor belongs to.
+        value: The sort column value of the edge row.
+        record_id (int): The id of the edge row.
+        direction (str): DIRECTION_NEXT or DIRECTION_PREV.
+
+    Returns:
+        str: The encoded cursor.
+    """
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        value = value.isoformat()
+    elif isinstance(value, Decimal):
+        value = str(value)
+    payload = {'s': sort_by, 'v': value, 'i': record_id, 'd': direction}
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort_by: str, python_type: type) -> tuple[Any, int, str]:
+    """
+    Decode a cursor string built by encode_cursor.
+
+    Args:
+        cursor (str): The encoded cursor.
+        sort_by (str): The sort column of the current request.
+        python_type (type): The Python type of the sort column.
+
+    Returns:
+        tuple[Any, int, str]: The sort value, the record id and the direction.
+
+    Raises:
+        ValueError: If the cursor is malformed or belongs to another sort column.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        value, record_id, direction = payload['v'], int(payload['i']), payload['d']
+        cursor_sort_by = payload['s']
+    except (ValueError, KeyError, TypeError, ArithmeticError):
+        raise ValueError('Invalid cursor')
+
+    if cursor_sort_by != sort_by:
+        raise ValueError('Cursor does not belong to this sort column')
+    if direction not in (DIRECTION_NEXT, DIRECTION_PREV):
+        raise ValueError('Invalid cursor')
+
+    # A tampered value fails here: fromisoformat() of a number raises TypeError, Decimal() InvalidOperation
+    try:
+        if value is not None:
+            if python_type is datetime.datetime:
+                value = datetime.datetime.fromisoformat(value)
+            else:
+                value = python_type(value)
+    except (ValueError, TypeError, ArithmeticError):
+        raise ValueError('Invalid cursor')
+    return value, record_id, direction
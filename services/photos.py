@@ -0,0 +1,228 @@
+"""
+Battery photos.
+
+The 'photo' table only keeps the SHA-256 and the metadata of a photo; the
+image itself is a file in the content-addressed blob store, so identical
+uploads share one file and one row. Thumbnails are JPEG variants of the
+blobs, generated in a process pool on upload and on the first download.
+"""
+
+import datetime
+import logging
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, BinaryIO
+
+from sqlalchemy import exc, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.exceptions import BlobTooLargeError
+from app.extensions import db
+from app.models.parameters import Photo
+from app.models.records import BatteryData
+from app.services.blob_store import blob_store
+
+logger = logging.getLogger(__name__)
+
+# Image formats of Pillow that are accepted, with their content type
+IMAGE_FORMATS = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp', 'GIF': 'image/gif'}
+
+THUMBNAIL_SUFFIX = '.jpg'
+THUMBNAIL_QUALITY = 85
+
+
+def inspect_image(path: str) -> tuple[str, int, int]:
+    """
+    The content type, width and height of an image file; only the image header is read.
+
+    Raises:
+        ValueError: If the file is not an image in one of IMAGE_FORMATS.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+            width, height = image.size
+    except (UnidentifiedImageError, OSError):
+        image_format = None
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f'File is not a supported image. Expected any of: {", ".join(IMAGE_FORMATS)}')
+    return IMAGE_FORMATS[image_format], width, height
+
+
+def make_thumbnail(source: str, target: str, size: int) -> str:
+    """
+    Write a JPEG thumbnail that fits into size x size pixels.
+
+    Runs in the worker processes of ThumbnailPool, so it only depends on its arguments.
+    """
+    from PIL import Image
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temporary = f'{target}.{os.getpid()}.tmp'
+    with Image.open(source) as image:
+        # Lets the JPEG decoder skip the resolution the thumbnail does not need
+        image.draft('RGB', (size, size))
+        thumbnail = image.convert('RGB')
+        thumbnail.thumbnail((size, size))
+        thumbnail.save(temporary, 'JPEG', quality=THUMBNAIL_QUALITY)
+    os.replace(temporary, target)
+    return target
+
+
+class ThumbnailPool:
+    """
+    Generates thumbnails in worker processes, at most once at a time per photo.
+
+    Attributes:
+        workers (int): The number of worker processes.
+        size (int): The largest thumbnail width and height in pixels.
+    """
+
+    def __init__(self, workers: int = 2, size: int = 256):
+        self.workers = workers
+        self.size = size
+        self._executor = None
+        self._pid = None
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Read the thumbnail settings from the application config.
+
+        Args:
+            app: The Flask application.
+        """
+        self.workers = app.config.get('THUMBNAIL_WORKERS', self.workers)
+        self.size = app.config.get('THUMBNAIL_SIZE', self.size)
+        app.extensions['thumbnail_pool'] = self
+
+    def path(self, digest: str) -> str:
+        return blob_store.path(digest, variant=f'thumb-{self.size}', suffix=THUMBNAIL_SUFFIX)
+
+    def submit(self, digest: str) -> Future:
+        """
+        Generate the thumbnail of a blob unless it exists or is being generated.
+
+        Args:
+            digest (str): The SHA-256 of the photo.
+
+        Returns:
+            Future: Resolves to the path of the thumbnail.
+        """
+        target = self.path(digest)
+        if os.path.isfile(target):
+            future = Future()
+            future.set_result(target)
+            return future
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # A pool inherited from the parent of a forked worker is not usable
+                self._executor = ProcessPoolExecutor(self.workers)
+                self._pid = os.getpid()
+                self._running = {}
+            if digest not in self._running:
+                future = self._executor.submit(make_thumbnail, blob_store.path(digest), target, self.size)
+                self._running[digest] = future
+                future.add_done_callback(lambda _: self._done(digest))
+            return self._running[digest]
+
+    def _done(self, digest: str):
+        with self._lock:
+            future = self._running.pop(digest, None)
+        if future is not None and future.exception() is not None:
+            logger.warning('thumbnail failed', extra={'digest': digest, 'error': str(future.exception())})
+
+
+class Photos:
+    """
+    Photo rows of the records.
+    """
+
+    @classmethod
+    def serialize(cls, photo: Photo) -> dict[str, Any]:
+        return {
+            'sha256': photo.sha256,
+            'content_type': photo.content_type,
+            'size': photo.size,
+            'width': photo.width,
+            'height': photo.height,
+            'created_at': photo.created_at,
+        }
+
+    @classmethod
+    def for_barcode(cls, barcode: int) -> Photo | None:
+        """
+        The photo of a live record, or None if the record does not exist or has no photo.
+        """
+        return db.session.query(Photo).join(BatteryData, BatteryData.photo_id == Photo.id).filter(
+            BatteryData.barcode == barcode, BatteryData.deleted_at.is_(None)).first()
+
+    @classmethod
+    def get_or_create(cls, digest: str, size: int, content_type: str, width: int | None,
+                      height: int | None) -> Photo:
+        photo = Photo.query.filter_by(sha256=digest).first()
+        if photo is not None:
+            return photo
+        photo = Photo(sha256=digest, size=size, content_type=content_type, width=width, height=height,
+                      created_at=datetime.datetime.now())
+        try:
+            with db.session.begin_nested():
+                db.session.add(photo)
+        except exc.IntegrityError:
+            # Another worker stored the same photo first
+            photo = Photo.query.filter_by(sha256=digest).one()
+        return photo
+
+    @classmethod
+    def attach(cls, barcode: int, stream: BinaryIO, max_bytes: int) -> dict[str, Any]:
+        """
+        Store an uploaded image and make it the photo of a record.
+
+        Args:
+            barcode (int): The barcode of the record.
+            stream: The image content.
+            max_bytes (int): The largest accepted image.
+
+        Returns:
+            dict[str, Any]: The photo metadata, or an error.
+
+        Raises:
+            BlobTooLargeError: If the image is larger than max_bytes.
+        """
+        exists = db.session.query(BatteryData.id).filter(
+            BatteryData.barcode == barcode, BatteryData.deleted_at.is_(None)).first()
+        if exists is None:
+            return {'error': 'Record not found.', 'description': 'Not found'}
+
+        metadata = {}
+
+        def check(path: str):
+            metadata['content_type'], metadata['width'], metadata['height'] = inspect_image(path)
+
+        try:
+            digest, size = blob_store.put(stream, max_bytes, check=check)
+        except BlobTooLargeError:
+            raise
+        except ValueError as ex:
+            return {'error': str(ex), 'description': 'Invalid image'}
+
+        try:
+            photo = cls.get_or_create(digest, size, **metadata)
+            db.session.execute(update(BatteryData).where(BatteryData.barcode == barcode)
+                               .values(photo_id=photo.id).execution_options(synchronize_session=False))
+            db.session.commit()
+        except SQLAlchemyError as ex:
+            db.session.rollback()
+            error_msg = f"Error occurred while storing photo: {ex}"
+            return {'error': error_msg, 'description': 'Database error'}
+
+        thumbnails.submit(digest)
+        return {'success': 'Photo stored successfully.', 'photo': cls.serialize(photo)}
+
+
+thumbnails = ThumbnailPool()
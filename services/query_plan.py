@@ -0,0 +1,248 @@
+"""
+Query plan regression checks.
+
+The checker runs every API scenario against a scratch database, once per read
+model, records the SQL statements the Database service issues, runs EXPLAIN
+for each of them and reports statements whose plan walks a whole table or index.
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+from dataclasses import dataclass, field
+
+from sqlalchemy import MetaData, event, text
+
+# How many rows a scenario reads: LIMITED stops after a page or a single record,
+# FILTERED reads the rows its filter selects and ALL reads the whole inventory
+LIMITED, FILTERED, ALL = 'limited', 'filtered', 'all'
+
+SCENARIOS = (
+    ('add record', 'POST', '/api/records', 'single', LIMITED),
+    ('add batch', 'POST', '/api/records/batch', 'batch', LIMITED),
+    ('barcode lookup', 'GET', '/api/records/{barcode}', None, LIMITED),
+    ('last record', 'GET', '/api/records/last', None, LIMITED),
+    ('filter by name', 'GET', '/api/records?name=LG', None, FILTERED),
+    ('filter by color', 'GET', '/api/records?color=red', None, FILTERED),
+    ('filter by source', 'GET', '/api/records?source=laptop', None, FILTERED),
+    ('filter by voltage', 'GET', '/api/records?min_voltage=3.5&max_voltage=3.7', None, FILTERED),
+    ('filter by resistance', 'GET', '/api/records?min_resistance=20&max_resistance=21', None, FILTERED),
+    ('filter by capacity', 'GET', '/api/records?min_capacity=2400&max_capacity=2600', None, FILTERED),
+    ('first page by id', 'GET', '/api/records?limit=10', None, LIMITED),
+    ('first page by datetime', 'GET', '/api/records?limit=10&sort_by=datetime&order_by=desc', None, LIMITED),
+    ('first page by barcode', 'GET', '/api/records?limit=10&sort_by=barcode', None, LIMITED),
+    ('unpaginated list', 'GET', '/api/records', None, ALL),
+    ('export', 'GET', '/api/records/export?format=csv', None, ALL),
+    ('export by source', 'GET', '/api/records/export?source=laptop', None, FILTERED),
+    ('stats', 'GET', '/api/stats', None, ALL),
+    ('stats by color', 'GET', '/api/stats?color=red', None, FILTERED),
+    ('similar to values', 'GET', '/api/records/similar?capacity=2500&voltage=3.6&k=5', None, ALL),
+    ('similar to record', 'GET', '/api/records/{barcode}/similar?k=5', None, ALL),
+    ('pack match', 'GET', '/api/packs/match?topology=2s2p', None, ALL),
+    ('pack match by source', 'GET', '/api/packs/match?topology=2s2p&source=laptop', None, FILTERED),
+    ('update record', 'PUT', '/api/records/{barcode}', 'update', LIMITED),
+    ('update by filter', 'PATCH', '/api/records', 'patch', FILTERED),
+    ('delete record', 'DELETE', '/api/records/{barcode}', None, LIMITED),
+    ('delete by filter', 'DELETE', '/api/records', 'delete', FILTERED),
+)
+
+# Every scenario runs once per read model
+READ_MODELS = ('join', 'flat')
+
+SEED_RECORDS = 500
+
+RECORD = {'name': 'LG', 'color': 'red', 'voltage': 3.6, 'resistance': 20.5,
+          'capacity': 2500, 'weight': 0.045, 'source': 'laptop'}
+
+
+@dataclass
+class PlanReport:
+    scenario: str
+    statement: str
+    plan: list = field(default_factory=list)
+    full_scans: list = field(default_factory=list)
+    read_model: str = 'join'
+
+
+def explain(conn, statement: str, parameters) -> list[str]:
+    """
+    Run EXPLAIN for a statement and return the plan as text lines.
+
+    Args:
+        conn: The DBAPI connection the statement was executed on.
+        statement (str): The SQL statement.
+        parameters: The statement parameters.
+
+    Returns:
+        list[str]: One line per plan step.
+    """
+    dialect = conn.dialect.name
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+    result = conn.exec_driver_sql(prefix + statement, parameters)
+    if dialect == 'sqlite':
+        return [row[-1] for row in result]
+    keys = list(result.keys())
+    return [json.dumps(dict(zip(keys, [str(value) for value in row]))) for row in result]
+
+
+def seed_records(count: int) -> list[dict]:
+    """
+    Records with enough distinct values for the planner statistics to look like production data.
+    """
+    rng = random.Random(0)
+    return [
+        {'name': rng.choice(['LG', 'Sony', 'Samsung', 'Molicel', 'Panasonic', 'BAK', 'EVE', 'Lishen']),
+         'color': rng.choice(['red', 'blue', 'green', 'pink', 'black', 'white']),
+         'voltage': round(rng.uniform(2.5, 4.2), 2),
+         'resistance': round(rng.uniform(15, 150), 2),
+         'capacity': rng.randint(1500, 3500),
+         'weight': round(rng.uniform(0.040, 0.050), 3),
+         'source': rng.choice(['laptop', 'e-bike', 'power tool', 'vape', 'scooter'])}
+        for _ in range(count)
+    ]
+
+
+def analyze(engine):
+    """
+    Refresh the planner statistics of all tables.
+    """
+    with engine.begin() as conn:
+        if conn.dialect.name == 'sqlite':
+            conn.execute(text('ANALYZE'))
+        else:
+            from app.extensions import db
+            for table in db.metadata.sorted_tables:
+                conn.execute(text(f'ANALYZE TABLE {table.name}'))
+
+
+def is_explainable(statement: str) -> bool:
+    """
+    Whether the statement reads rows: SELECT, UPDATE, DELETE or INSERT ... SELECT.
+    """
+    statement = statement.lstrip().upper()
+    if statement.startswith('INSERT'):
+        return 'SELECT' in statement
+    return statement.startswith(('SELECT', 'UPDATE', 'DELETE'))
+
+
+def find_full_scans(plan: list[str], dialect: str, rows: str = FILTERED) -> list[str]:
+    """
+    Pick the plan steps that read a whole table or a whole index.
+
+    SQLite reports them as 'SCAN <table>', with or without 'USING [COVERING] INDEX',
+    MySQL as access type 'ALL' or 'index'. The outer scan of a LIMITED statement
+    is not reported when it is read in the requested order and so stops after
+    LIMIT rows, nor is the outer scan of a statement that reads ALL rows.
+
+    Args:
+        plan (list[str]): The plan lines returned by explain().
+        dialect (str): The SQLAlchemy dialect name.
+        rows (str): LIMITED, FILTERED or ALL, see SCENARIOS.
+
+    Returns:
+        list[str]: The offending plan steps.
+    """
+    if dialect == 'sqlite':
+        # Co-routines and materialized subqueries hold rows the plan already selected
+        derived = {step.split(' ', 1)[1] for step in plan if step.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+        steps = [step for step in plan if step.startswith(('SCAN ', 'SEARCH '))
+                 and step.split(' ')[1] not in derived and not step.startswith('SCAN (subquery-')]
+        scans = [step for step in steps if step.startswith('SCAN ') and step != 'SCAN CONSTANT ROW']
+        ordered_by_scan = not any('USE TEMP B-TREE' in step for step in plan)
+    else:
+        steps = plan
+        scans = [step for step in plan if json.loads(step).get('type') in ('ALL', 'index')]
+        ordered_by_scan = not any(extra in json.loads(step).get('Extra', '')
+                                  for step in plan for extra in ('Using filesort', 'Using temporary'))
+    if steps and (rows == ALL or (rows == LIMITED and ordered_by_scan)):
+        return [step for step in scans if step != steps[0]]
+    return scans
+
+
+def run_scenarios(client, barcode: int) -> list[tuple[str, str, str, list]]:
+    """
+    Run every scenario and capture the statements that read rows.
+
+    Args:
+        client: The test client of the application.
+        barcode (int): An existing record for the single-record scenarios.
+
+    Returns:
+        list[tuple]: The scenario name, its row scope, the statement and its parameters.
+    """
+    from app.extensions import db
+
+    captured, statements = [], []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and is_explainable(statement):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record_statement)
+    try:
+        for name, method, url, body, rows in SCENARIOS:
+            statements.clear()
+            payload = {'single': json.dumps(RECORD), 'batch': [RECORD],
+                       'update': dict(RECORD, voltage=3.8),
+                       'patch': {'filter': {'source': 'laptop'}, 'set': {'color': 'blue'}},
+                       'delete': {'filter': {'name': 'Sony'}}}.get(body)
+            with contextlib.redirect_stdout(io.StringIO()):
+                client.open(url.format(barcode=barcode), method=method, json=payload)
+            captured += [(name, rows, statement, parameters) for statement, parameters in statements]
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record_statement)
+    return captured
+
+
+def check_query_plans(database_url: str | None = None) -> list[PlanReport]:
+    """
+    Run the API scenarios on a scratch database and explain every statement.
+
+    Args:
+        database_url (str | None): An empty database to run on; a temporary SQLite file by default.
+            It is emptied again after each read model.
+
+    Returns:
+        list[PlanReport]: The explained statements of every scenario.
+    """
+    from app import create_app
+    from app.config import Config
+    from app.extensions import db
+    from app.migrations import upgrade
+
+    reports = []
+    for read_model in READ_MODELS:
+        with tempfile.TemporaryDirectory() as tmp:
+            class PlanConfig(Config):
+                SQLALCHEMY_DATABASE_URI = database_url or f'sqlite:///{os.path.join(tmp, "plans.db")}'
+                READ_MODEL = read_model
+                FLAT_TABLE_SYNC = True
+
+            app = create_app(PlanConfig)
+            with app.app_context():
+                upgrade(db.engine, db.metadata)
+                client = app.test_client()
+
+                with contextlib.redirect_stdout(io.StringIO()):
+                    client.post('/api/records/batch', json=seed_records(SEED_RECORDS))
+                analyze(db.engine)
+                barcode = client.get('/api/records?limit=1').json['records'][0]['barcode']
+
+                captured = run_scenarios(client, barcode)
+                with db.engine.connect() as conn:
+                    for name, rows, statement, parameters in captured:
+                        if rows == LIMITED and ' LIMIT ' not in statement.upper():
+                            rows = FILTERED
+                        plan = explain(conn, statement, parameters)
+                        reports.append(PlanReport(name, statement, plan,
+                                                  find_full_scans(plan, conn.dialect.name, rows), read_model))
+                if database_url:
+                    # Empty the scratch database again for the next read model
+                    scratch = MetaData()
+                    scratch.reflect(db.engine)
+                    scratch.drop_all(db.engine)
+                db.session.remove()
+    return reports
@@ -0,0 +1,386 @@
+"""
+In-process columnar index for the record list filters.
+
+RangeIndex answers the filters of APIHandler.sorting_args_handler without
+the database. Voltage, resistance and capacity are kept as sorted arrays
+searched with binary search; name, color and source are dictionary encoded,
+so an equality filter is one vectorized comparison producing a row bitmap.
+The bitmaps of all filters are combined with AND.
+
+The index is optional (RANGE_INDEX_ENABLED). It is loaded in a background
+thread on first use; until then and whenever a filter can not be answered
+from memory, callers fall back to SQL. Writes of this worker are applied
+through the records_changed signal; writes of other workers are picked up
+by a reload every RANGE_INDEX_TTL seconds.
+"""
+
+import datetime
+import logging
+import threading
+import time
+
+import numpy as np
+
+from app.services.signals import ACTION_DELETE, records_changed
+
+logger = logging.getLogger(__name__)
+
+RANGE_FILTERS = {
+    'voltage': ('min_voltage', 'max_voltage'),
+    'resistance': ('min_resistance', 'max_resistance'),
+    'capacity': ('min_capacity', 'max_capacity'),
+}
+CATEGORY_FIELDS = ('name', 'color', 'source')
+NUMBER_FIELDS = ('id', 'barcode', 'datetime', 'voltage', 'resistance', 'weight', 'capacity')
+
+# Recently added rows are scanned linearly until this many have piled up
+MERGE_SIZE = 4096
+
+# Barcodes per query when re-reading changed records
+RELOAD_CHUNK_SIZE = 500
+
+
+def _number(value) -> float:
+    if value is None:
+        return np.nan
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return float(value)
+
+
+class SortedColumn:
+    """
+    A numeric column with a sorted permutation of its slots.
+
+    Slots appended after the last sort form an unsorted tail that is scanned
+    directly; the permutation is rebuilt once the tail exceeds MERGE_SIZE.
+    """
+
+    def __init__(self):
+        self.order = np.empty(0, dtype=np.int64)
+        self.sorted_values = np.empty(0)
+        self.sorted_size = 0
+
+    def sort(self, values: np.ndarray, size: int):
+        self.order = np.argsort(values[:size], kind='stable')
+        self.sorted_values = values[self.order]
+        self.sorted_size = size
+
+    def mask(self, values: np.ndarray, size: int, low: float | None, high: float | None) -> np.ndarray:
+        """
+        The slots with low < value < high; NULL values never match.
+        """
+        if size - self.sorted_size > MERGE_SIZE:
+            self.sort(values, size)
+
+        start = 0 if low is None else np.searchsorted(self.sorted_values, low, side='right')
+        # NaN sorts last, so the end of the non-NULL values bounds an open range
+        end = (np.searchsorted(self.sorted_values, high, side='left') if high is not None
+               else self.sorted_size - np.count_nonzero(np.isnan(self.sorted_values)))
+        mask = np.zeros(size, dtype=bool)
+        mask[self.order[start:end]] = True
+
+        tail = values[self.sorted_size:size]
+        matches = ~np.isnan(tail)
+        if low is not None:
+            matches &= tail > low
+        if high is not None:
+            matches &= tail < high
+        mask[self.sorted_size:size] = matches
+        return mask
+
+
+class ColumnStore:
+    """
+    The columns of all records in slots; a changed record gets a new slot.
+
+    Attributes:
+        case_insensitive (bool): Whether name, color and source compare like a
+            case-insensitive collation.
+    """
+
+    def __init__(self, case_insensitive: bool = False):
+        self.case_insensitive = case_insensitive
+        self.size = 0
+        self.dead = 0
+        self.rows = []
+        self.alive = np.empty(0, dtype=bool)
+        self.numbers = {field: np.empty(0) for field in NUMBER_FIELDS}
+        self.codes = {field: np.empty(0, dtype=np.int32) for field in CATEGORY_FIELDS}
+        self.dictionaries = {field: {} for field in CATEGORY_FIELDS}
+        self.columns = {field: SortedColumn() for field in RANGE_FILTERS}
+        self.slots = {}
+
+    def _grow(self, needed: int):
+        if needed <= len(self.alive):
+            return
+        capacity = max(needed, 2 * len(self.alive), 1024)
+        self.alive = np.resize(self.alive, capacity)
+        for field in NUMBER_FIELDS:
+            self.numbers[field] = np.resize(self.numbers[field], capacity)
+        for field in CATEGORY_FIELDS:
+            self.codes[field] = np.resize(self.codes[field], capacity)
+
+    def _code(self, field: str, value) -> int:
+        if value is None:
+            return -1
+        dictionary = self.dictionaries[field]
+        code = dictionary.get(value)
+        if code is None:
+            code = dictionary[value] = len(dictionary)
+        return code
+
+    def insert(self, rows: list):
+        """
+        Add rows of Database.query_to_db(); existing records with the same barcode are replaced.
+        """
+        self.remove([row.barcode for row in rows])
+        start, end = self.size, self.size + len(rows)
+        self._grow(end)
+        self.alive[start:end] = True
+        for field in NUMBER_FIELDS:
+            self.numbers[field][start:end] = [_number(getattr(row, field)) for row in rows]
+        for field in CATEGORY_FIELDS:
+            self.codes[field][start:end] = [self._code(field, getattr(row, field)) for row in rows]
+        for slot, row in enumerate(rows, start):
+            self.slots[row.barcode] = slot
+        self.rows.extend(rows)
+        self.size = end
+
+    def remove(self, barcodes):
+        for barcode in barcodes:
+            slot = self.slots.pop(int(barcode), None)
+            if slot is not None:
+                self.alive[slot] = False
+                self.rows[slot] = None
+                self.dead += 1
+
+    def sort_columns(self):
+        for field, column in self.columns.items():
+            column.sort(self.numbers[field], self.size)
+
+    def compacted(self) -> 'ColumnStore':
+        store = ColumnStore(self.case_insensitive)
+        store.insert([row for row in self.rows if row is not None])
+        store.sort_columns()
+        return store
+
+    def _category_codes(self, field: str, value: str) -> list[int]:
+        dictionary = self.dictionaries[field]
+        if not self.case_insensitive:
+            return [dictionary[value]] if value in dictionary else []
+        value = value.casefold()
+        return [code for key, code in dictionary.items() if key.casefold() == value]
+
+    def filter(self, filters: dict) -> np.ndarray:
+        """
+        The slots of the live records matching the filters.
+
+        Args:
+            filters (dict): The arguments returned by APIHandler.filter_args.
+
+        Returns:
+            np.ndarray: The matching slots.
+
+        Raises:
+            ValueError: If a range bound is not a number.
+        """
+        mask = self.alive[:self.size].copy()
+        for field, (low_arg, high_arg) in RANGE_FILTERS.items():
+            low, high = filters.get(low_arg), filters.get(high_arg)
+            if low is None and high is None:
+                continue
+            low = None if low is None else float(low)
+            high = None if high is None else float(high)
+            mask &= self.columns[field].mask(self.numbers[field], self.size, low, high)
+        for field in CATEGORY_FIELDS:
+            if field in filters:
+                mask &= np.isin(self.codes[field][:self.size], self._category_codes(field, filters[field]))
+        return np.flatnonzero(mask)
+
+    def sort(self, slots: np.ndarray, sort_by: str, descending: bool) -> np.ndarray:
+        """
+        Order slots like Database.order_clauses: NULLs first, ties broken by id.
+        """
+        ids = self.numbers['id'][slots]
+        if sort_by == 'id':
+            order = np.argsort(ids, kind='stable')
+        elif sort_by in CATEGORY_FIELDS:
+            dictionary = self.dictionaries[sort_by]
+            ranks = np.empty(len(dictionary) + 1, dtype=np.int64)
+            # Code -1 (NULL) indexes the last entry and ranks before every value
+            ranks[-1] = -1
+            ranks[[dictionary[key] for key in sorted(dictionary)]] = np.arange(len(dictionary))
+            order = np.lexsort((ids, ranks[self.codes[sort_by][slots]]))
+        else:
+            keys = self.numbers[sort_by][slots]
+            nulls = np.isnan(keys)
+            order = np.lexsort((ids, np.where(nulls, 0, keys), ~nulls))
+        order = slots[order]
+        return order[::-1] if descending else order
+
+
+class RangeIndex:
+    """
+    Per-worker filter index with SQL fallback.
+
+    Attributes:
+        enabled (bool): Whether the index is used at all.
+        ttl (int): The seconds after which the index is reloaded from the database.
+    """
+
+    def __init__(self, ttl: int = 300):
+        self.enabled = False
+        self.ttl = ttl
+        self._app = None
+        self._store = None
+        self._loaded_at = None
+        self._loading = False
+        self._pending = []
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        """
+        Read the index settings and subscribe the index to record changes of the application.
+
+        Args:
+            app: The Flask application.
+        """
+        self.enabled = app.config.get('RANGE_INDEX_ENABLED', False)
+        self.ttl = app.config.get('RANGE_INDEX_TTL', self.ttl)
+        app.extensions['range_index'] = self
+        if self.enabled:
+            self._app = app
+            records_changed.connect(self._on_records_changed, app, weak=False)
+
+    @property
+    def ready(self) -> bool:
+        return self._store is not None
+
+    def warm_up(self, wait: bool = False):
+        """
+        Start loading the index in a background thread unless it is fresh or already loading.
+
+        Args:
+            wait (bool): Load in the calling thread instead.
+        """
+        with self._lock:
+            fresh = self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+            if not self.enabled or self._loading or fresh:
+                return
+            self._loading = True
+            self._pending = []
+        if wait:
+            self._load()
+        else:
+            threading.Thread(target=self._load, name='range-index-loader', daemon=True).start()
+
+    @staticmethod
+    def _read(barcodes: list[int] | None = None) -> list:
+        from app.services.db import Database
+
+        query = Database.query_to_db()
+        if barcodes is None:
+            return query.all()
+        column = Database.read_columns()['barcode']
+        rows = []
+        for start in range(0, len(barcodes), RELOAD_CHUNK_SIZE):
+            rows += query.filter(column.in_(barcodes[start:start + RELOAD_CHUNK_SIZE])).all()
+        return rows
+
+    def _load(self):
+        from app.extensions import db
+
+        started = time.perf_counter()
+        try:
+            with self._app.app_context():
+                store = ColumnStore(case_insensitive=db.engine.dialect.name == 'mysql')
+                store.insert(self._read())
+                store.sort_columns()
+                with self._lock:
+                    # Apply the writes committed while the snapshot was read
+                    for action, barcodes in self._pending:
+                        self._apply(store, action, barcodes)
+                    self._store = store
+                    self._loaded_at = time.monotonic()
+                db.session.remove()
+            logger.info('range index loaded', extra={'records': len(store.slots),
+                                                     'seconds': round(time.perf_counter() - started, 3)})
+        except Exception:
+            logger.exception('range index load failed')
+        finally:
+            with self._lock:
+                self._loading = False
+                self._pending = []
+
+    def _apply(self, store: ColumnStore, action: str, barcodes: list[int]):
+        store.remove(barcodes)
+        if action != ACTION_DELETE:
+            store.insert(self._read(barcodes))
+
+    def _on_records_changed(self, sender, action: str, barcodes: list[int]):
+        with self._lock:
+            if self._loading:
+                self._pending.append((action, barcodes))
+            if self._store is None:
+                return
+            self._apply(self._store, action, barcodes)
+            if self._store.dead > self._store.size // 4:
+                self._store = self._store.compacted()
+
+    def _slots(self, filters: dict) -> tuple[ColumnStore, np.ndarray] | None:
+        if not self.enabled:
+            return None
+        self.warm_up()
+        store = self._store
+        if store is None:
+            return None
+        try:
+            return store, store.filter(filters)
+        except ValueError:
+            # Let the database handle bounds that are not numbers
+            return None
+
+    def rows(self, filters: dict, sort_by: str = 'id', order_by: str = 'asc') -> list | None:
+        """
+        The sorted rows matching the filters, or None if SQL has to answer.
+
+        Args:
+            filters (dict): The arguments returned by APIHandler.filter_args.
+            sort_by (str): The sort column name.
+            order_by (str): 'asc' or 'desc'.
+
+        Returns:
+            list | None: Rows in the format of Database.query_to_db().
+        """
+        with self._lock:
+            found = self._slots(filters)
+            if found is None:
+                return None
+            store, slots = found
+            # Only the binary collation of SQLite orders strings like Python
+            if sort_by in CATEGORY_FIELDS and store.case_insensitive:
+                return None
+            return [store.rows[slot] for slot in store.sort(slots, sort_by, order_by == 'desc')]
+
+    def barcodes(self, filters: dict) -> list[int] | None:
+        """
+        The sorted barcodes of the records matching the filters, or None if SQL has to answer.
+        """
+        with self._lock:
+            found = self._slots(filters)
+            if found is None:
+                return None
+            store, slots = found
+            return np.sort(store.numbers['barcode'][slots]).astype(np.int64).tolist()
+
+    def stats(self) -> dict:
+        with self._lock:
+            store = self._store
+            return {'enabled': self.enabled,
+                    'ready': store is not None,
+                    'loading': self._loading,
+                    'records': len(store.slots) if store else 0}
+
+
+range_index = RangeIndex()
@@ -0,0 +1,259 @@
+"""
+Routing of record reads to read replicas.
+
+Replicas are Flask-SQLAlchemy binds named 'replica0', 'replica1', ... built
+from DATABASE_REPLICA_URLS. The queries of Database.query_to_db() run on
+Database.read_session(), which is a session on a healthy replica for GET and
+HEAD requests and db.session, the primary, for everything else: writes,
+reads inside write requests and background jobs, which follow writes.
+
+A client that wrote gets a cookie that sends its reads to the primary for
+READ_YOUR_WRITES_SECONDS, so it sees its own writes.
+
+A thread per worker checks the replicas every REPLICA_CHECK_SECONDS: it
+updates the heartbeat row on the primary and reads it on every replica. A
+replica whose heartbeat is more than REPLICA_MAX_LAG seconds old, or that
+can not be queried, is skipped until a later check finds it healthy again;
+a failing replica query marks it down at once and runs again on the
+primary, so a replica going down does not fail the request. The lag is measured with the
+resolution of the check interval. Without a healthy replica reads go to the
+primary. With REPLICA_MAX_LAG set to 0 the lag is not checked, which allows
+two unreplicated local databases, e.g. two SQLite files, as primary and replica.
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from flask import g, has_request_context, request
+from sqlalchemy import event, insert, select, text, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models.records import ReplicaHeartbeat
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND_PREFIX = 'replica'
+READ_PRIMARY_COOKIE = 'read_primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+
+@dataclass
+class ReplicaState:
+    healthy: bool = False
+    lag: float | None = None
+    error: str | None = None
+    checked_at: float | None = None
+
+
+class ReplicaSession(Session):
+    """
+    A session on a read replica that runs its statements on the primary once a statement failed on the replica.
+
+    Attributes:
+        key (str): The bind key of the replica.
+        failed (bool): Whether a statement failed and the session reads from the primary.
+    """
+
+    def __init__(self, key: str):
+        super().__init__(db.engines[key])
+        self.key = key
+        self.failed = False
+
+    def _run(self, method: str, statement, *args, **kwargs):
+        if not self.failed:
+            try:
+                return getattr(super(), method)(statement, *args, **kwargs)
+            except DBAPIError as ex:
+                # The handle_error listener has marked the replica down
+                self.rollback()
+                self.failed = True
+                logger.warning('replica read failed, reading from the primary',
+                               extra={'replica': self.key, 'error': str(ex.orig)})
+        return getattr(db.session, method)(statement, *args, **kwargs)
+
+    def execute(self, statement, *args, **kwargs):
+        return self._run('execute', statement, *args, **kwargs)
+
+    def scalars(self, statement, *args, **kwargs):
+        return self._run('scalars', statement, *args, **kwargs)
+
+    def scalar(self, statement, *args, **kwargs):
+        return self._run('scalar', statement, *args, **kwargs)
+
+
+class ReplicaRouter:
+    """
+    Chooses the database of the reads of a request.
+
+    Attributes:
+        binds (list[str]): The bind keys of the replicas.
+        max_lag (float): The largest replication lag in seconds of a replica that serves reads; 0 disables the check.
+        check_interval (float): The seconds between two health checks.
+        read_your_writes (int): The seconds a client reads from the primary after it wrote.
+    """
+
+    def __init__(self):
+        self.binds = []
+        self.max_lag = 5.0
+        self.check_interval = 1.0
+        self.read_your_writes = 5
+        self.states = {}
+        self._app = None
+        self._pid = None
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Read the replica settings, watch the replica engines for errors and set the read-your-writes cookie.
+
+        Args:
+            app: The Flask application.
+        """
+        binds = app.config.get('SQLALCHEMY_BINDS') or {}
+        self.binds = sorted(key for key in binds if key.startswith(REPLICA_BIND_PREFIX))
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', self.max_lag)
+        self.check_interval = app.config.get('REPLICA_CHECK_SECONDS', self.check_interval)
+        self.read_your_writes = app.config.get('READ_YOUR_WRITES_SECONDS', self.read_your_writes)
+        self.states = {key: ReplicaState() for key in self.binds}
+        app.extensions['replica_router'] = self
+        if not self.binds:
+            return
+
+        self._app = app
+        app.after_request(self._after_request)
+        app.teardown_appcontext(self._close_session)
+        with app.app_context():
+            for key in self.binds:
+                event.listen(db.engines[key], 'handle_error', self._on_error(key))
+
+    def _on_error(self, key: str):
+        def mark_down(context):
+            if not self.states[key].healthy:
+                return
+            self.states[key] = ReplicaState(healthy=False, error=str(context.original_exception),
+                                            checked_at=time.time())
+            logger.warning('replica marked down', extra={'replica': key, 'error': str(context.original_exception)})
+        return mark_down
+
+    def _after_request(self, response):
+        if request.method not in READ_METHODS and response.status_code < 400 and self.read_your_writes:
+            response.set_cookie(READ_PRIMARY_COOKIE, str(int(time.time() + self.read_your_writes)),
+                                max_age=self.read_your_writes, httponly=True, samesite='Lax')
+        return response
+
+    def _close_session(self, exception=None):
+        session = g.pop('replica_session', None)
+        if session is not None:
+            session.close()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._loop, name='replica-check', daemon=True).start()
+
+    def _loop(self):
+        while True:
+            try:
+                with self._app.app_context():
+                    self.check()
+            except Exception:
+                logger.exception('replica check failed')
+            time.sleep(self.check_interval)
+
+    def _beat(self) -> int:
+        beat_ms = int(time.time() * 1000)
+        with db.engine.begin() as conn:
+            beaten = conn.execute(update(ReplicaHeartbeat).where(ReplicaHeartbeat.id == 1)
+                                  .values(beat_ms=beat_ms)).rowcount
+            if not beaten:
+                conn.execute(insert(ReplicaHeartbeat).values(id=1, beat_ms=beat_ms))
+        return beat_ms
+
+    def check(self) -> dict[str, ReplicaState]:
+        """
+        Measure the availability and lag of every replica.
+
+        Returns:
+            dict[str, ReplicaState]: The new state of each replica by bind key.
+        """
+        beat_ms = self._beat() if self.max_lag else None
+        for key in self.binds:
+            started = time.time()
+            try:
+                with db.engines[key].connect() as conn:
+                    if beat_ms is None:
+                        conn.execute(text('SELECT 1'))
+                        lag = None
+                    else:
+                        replica_ms = conn.execute(select(ReplicaHeartbeat.beat_ms)
+                                                  .where(ReplicaHeartbeat.id == 1)).scalar()
+                        if replica_ms is None:
+                            raise LookupError('No heartbeat row on the replica')
+                        lag = 0.0 if replica_ms >= beat_ms else round(started - replica_ms / 1000, 3)
+                state = ReplicaState(healthy=lag is None or lag <= self.max_lag, lag=lag, checked_at=started)
+            except Exception as ex:
+                state = ReplicaState(healthy=False, error=str(ex), checked_at=started)
+            if state.healthy != self.states[key].healthy:
+                logger.info('replica state changed', extra={'replica': key, 'healthy': state.healthy,
+                                                            'lag': state.lag, 'error': state.error})
+            self.states[key] = state
+        return self.states
+
+    @staticmethod
+    def reads_primary() -> bool:
+        """
+        Whether the client of the current request wrote recently and must read from the primary.
+        """
+        if not has_request_context():
+            return False
+        read_primary_until = request.cookies.get(READ_PRIMARY_COOKIE, '')
+        return read_primary_until.isdigit() and int(read_primary_until) > time.time()
+
+    @staticmethod
+    def used_replica() -> bool:
+        """
+        Whether reads of the current request were routed to a replica, so they may miss recent writes.
+        """
+        return has_request_context() and 'replica_session' in g
+
+    def replica_key(self) -> str | None:
+        """
+        The bind key of the replica the reads of the current request go to, or None for the primary.
+        """
+        if not self.binds or not has_request_context() or request.method not in READ_METHODS:
+            return None
+        if self.reads_primary():
+            return None
+
+        self._start()
+        healthy = [key for key in self.binds if self.states[key].healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    def session(self) -> Session:
+        """
+        The session for the record reads of the current request.
+
+        Returns:
+            Session: A ReplicaSession that lives until the end of the request, or db.session.
+        """
+        if 'replica_session' in g:
+            return g.replica_session
+        key = self.replica_key()
+        if key is None:
+            return db.session
+        g.replica_session = ReplicaSession(key)
+        return g.replica_session
+
+
+replica_router = ReplicaRouter()
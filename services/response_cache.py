@@ -0,0 +1,227 @@
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Callable, Iterable
+
+from flask import Response, current_app, request
+
+from app.services.change_feed import change_feed
+from app.services.dimension_cache import LRUCache
+from app.services.replica import replica_router
+from app.services.signals import changes_received, records_changed
+
+logger = logging.getLogger(__name__)
+
+LIST_TAG = 'list'
+
+
+def barcode_tag(barcode) -> str:
+    barcode = str(barcode).strip()
+    return f'barcode:{int(barcode) if barcode.isdigit() else barcode}'
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    status: int
+    mimetype: str
+    etag: str
+    expires_at: float
+    tags: tuple = field(default_factory=tuple)
+
+
+class CacheBackend:
+    """
+    Interface of a response cache store.
+
+    A shared store (for example Redis) can be plugged in by implementing these methods
+    and passing an instance to ResponseCache.init_app.
+    """
+
+    def get(self, key: str) -> CacheEntry | None:
+        raise NotImplementedError
+
+    def set(self, key: str, entry: CacheEntry, generation: int):
+        """
+        Store an entry unless an invalidation happened since `generation` was read.
+        """
+        raise NotImplementedError
+
+    def generation(self) -> int:
+        """
+        A counter that changes on every invalidation.
+        """
+        raise NotImplementedError
+
+    def invalidate(self, tags: Iterable[str]):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    In-process response store with TTL expiry and LRU eviction.
+
+    Attributes:
+        maxsize (int): The maximum number of cached responses.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self._entries = LRUCache(maxsize)
+        self._tags = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CacheEntry | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self._entries.pop(key)
+            return None
+        return entry
+
+    def set(self, key: str, entry: CacheEntry, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries.set(key, entry)
+            for tag in entry.tags:
+                self._tags.setdefault(tag, set()).add(key)
+            if len(self._tags) > 2 * self._entries.maxsize:
+                self._prune_tags()
+
+    def _prune_tags(self):
+        for tag in list(self._tags):
+            keys = {key for key in self._tags[tag] if self._entries.get(key) is not None}
+            if keys:
+                self._tags[tag] = keys
+            else:
+                del self._tags[tag]
+
+    def generation(self) -> int:
+        return self._generation
+
+    def invalidate(self, tags: Iterable[str]):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._entries.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+
+class ResponseCache:
+    """
+    Caches rendered JSON responses of read endpoints and answers conditional
+    requests with 304 Not Modified.
+
+    Entries are keyed by the request path and its normalized query arguments and
+    tagged with the data they depend on. The records_changed signal invalidates
+    the list entries on every write and the entries of the written barcodes.
+    With several workers (WEB_CONCURRENCY) the writes of the other workers
+    arrive as the changes_received signal of the 'db' change feed, so a worker
+    serves an older response for at most CHANGE_FEED_POLL_MS after a write;
+    without the change feed the cache is turned off. The cache is off unless
+    RESPONSE_CACHE_ENABLED is set.
+
+    Only responses that go through the cache carry an ETag, so a 304 is answered
+    from a cached entry without running the view. Without the cache the view
+    would have to run to compare the ETag, so no ETag is sent.
+
+    Responses read from a replica are not stored: the replica may not have
+    applied a write yet whose invalidation already happened. Clients with the
+    read-your-writes cookie of the replica router bypass the cache.
+    """
+
+    def __init__(self, backend: CacheBackend | None = None):
+        self.backend = backend or MemoryCacheBackend()
+        self.enabled = False
+        self.ttl = 10
+        self.follow_feed = False
+
+    def init_app(self, app, backend: CacheBackend | None = None):
+        """
+        Configure the cache and subscribe it to record changes of the application and,
+        with several workers, to the changes of the others read by the change feed.
+
+        Args:
+            app: The Flask application.
+            backend (CacheBackend | None): A custom store; the in-process store by default.
+        """
+        self.enabled = app.config.get('RESPONSE_CACHE_ENABLED', self.enabled)
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', self.ttl)
+        self.backend = backend or MemoryCacheBackend(app.config.get('RESPONSE_CACHE_SIZE', 1024))
+        app.extensions['response_cache'] = self
+        records_changed.connect(self._on_records_changed, app, weak=False)
+
+        self.follow_feed = self.enabled and app.config.get('WEB_CONCURRENCY', 1) > 1
+        if not self.follow_feed:
+            return
+        if app.config.get('CHANGE_FEED_ENABLED') and app.config.get('CHANGE_FEED_BACKEND') == 'db':
+            changes_received.connect(self._on_records_changed, app, weak=False)
+        else:
+            logger.warning('response cache disabled: several workers need the db change feed to invalidate it')
+            self.enabled = self.follow_feed = False
+
+    def _on_records_changed(self, sender, action: str, barcodes: list[int]):
+        self.backend.invalidate([LIST_TAG] + [barcode_tag(barcode) for barcode in barcodes])
+
+    @staticmethod
+    def make_key(path: str, args) -> str:
+        items = sorted((key, value) for key in args for value in args.getlist(key))
+        return path + '?' + '&'.join(f'{key}={value}' for key, value in items)
+
+    def cached(self, tags: Callable[..., list[str]]):
+        """
+        Decorate a view so its successful responses are cached and carry an ETag.
+
+        When the cache is off or bypassed the view runs as if undecorated.
+
+        Args:
+            tags: A function of the view arguments returning the tags of the response.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = self.make_key(request.path, request.args)
+                use_cache = self.enabled and not replica_router.reads_primary()
+                if not use_cache:
+                    return view(*args, **kwargs)
+                if self.follow_feed:
+                    change_feed.start()
+                entry = self.backend.get(key)
+
+                if entry is None:
+                    generation = self.backend.generation()
+                    response = current_app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    entry = CacheEntry(body=body,
+                                       status=response.status_code,
+                                       mimetype=response.mimetype,
+                                       etag=hashlib.sha1(body).hexdigest(),
+                                       expires_at=time.monotonic() + self.ttl,
+                                       tags=tuple(tags(*args, **kwargs)))
+                    if not replica_router.used_replica():
+                        self.backend.set(key, entry, generation)
+
+                response = Response(entry.body, status=entry.status, mimetype=entry.mimetype)
+                response.set_etag(entry.etag)
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+
+response_cache = ResponseCache()
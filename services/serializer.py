@@ -0,0 +1,164 @@
+"""
+Fast JSON encoding of record rows.
+
+RowEncoder turns the rows of Database.query_to_db() straight into JSON text.
+The output is byte-for-byte what jsonify() produces for the dictionaries built
+by Database.serialize_record, without building the dictionaries first.
+"""
+
+import datetime
+import json
+from json.encoder import encode_basestring_ascii
+from typing import Iterable
+
+from werkzeug.http import http_date
+
+RECORD_FIELDS = ('id', 'barcode', 'datetime', 'name', 'color', 'voltage',
+                 'resistance', 'source', 'weight', 'capacity')
+
+UNKNOWN = '"Unknown"'
+
+
+def _int(value) -> str:
+    return int.__repr__(int(value))
+
+
+def _float(value) -> str:
+    return float.__repr__(float(value))
+
+
+def _float_or_unknown(value) -> str:
+    return UNKNOWN if value is None else float.__repr__(float(value))
+
+
+def _int_or_unknown(value) -> str:
+    return UNKNOWN if value is None else int.__repr__(int(value))
+
+
+def _str_or_unknown(value) -> str:
+    return UNKNOWN if value is None else encode_basestring_ascii(value)
+
+
+def _str_or_null(value) -> str:
+    return 'null' if value is None else encode_basestring_ascii(value)
+
+
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _datetime(value) -> str:
+    if value is None:
+        return 'null'
+    if type(value) is not datetime.datetime or value.tzinfo is not None:
+        return '"' + http_date(value) + '"'
+    # Naive datetimes are UTC, formatted like werkzeug.http.http_date
+    return '"%s, %02d %s %04d %02d:%02d:%02d GMT"' % (
+        _WEEKDAYS[value.weekday()], value.day, _MONTHS[value.month - 1], value.year,
+        value.hour, value.minute, value.second)
+
+
+FORMATTERS = {
+    'id': _int,
+    'barcode': _int,
+    'datetime': _datetime,
+    'name': _str_or_unknown,
+    'color': _str_or_null,
+    'voltage': _float,
+    'resistance': _float,
+    'source': _str_or_unknown,
+    'weight': _float_or_unknown,
+    'capacity': _int_or_unknown,
+}
+
+
+class RowEncoder:
+    """
+    Encoder compiled for a fixed column order of the record rows.
+
+    The object template and the per-column formatters are resolved once, so
+    encoding a row is a single string formatting call over tuple indexes.
+
+    Attributes:
+        columns (tuple): The column order of the rows to encode.
+    """
+
+    def __init__(self, columns: Iterable[str] = RECORD_FIELDS):
+        self.columns = tuple(columns)
+        positions = {name: index for index, name in enumerate(self.columns)}
+        keys = sorted(FORMATTERS)
+
+        template = '{' + ','.join(f'"{key}":%s' for key in keys) + '}'
+        values = ', '.join(f'_{key}(row[{positions[key]}])' for key in keys)
+        namespace = {f'_{key}': FORMATTERS[key] for key in keys}
+        exec(f'def encode_object(row):\n    return {template!r} % ({values},)', namespace)
+        exec(f'def encode_values(row):\n    return "[" + ",".join(({values},)) + "]"', namespace)
+
+        self.encode_row = namespace['encode_object']
+        self.encode_values = namespace['encode_values']
+        self.columns_header = '[' + ','.join(f'"{key}"' for key in keys) + ']'
+
+    def encode_rows(self, rows: Iterable) -> str:
+        """
+        Encode rows as a JSON array of record objects.
+
+        Args:
+            rows: The rows of the read query.
+
+        Returns:
+            str: The JSON text.
+        """
+        encode_row = self.encode_row
+        return '[' + ','.join([encode_row(row) for row in rows]) + ']'
+
+    def encode_columnar(self, rows: Iterable) -> str:
+        """
+        Encode rows in the columnar shape {"columns": [...], "rows": [[...], ...]}.
+
+        Args:
+            rows: The rows of the read query.
+
+        Returns:
+            str: The JSON text.
+        """
+        return '{"columns":' + self.columns_header + ',"rows":' + self._encode_values_list(rows) + '}'
+
+    def _encode_values_list(self, rows: Iterable) -> str:
+        encode_values = self.encode_values
+        return '[' + ','.join([encode_values(row) for row in rows]) + ']'
+
+    def encode(self, rows: Iterable, shape: str = 'records') -> str:
+        """
+        Encode rows in the requested response shape.
+
+        Args:
+            rows: The rows of the read query.
+            shape (str): 'records' or 'columns'.
+
+        Returns:
+            str: The JSON text.
+        """
+        if shape == 'columns':
+            return self.encode_columnar(rows)
+        return self.encode_rows(rows)
+
+    def encode_page(self, rows: Iterable, shape: str, next_cursor: str | None, prev_cursor: str | None) -> str:
+        """
+        Encode one page of Database.get_rows_page with its cursors.
+
+        Args:
+            rows: The rows of the page.
+            shape (str): 'records' or 'columns'.
+            next_cursor (str | None): The cursor of the next page.
+            prev_cursor (str | None): The cursor of the previous page.
+
+        Returns:
+            str: The JSON text.
+        """
+        cursors = f'"next_cursor":{json.dumps(next_cursor)},"prev_cursor":{json.dumps(prev_cursor)}'
+        if shape == 'columns':
+            return '{"columns":' + self.columns_header + ',' + cursors + ',"rows":' + self._encode_values_list(rows) + '}'
+        return '{' + cursors + ',"records":' + self.encode_rows(rows) + '}'
+
+
+row_encoder = RowEncoder()
@@ -0,0 +1,26 @@
+"""
+Signals sent by the Database service after a write was committed.
+
+Receivers get the sender application and the keyword arguments:
+
+- action (str): 'create', 'update' or 'delete'
+- barcodes (list[int]): the barcodes of the changed records
+
+Example:
+    records_changed.connect(receiver, app)
+
+changes_received is sent with the same arguments by the publisher thread of
+the 'db' change feed for every write it reads from the change log, which
+includes the writes of the other workers.
+"""
+
+from blinker import Namespace
+
+ACTION_CREATE = 'create'
+ACTION_UPDATE = 'update'
+ACTION_DELETE = 'delete'
+
+signals = Namespace()
+
+records_changed = signals.signal('records-changed')
+changes_received = signals.signal('changes-received')
@@ -0,0 +1,244 @@
+"""
+Nearest-neighbour search for replacement cells.
+
+SimilarityIndex keeps the capacity, resistance, voltage and weight of every
+cell in memory, normalized by their standard deviation, and buckets the cells
+in a uniform grid over capacity, resistance and voltage. A query visits the
+grid cells in rings around the target until no unvisited cell can hold a
+closer match.
+
+The index is loaded on the first query and follows the records_changed
+signal afterwards. It only sees the writes of its own worker, so it is fully
+reloaded every SIMILARITY_INDEX_TTL seconds.
+"""
+
+import itertools
+import threading
+import time
+
+import numpy as np
+
+from app.services.signals import ACTION_DELETE, records_changed
+
+FEATURES = ('capacity', 'resistance', 'voltage', 'weight')
+
+# The features that place a cell in the grid; cells without a capacity are not indexed
+GRID_FEATURES = 3
+
+# The distance contributed by a feature the cell has no value for, in standard deviations
+MISSING_PENALTY = 1.0
+
+# Rings visited before falling back to scanning all cells
+MAX_RING = 6
+
+# Barcodes per query when reloading changed cells
+RELOAD_CHUNK_SIZE = 500
+
+
+def _ring_offsets(radius: int) -> np.ndarray:
+    """
+    The grid offsets at Chebyshev distance `radius`.
+    """
+    if radius == 0:
+        return np.zeros((1, GRID_FEATURES), dtype=np.int64)
+    axis = range(-radius, radius + 1)
+    return np.array([offset for offset in itertools.product(axis, repeat=GRID_FEATURES)
+                     if max(abs(value) for value in offset) == radius], dtype=np.int64)
+
+
+class SimilarityIndex:
+    """
+    Grid index of the cell parameters of one worker.
+
+    Attributes:
+        cell_size (float): The edge of a grid cell in standard deviations.
+        ttl (int): The seconds after which the index is reloaded from the database.
+    """
+
+    def __init__(self, cell_size: float = 0.25, ttl: int = 300):
+        self.cell_size = cell_size
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._rings = [_ring_offsets(radius) for radius in range(MAX_RING + 1)]
+        self._clear()
+
+    def _clear(self):
+        self._loaded_at = None
+        self._scale = np.ones(len(FEATURES))
+        self._values = np.empty((0, len(FEATURES)))
+        self._barcodes = np.empty(0, dtype=np.int64)
+        self._alive = np.empty(0, dtype=bool)
+        self._size = 0
+        self._positions = {}
+        self._grid = {}
+
+    def init_app(self, app):
+        """
+        Read the index settings and subscribe the index to record changes of the application.
+
+        Args:
+            app: The Flask application.
+        """
+        self.cell_size = app.config.get('SIMILARITY_CELL_SIZE', self.cell_size)
+        self.ttl = app.config.get('SIMILARITY_INDEX_TTL', self.ttl)
+        # Cells loaded for an earlier application may come from another database
+        with self._lock:
+            self._clear()
+        app.extensions['similarity_index'] = self
+        records_changed.connect(self._on_records_changed, app, weak=False)
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    @staticmethod
+    def _read(conditions: list) -> list:
+        from app.services.db import Database
+
+        columns = Database.read_columns()
+        conditions = conditions + [columns['capacity'].isnot(None)]
+        return Database.get_field_rows(conditions, ['barcode', *FEATURES])
+
+    @staticmethod
+    def _to_array(rows: list) -> tuple[np.ndarray, np.ndarray]:
+        barcodes = np.array([row[0] for row in rows], dtype=np.int64)
+        values = np.array([[np.nan if value is None else float(value) for value in row[1:]] for row in rows],
+                          dtype=np.float64).reshape(len(rows), len(FEATURES))
+        return barcodes, values
+
+    def load(self):
+        """
+        Load all cells from the database and rebuild the grid.
+        """
+        barcodes, values = self._to_array(self._read([]))
+        with self._lock:
+            self._clear()
+            scale = np.nanstd(values, axis=0) if len(values) else np.ones(len(FEATURES))
+            self._scale = np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+            self._insert(barcodes, values)
+            self._loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def _cell(self, normalized: np.ndarray) -> tuple:
+        return tuple(np.floor(normalized[:GRID_FEATURES] / self.cell_size).astype(np.int64).tolist())
+
+    def _insert(self, barcodes: np.ndarray, values: np.ndarray):
+        needed = self._size + len(barcodes)
+        if needed > len(self._barcodes):
+            capacity = max(needed, 2 * len(self._barcodes), 1024)
+            self._values = np.resize(self._values, (capacity, len(FEATURES)))
+            self._barcodes = np.resize(self._barcodes, capacity)
+            self._alive = np.resize(self._alive, capacity)
+
+        normalized = values / self._scale
+        start = self._size
+        self._values[start:needed] = normalized
+        self._barcodes[start:needed] = barcodes
+        self._alive[start:needed] = True
+        cells = np.floor(normalized[:, :GRID_FEATURES] / self.cell_size).astype(np.int64)
+        for position, barcode, cell in zip(range(start, needed), barcodes.tolist(), map(tuple, cells.tolist())):
+            self._positions[barcode] = position
+            self._grid.setdefault(cell, []).append(position)
+        self._size = needed
+
+    def _remove(self, barcodes):
+        for barcode in barcodes:
+            position = self._positions.pop(int(barcode), None)
+            if position is None:
+                continue
+            self._alive[position] = False
+            cell = self._cell(self._values[position])
+            members = self._grid.get(cell)
+            if members is not None:
+                members.remove(position)
+                if not members:
+                    del self._grid[cell]
+
+    def _on_records_changed(self, sender, action: str, barcodes: list[int]):
+        if not self.loaded:
+            return
+        rows = []
+        if action != ACTION_DELETE:
+            from app.services.db import Database
+
+            column = Database.read_columns()['barcode']
+            for start in range(0, len(barcodes), RELOAD_CHUNK_SIZE):
+                rows += self._read([column.in_(barcodes[start:start + RELOAD_CHUNK_SIZE])])
+        with self._lock:
+            self._remove(barcodes)
+            if rows:
+                self._insert(*self._to_array(rows))
+
+    def _distances(self, positions: np.ndarray, target: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        difference = self._values[positions] - target
+        difference = np.where(np.isnan(difference), MISSING_PENALTY, difference)
+        return np.sqrt((difference * difference) @ weights)
+
+    def nearest(self, target: dict, k: int = 10, exclude: int | None = None) -> list[tuple[int, float]]:
+        """
+        Find the k cells closest to the target values.
+
+        The distance is the Euclidean distance of the values divided by their
+        standard deviation. Features missing from the target are ignored.
+
+        Args:
+            target (dict): Values for some of 'capacity', 'resistance', 'voltage' and 'weight'.
+            k (int): The number of matches.
+            exclude (int | None): A barcode left out of the result, usually the target cell.
+
+        Returns:
+            list[tuple[int, float]]: The barcodes and distances of the matches, closest first.
+        """
+        self.ensure_loaded()
+        raw = np.array([np.nan if target.get(feature) is None else float(target[feature])
+                        for feature in FEATURES])
+        weights = np.where(np.isnan(raw), 0.0, 1.0)
+        normalized = np.nan_to_num(raw / self._scale)
+
+        with self._lock:
+            wanted = k + (exclude is not None)
+            positions = None
+            if weights[:GRID_FEATURES].all():
+                positions = self._grid_search(normalized, weights, wanted)
+            if positions is None:
+                positions = np.flatnonzero(self._alive[:self._size])
+            distances = self._distances(positions, normalized, weights)
+            barcodes = self._barcodes[positions]
+
+        keep = barcodes != exclude if exclude is not None else slice(None)
+        barcodes, distances = barcodes[keep], distances[keep]
+        order = np.lexsort((barcodes, distances))[:k]
+        return [(int(barcodes[i]), round(float(distances[i]), 6)) for i in order]
+
+    def _grid_search(self, target: np.ndarray, weights: np.ndarray, k: int) -> np.ndarray | None:
+        """
+        The positions of the visited cells once they are known to hold the k nearest matches.
+
+        Returns None if the matches are further away than MAX_RING rings.
+        """
+        center = np.array(self._cell(target))
+        found = []
+        for radius, offsets in enumerate(self._rings):
+            for cell in map(tuple, (center + offsets).tolist()):
+                members = self._grid.get(cell)
+                if members:
+                    found.extend(members)
+            if len(found) >= k:
+                positions = np.array(found)
+                kth = np.partition(self._distances(positions, target, weights), k - 1)[k - 1]
+                # Cells outside the visited rings are at least radius cells away in one dimension
+                if kth <= radius * self.cell_size:
+                    return positions
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'cells': len(self._positions),
+                    'grid_cells': len(self._grid),
+                    'loaded': self.loaded}
+
+
+similarity_index = SimilarityIndex()
@@ -0,0 +1,208 @@
+"""
+Inventory statistics computed in the database.
+
+Counts, averages and histograms are GROUP BY queries over the read query of
+Database. Percentiles use ROW_NUMBER() where the backend has window
+functions and NumPy over the column values where it does not; both use the
+nearest-rank definition, so they return the same values.
+"""
+
+import math
+import sqlite3
+
+import numpy as np
+from sqlalchemy import Integer, case, cast, func
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
+
+from app.extensions import db
+from app.services.db import Database
+
+NUMERIC_FIELDS = ('voltage', 'resistance', 'capacity', 'weight')
+FACET_FIELDS = ('name', 'color', 'source')
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+# Histogram ranges per field, so histograms of different filters share their bins
+HISTOGRAM_RANGES = {
+    'voltage': (0.0, 4.5),
+    'resistance': (0.0, 200.0),
+    'capacity': (0.0, 4000.0),
+    'weight': (0.0, 0.1),
+}
+
+
+def supports_window_functions(engine) -> bool:
+    """
+    Whether the database has ROW_NUMBER() OVER (...).
+    """
+    dialect = engine.dialect
+    if dialect.name == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 25, 0)
+    if dialect.name == 'mysql':
+        version = dialect.server_version_info or (0,)
+        minimum = (10, 2) if getattr(dialect, 'is_mariadb', False) else (8, 0)
+        return tuple(version[:2]) >= minimum
+    return dialect.name in ('postgresql', 'mssql', 'oracle')
+
+
+def nearest_rank(count: int, percentile: float) -> int:
+    return max(1, math.ceil(percentile / 100 * count))
+
+
+class InventoryStats:
+    """
+    Aggregations over the filtered records.
+    """
+
+    @classmethod
+    def _base(cls, conditions: list):
+        return Database.query_to_db().filter(*conditions)
+
+    @staticmethod
+    def _sort_key(column, conditions: list):
+        """
+        The expression to sort or group a column by.
+
+        With filtering conditions the column is wrapped in a unary plus, which
+        changes no value but keeps the planner from walking the whole index of
+        the column to skip the sort; the rows are then selected through the
+        index of a condition and only those are sorted.
+        """
+        if not conditions:
+            return column
+        return UnaryExpression(column, operator=operators.custom_op('+'), type_=column.type)
+
+    @classmethod
+    def summary(cls, conditions: list) -> dict:
+        """
+        Count, min, max and mean of every numeric field.
+        """
+        columns = Database.read_columns()
+        entities = [func.count(columns['id'])]
+        for field in NUMERIC_FIELDS:
+            column = columns[field]
+            entities += [func.count(column), func.min(column), func.max(column), func.avg(column)]
+        row = cls._base(conditions).with_entities(*entities).one()
+
+        result = {'count': row[0]}
+        for index, field in enumerate(NUMERIC_FIELDS):
+            count, minimum, maximum, mean = row[1 + 4 * index:5 + 4 * index]
+            result[field] = {
+                'count': count,
+                'min': float(minimum) if minimum is not None else None,
+                'max': float(maximum) if maximum is not None else None,
+                'mean': round(float(mean), 6) if mean is not None else None,
+            }
+        return result
+
+    @classmethod
+    def facets(cls, conditions: list) -> dict:
+        """
+        Record count, mean resistance and mean capacity per name, color and source.
+        """
+        columns = Database.read_columns()
+        result = {}
+        for field in FACET_FIELDS:
+            column = cls._sort_key(columns[field], conditions)
+            rows = (cls._base(conditions)
+                    .with_entities(column, func.count(columns['id']),
+                                   func.avg(columns['resistance']), func.avg(columns['capacity']))
+                    .group_by(column)
+                    .order_by(func.count(columns['id']).desc(), column)
+                    .all())
+            result[field] = [
+                {'value': value if value is not None else 'Unknown',
+                 'count': count,
+                 'mean_resistance': round(float(resistance), 3) if resistance is not None else None,
+                 'mean_capacity': round(float(capacity), 1) if capacity is not None else None}
+                for value, count, resistance, capacity in rows
+            ]
+        return result
+
+    @classmethod
+    def percentiles(cls, conditions: list, field: str, count: int, percentiles) -> dict:
+        """
+        Nearest-rank percentiles of a numeric field.
+
+        Args:
+            conditions (list): The filtering conditions.
+            field (str): The numeric field.
+            count (int): The number of non-NULL values of the field.
+            percentiles: The percentiles to compute, between 0 and 100.
+
+        Returns:
+            dict: The value of every percentile, keyed like 'p50'.
+        """
+        if not count:
+            return {f'p{p:g}': None for p in percentiles}
+
+        column = Database.read_columns()[field]
+        base = cls._base(conditions).filter(column.isnot(None))
+        ranks = {p: nearest_rank(count, p) for p in percentiles}
+
+        if supports_window_functions(db.engine):
+            ranked = base.with_entities(column.label('value'),
+                                        func.row_number().over(order_by=cls._sort_key(column, conditions)).label('rank')).subquery()
+            rows = Database.read_session().query(ranked.c.rank, ranked.c.value).filter(ranked.c.rank.in_(set(ranks.values())))
+            values = {rank: float(value) for rank, value in rows}
+            return {f'p{p:g}': values.get(rank) for p, rank in ranks.items()}
+
+        values = np.array([float(value) for value, in base.with_entities(column)])
+        return {f'p{p:g}': float(np.percentile(values, p, method='inverted_cdf')) for p in percentiles}
+
+    @classmethod
+    def histogram(cls, conditions: list, field: str, bins: int) -> dict:
+        """
+        Counts of a numeric field in equal-width bins over HISTOGRAM_RANGES.
+
+        Values outside the range are counted as 'below' and 'above'.
+        """
+        column = Database.read_columns()[field]
+        low, high = HISTOGRAM_RANGES[field]
+        width = (high - low) / bins
+
+        offset = (column - low) / width
+        # CAST truncates on SQLite, but rounds on MySQL
+        bucket = cast(offset, Integer) if db.engine.dialect.name == 'sqlite' else func.floor(offset)
+        rows = (cls._base(conditions)
+                .filter(column.isnot(None), column >= low, column <= high)
+                .with_entities(bucket, func.count())
+                .group_by(bucket)
+                .all())
+        counts = [0] * bins
+        for index, count in rows:
+            # The upper edge belongs to the last bin
+            counts[min(int(index), bins - 1)] += count
+
+        below, above = (cls._base(conditions)
+                        .with_entities(func.sum(case((column < low, 1), else_=0)),
+                                       func.sum(case((column > high, 1), else_=0)))
+                        .one())
+        return {
+            'edges': [round(low + index * width, 6) for index in range(bins + 1)],
+            'counts': counts,
+            'below': below or 0,
+            'above': above or 0,
+        }
+
+    @classmethod
+    def compute(cls, conditions: list, bins: int = 20, percentiles=DEFAULT_PERCENTILES) -> dict:
+        """
+        All statistics of the filtered records.
+
+        Args:
+            conditions (list): The filtering conditions of APIHandler.sorting_args_handler.
+            bins (int): The number of histogram bins per field.
+            percentiles: The percentiles to compute, between 0 and 100.
+
+        Returns:
+            dict: The record count, the facets and the statistics of every numeric field.
+        """
+        summary = cls.summary(conditions)
+        fields = {}
+        for field in NUMERIC_FIELDS:
+            fields[field] = dict(summary[field],
+                                 percentiles=cls.percentiles(conditions, field, summary[field]['count'], percentiles),
+                                 histogram=cls.histogram(conditions, field, bins))
+        return {'count': summary['count'], 'facets': cls.facets(conditions), 'fields': fields}
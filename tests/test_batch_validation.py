@@ -0,0 +1,82 @@
+"""
+The columnar batch validation gives the results of record_to_api_data.
+
+Run from the directory that contains the 'app' package:
+    python -m pytest app/tests
+"""
+
+from hypothesis import given, settings, strategies as st
+
+from app.services.api import APIHandler
+from app.validator.records_model import APIData
+
+FIELDS = ('name', 'color', 'resistance', 'voltage', 'source', 'capacity', 'weight')
+
+numbers = st.one_of(
+    st.integers(min_value=-10 ** 4, max_value=10 ** 4),
+    st.integers(),
+    st.floats(min_value=-10, max_value=1000),
+    st.floats(),
+    st.sampled_from([0.0, -0.0, 4.5, 4.500001, 999.99, 1000.0, 10 ** 400]),
+)
+strings = st.one_of(st.text(max_size=60), st.sampled_from(['', 'LG', 'red', 'x' * 10, 'x' * 11, 'laptop']))
+odd_values = st.one_of(st.none(), st.booleans(), st.lists(st.integers(), max_size=2),
+                       st.dictionaries(st.text(max_size=3), st.integers(), max_size=2))
+
+# Values APIData accepts, so that most records are valid and reach the range and length checks
+VALID = {
+    'name': st.text(min_size=1, max_size=10),
+    'color': st.text(min_size=2, max_size=20),
+    'source': st.text(max_size=50),
+    'resistance': st.one_of(st.floats(min_value=0.01, max_value=999.99), st.integers(1, 999)),
+    'voltage': st.one_of(st.floats(min_value=0, max_value=4.5), st.sampled_from([4.4, 4.45, 4.5])),
+    'capacity': st.one_of(st.integers(1000, 4000), st.floats(min_value=0, max_value=5000)),
+    'weight': st.one_of(st.floats(min_value=0, max_value=1), st.integers(0, 1)),
+}
+ANY = st.one_of(numbers, strings, odd_values)
+
+
+def valid_or_any(valid):
+    return st.integers(0, 7).flatmap(lambda draw: valid if draw else ANY)
+
+
+@st.composite
+def records(draw):
+    if draw(st.integers(0, 19)) == 0:
+        return draw(st.one_of(st.none(), st.lists(st.integers(), max_size=2), st.text(max_size=5)))
+    missing = draw(st.sets(st.sampled_from(FIELDS), max_size=2)) if draw(st.integers(0, 9)) == 0 else set()
+    return {field: draw(valid_or_any(VALID[field])) for field in FIELDS if field not in missing}
+
+
+barcodes = valid_or_any(st.integers(min_value=100000, max_value=999999))
+datetimes = valid_or_any(st.one_of(st.just('2024-01-31 12:00:00'),
+                                   st.datetimes().map(lambda value: str(value)[:19])))
+batches = st.integers(min_value=0, max_value=30).flatmap(
+    lambda size: st.tuples(st.lists(records(), min_size=size, max_size=size),
+                           st.lists(barcodes, min_size=size, max_size=size),
+                           st.lists(datetimes, min_size=size, max_size=size)))
+
+
+def convert(json_record, barcode, current_datetime):
+    try:
+        return APIHandler.record_to_api_data(json_record, barcode, current_datetime)
+    except Exception as ex:
+        return APIHandler.record_error(ex)
+
+
+def comparable(result):
+    # repr tells 1 from 1.0 and 0.0 from -0.0, and NaN equals NaN
+    if isinstance(result, APIData):
+        return type(result), repr(sorted(result.dict().items()))
+    return type(result), result
+
+
+@settings(max_examples=100, deadline=None)
+@given(batches)
+def test_batch_matches_record_to_api_data(batch):
+    json_records, barcodes, datetimes = batch
+    expected = [convert(*row) for row in zip(json_records, barcodes, datetimes)]
+
+    results = APIHandler.records_to_api_data(json_records, barcodes, datetimes)
+
+    assert list(map(comparable, results)) == list(map(comparable, expected))
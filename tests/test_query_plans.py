@@ -0,0 +1,29 @@
+"""
+Query plans of the API scenarios on a seeded SQLite database.
+
+Run from the directory that contains the 'app' package:
+    python -m pytest app/tests
+"""
+
+import pytest
+
+from app.services.query_plan import READ_MODELS, SCENARIOS, check_query_plans
+
+CASES = [(name, read_model) for read_model in READ_MODELS for name, *_ in SCENARIOS]
+
+
+@pytest.fixture(scope='module')
+def reports():
+    return check_query_plans()
+
+
+def test_statements_are_explained(reports):
+    explained = {(report.scenario, report.read_model) for report in reports}
+    assert explained == set(CASES)
+
+
+@pytest.mark.parametrize('scenario, read_model', CASES)
+def test_no_full_scans(reports, scenario, read_model):
+    full_scans = [(' '.join(report.statement.split()), report.full_scans) for report in reports
+                  if (report.scenario, report.read_model) == (scenario, read_model) and report.full_scans]
+    assert full_scans == []
@@ -0,0 +1,199 @@
+"""
+Columnar validation of record batches.
+
+validate_batch applies the conversions of APIHandler.record_to_api_data and
+the rules of APIData to a whole batch at once: every field is extracted into
+one column, numbers are converted and range-checked as arrays and every
+distinct string and datetime is checked once. Error objects are only built
+for the invalid records.
+
+Records whose values are not plain JSON strings and numbers (null, booleans,
+nested values, non-finite numbers) are left to the per-record path, so the
+results are the same as those of APIData for every input.
+"""
+
+import datetime
+import itertools
+
+import numpy as np
+from pydantic import ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.errors import AnyStrMaxLengthError, AnyStrMinLengthError
+
+from app.validator.records_model import APIData
+
+# The fields in the order record_to_api_data reads them from a record
+RECORD_FIELDS = ('name', 'color', 'resistance', 'voltage', 'source', 'capacity', 'weight')
+STRING_FIELDS = ('name', 'color', 'source')
+FLOAT_FIELDS = ('resistance', 'voltage', 'weight')
+
+# Upper limits of the numeric validators of APIData
+MAX_RESISTANCE = 999.99
+MAX_VOLTAGE = 4.5
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_MISSING = object()
+
+# Column value types: the records with any other type go to the per-record path
+TYPE_OTHER, TYPE_MISSING, TYPE_STR, TYPE_INT, TYPE_FLOAT = range(5)
+TYPE_CODES = {type(_MISSING): TYPE_MISSING, str: TYPE_STR, int: TYPE_INT, float: TYPE_FLOAT}
+
+
+def _length_limits(field: str) -> tuple[int | None, int | None]:
+    info = APIData.__fields__[field].field_info
+    return info.min_length, info.max_length
+
+
+STRING_LIMITS = {field: _length_limits(field) for field in STRING_FIELDS}
+
+
+def _type_codes(column: list) -> np.ndarray:
+    kinds = set(map(type, column))
+    if len(kinds) == 1:
+        return np.full(len(column), TYPE_CODES.get(kinds.pop(), TYPE_OTHER), dtype=np.int8)
+    return np.fromiter(map(TYPE_CODES.get, map(type, column), itertools.repeat(TYPE_OTHER)),
+                       dtype=np.int8, count=len(column))
+
+
+def _where(column: list, keep: np.ndarray, default) -> list:
+    """
+    The column with the values not kept replaced by a default.
+    """
+    if keep.all():
+        return column
+    return [value if kept else default for value, kept in zip(column, keep.tolist())]
+
+
+def _to_float(column: list, codes: np.ndarray, simple: np.ndarray) -> np.ndarray:
+    """
+    float() of every number, NaN for other values.
+
+    Numbers float() can not convert mark their record as not simple.
+    """
+    values = _where(column, codes >= TYPE_INT, np.nan)
+    try:
+        return np.array(values, dtype=np.float64)
+    except OverflowError:
+        result = np.empty(len(values))
+        for index, value in enumerate(values):
+            try:
+                result[index] = float(value)
+            except OverflowError:
+                result[index] = np.nan
+                simple[index] = False
+        return result
+
+
+def _invalid_datetimes(values: list) -> np.ndarray:
+    invalid = set()
+    for value in set(values):
+        try:
+            datetime.datetime.strptime(value, DATETIME_FORMAT)
+        except ValueError:
+            invalid.add(value)
+    return np.fromiter(map(invalid.__contains__, values), dtype=bool, count=len(values))
+
+
+def _lengths(column: list, codes: np.ndarray) -> np.ndarray:
+    strings = _where(column, codes == TYPE_STR, '')
+    return np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+
+
+def _length_checks(field: str, lengths: np.ndarray) -> list:
+    min_length, max_length = STRING_LIMITS[field]
+    checks = []
+    if min_length is not None:
+        checks.append((field, lengths < min_length, lambda: AnyStrMinLengthError(limit_value=min_length)))
+    if max_length is not None:
+        checks.append((field, lengths > max_length, lambda: AnyStrMaxLengthError(limit_value=max_length)))
+    return checks
+
+
+def validate_batch(json_records: list, barcodes: list[int], datetimes: list[str]) -> list:
+    """
+    Validate a batch of JSON records like record_to_api_data does one by one.
+
+    Args:
+        json_records (list): The records.
+        barcodes (list[int]): The barcode assigned to every record.
+        datetimes (list[str]): The datetime of every record.
+
+    Returns:
+        list: For every record an APIData object, the KeyError or ValidationError
+        record_to_api_data raises for it, or None if the record has to be
+        validated with record_to_api_data.
+    """
+    count = len(json_records)
+    results = [None] * count
+    if not count:
+        return results
+
+    simple = np.fromiter((type(record) is dict for record in json_records), dtype=bool, count=count)
+    records = [record if is_dict else {} for record, is_dict in zip(json_records, simple.tolist())]
+
+    columns = {field: [record.get(field, _MISSING) for record in records] for field in RECORD_FIELDS}
+    codes = {field: _type_codes(column) for field, column in columns.items()}
+    for field in STRING_FIELDS:
+        simple &= (codes[field] == TYPE_MISSING) | (codes[field] == TYPE_STR)
+    for field in (*FLOAT_FIELDS, 'capacity'):
+        simple &= (codes[field] == TYPE_MISSING) | (codes[field] >= TYPE_INT)
+    simple &= _type_codes(barcodes) == TYPE_INT
+    simple &= _type_codes(datetimes) == TYPE_STR
+
+    numbers = {field: _to_float(columns[field], codes[field], simple) for field in (*FLOAT_FIELDS, 'capacity')}
+    # int() of a capacity fails for NaN and infinity
+    simple &= (codes['capacity'] != TYPE_FLOAT) | np.isfinite(numbers['capacity'])
+    # int() truncates towards zero; adding 0.0 turns -0.0 into 0.0 like float(int(value))
+    numbers['capacity'] = np.trunc(numbers['capacity']) + 0.0
+
+    # record_to_api_data raises the KeyError of the first missing field
+    first_missing = np.full(count, -1, dtype=np.int8)
+    for index in reversed(range(len(RECORD_FIELDS))):
+        first_missing[codes[RECORD_FIELDS[index]] == TYPE_MISSING] = index
+    for index in np.flatnonzero(simple & (first_missing >= 0)).tolist():
+        results[index] = KeyError(RECORD_FIELDS[first_missing[index]])
+    complete = simple & (first_missing < 0)
+
+    # The checks of APIData in the order of its fields
+    barcode_lengths = np.fromiter(map(len, map(str, _where(barcodes, complete, 0))), dtype=np.int64, count=count)
+    checks = [('barcode', barcode_lengths != 6, lambda: ValueError('Barcode must be 6 digits long'))]
+    checks += _length_checks('name', _lengths(columns['name'], codes['name']))
+    checks += _length_checks('color', _lengths(columns['color'], codes['color']))
+    checks += [
+        ('resistance', numbers['resistance'] > MAX_RESISTANCE,
+         lambda: ValueError('Resistance must be between 0.01 and 999.99')),
+        ('voltage', numbers['voltage'] > MAX_VOLTAGE,
+         lambda: ValueError('Voltage must be between 0 and 4.5')),
+    ]
+    checks += _length_checks('source', _lengths(columns['source'], codes['source']))
+    checks.append(('datetime', _invalid_datetimes(_where(datetimes, complete, '')),
+                   lambda: ValueError('Invalid datetime format. Expected format: %Y-%m-%d %H:%M:%S')))
+
+    invalid = np.zeros(count, dtype=bool)
+    for _, mask, _ in checks:
+        mask &= complete
+        invalid |= mask
+    for index in np.flatnonzero(invalid).tolist():
+        errors = [ErrorWrapper(make_error(), loc=field) for field, mask, make_error in checks if mask[index]]
+        results[index] = ValidationError(errors, APIData)
+
+    values = {
+        'barcode': barcodes,
+        'name': columns['name'],
+        'color': columns['color'],
+        'resistance': numbers['resistance'].tolist(),
+        'voltage': numbers['voltage'].tolist(),
+        # validate_source stores an empty source as None
+        'source': [value or None for value in columns['source']],
+        'capacity': numbers['capacity'].tolist(),
+        'weight': numbers['weight'].tolist(),
+        'datetime': datetimes,
+    }
+    # The fields were validated above
+    fields = tuple(values)
+    valid = (complete & ~invalid).tolist()
+    rows = itertools.compress(zip(*values.values()), valid)
+    for index, row in zip(itertools.compress(itertools.count(), valid), rows):
+        results[index] = APIData.construct(**dict(zip(fields, row)))
+    return results
@@ -1,9 +1,20 @@
-import logging
+"""
+WSGI entry point of the BatteryHub application.
 
-from waitress import serve
+Run from the directory that contains the 'app' package:
+
+    gunicorn -c app/gunicorn.conf.py app.wsgi:app    # production server, see gunicorn.conf.py
+    python -m app.wsgi                               # single-process waitress server, e.g. on Windows
+"""
+
+import os
 
 from app import create_app
 
-logging.basicConfig(level=logging.DEBUG)
 app = create_app()
-serve(app, host='127.0.0.1', port=5011)
\ No newline at end of file
+
+if __name__ == '__main__':
+    from waitress import serve
+
+    serve(app, host=os.environ.get('HOST', '127.0.0.1'), port=int(os.environ.get('PORT', 5011)),
+          threads=app.config['WEB_THREADS'])